@@ -0,0 +1,373 @@
+#region Imports
+
+# System libraries
+import gc
+import sys
+import json
+import time
+import argparse
+import pprint
+import tempfile
+import tracemalloc
+from array import array
+
+# Third party libraries (pip)
+import numpy as np # https://numpy.org/doc/stable/
+import bson # Installed with pymongo
+
+# Custom libraries
+import idcodec
+import clients
+
+#endregion
+
+#region Constants
+
+# Twitter ids of accounts created since late 2010 are snowflake ids in this range, older accounts have sequential ids below 2^32
+SNOWFLAKE_ID_RANGE = (150 * 10 ** 15, 1600 * 10 ** 15)
+SEQUENTIAL_ID_RANGE = (1, 2 ** 32)
+SEQUENTIAL_ID_SHARE = 0.3
+
+# Graph sizes of the graph benchmark suite, in users; the propagation work is measured against the 1m graph, so every size runs by default
+GRAPH_SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+GRAPH_MEAN_FRIENDS = 20
+# Share of the most followed users seeded with a tag before propagating
+SEED_TAG_SHARE = 0.01
+SEED_TAGS = ['sports', 'entertainment', 'media', 'food', 'politics', 'fashion', 'technology', 'religion', 'travel', 'science']
+# A networkx.DiGraph takes about a kilobyte per edge, and Mongo round trips are slow, so they are only benchmarked up to this many users
+NETWORKX_MAX_USERS = 100000
+MONGO_MAX_USERS = 100000
+# Database the Mongo round trips write to, dropped afterwards
+BENCHMARK_DATABASE_NAME = 'howla_benchmark'
+
+# Timings only compare on the same hardware: the baseline is regenerated on the CI machine, with the sizes and workers CI runs, whenever a stage is added or the machine changes, e.g. python benchmarks.py graph --workers 2 --save-baseline
+BASELINE_PATH = 'benchmark_baseline.json'
+# A stage regresses when it is this much slower, or takes this much more memory, than in the baseline
+REGRESSION_TOLERANCE = 0.25
+# Stages faster than this are compared as if they took this long, so timer noise is not flagged
+MIN_COMPARED_SECONDS = 0.05
+
+#endregion
+
+def sample_adjacency_lists(number_of_lists=200, ids_per_list=5000, seed=0):
+
+  '''
+  Generates follower id lists shaped like Twitter's, a mix of old sequential ids and snowflake ids.
+
+  Keyword Arguments:
+  ===
+  number_of_lists -- the number of id lists
+  ids_per_list -- the number of ids in each list
+  seed -- the random seed
+
+  return: the list of int64 numpy arrays
+
+  '''
+
+  generator = np.random.default_rng(seed)
+  adjacency_lists = []
+  for _ in range(number_of_lists):
+    number_of_sequential_ids = generator.binomial(ids_per_list, SEQUENTIAL_ID_SHARE)
+    adjacency_lists.append(np.unique(np.concatenate((
+      generator.integers(*SEQUENTIAL_ID_RANGE, number_of_sequential_ids, dtype=np.int64),
+      generator.integers(*SNOWFLAKE_ID_RANGE, ids_per_list - number_of_sequential_ids, dtype=np.int64)
+    ))))
+  return adjacency_lists
+
+def benchmark_id_codec(number_of_lists=200, ids_per_list=5000, collection=None):
+
+  '''
+  Compares friend/follower lists encoded by idcodec with the BSON arrays and Python int lists they replace, in size and in decode throughput.
+
+  Keyword Arguments:
+  ===
+  number_of_lists -- the number of id lists
+  ids_per_list -- the number of ids in each list
+  collection -- an optional MongoDB collection to measure the read throughput of documents with BSON id arrays against; it is emptied afterwards
+
+  return: dictionary of the bytes per id of each representation, and of the decode throughputs in ids per second
+
+  '''
+
+  adjacency_lists = sample_adjacency_lists(number_of_lists, ids_per_list)
+  python_lists = [ids.tolist() for ids in adjacency_lists]
+  number_of_ids = sum(len(ids) for ids in adjacency_lists)
+
+  started_at = time.perf_counter()
+  encoded_lists = [idcodec.encode_ids(ids) for ids in python_lists]
+  encode_seconds = time.perf_counter() - started_at
+
+  started_at = time.perf_counter()
+  for encoded_ids in encoded_lists:
+    idcodec.decode_ids_to_array(encoded_ids)
+  decode_seconds = time.perf_counter() - started_at
+
+  started_at = time.perf_counter()
+  for encoded_ids in encoded_lists[:max(1, number_of_lists // 10)]:
+    for _ in idcodec.iter_ids(encoded_ids):
+      pass
+  iterate_seconds = time.perf_counter() - started_at
+  iterated_ids = sum(len(ids) for ids in adjacency_lists[:max(1, number_of_lists // 10)])
+
+  bson_array_documents = [bson.encode({'followers': ids}) for ids in python_lists]
+  bson_binary_documents = [bson.encode({'followers': encoded_ids}) for encoded_ids in encoded_lists]
+
+  # Decoding the BSON arrays is work every read of an array document pays on the client, whatever the network
+  started_at = time.perf_counter()
+  for document in bson_array_documents:
+    array('q', bson.decode(document)['followers'])
+  bson_decode_seconds = time.perf_counter() - started_at
+
+  results = {
+    'number_of_ids': number_of_ids,
+    'bytes_per_id': {
+      'python_list': sum(sys.getsizeof(ids) + sum(sys.getsizeof(id) for id in ids) for ids in python_lists[:10]) / sum(len(ids) for ids in python_lists[:10]),
+      'bson_array': sum(len(document) for document in bson_array_documents) / number_of_ids,
+      'id_array': 8.0,
+      'bson_varint': sum(len(document) for document in bson_binary_documents) / number_of_ids,
+      'varint': sum(len(encoded_ids) for encoded_ids in encoded_lists) / number_of_ids
+    },
+    'ids_per_second': {
+      'varint_encode': number_of_ids / encode_seconds,
+      'varint_decode': number_of_ids / decode_seconds,
+      'varint_iterate': iterated_ids / iterate_seconds,
+      'bson_array_decode': number_of_ids / bson_decode_seconds
+    }
+  }
+  results['size_reduction'] = {
+    representation: 1 - results['bytes_per_id']['varint'] / bytes_per_id
+    for representation, bytes_per_id in results['bytes_per_id'].items() if representation not in ('varint', 'bson_varint')
+  }
+
+  if collection is not None:
+    collection.delete_many({})
+    collection.insert_many([{'index': index, 'followers': ids} for index, ids in enumerate(python_lists)])
+    started_at = time.perf_counter()
+    for document in collection.find({}, {'_id': False, 'followers': True}):
+      array('q', document['followers'])
+    results['ids_per_second']['mongo_array_read'] = number_of_ids / (time.perf_counter() - started_at)
+    collection.delete_many({})
+
+  return results
+
+def benchmark_crawl(number_of_users=5000, number_of_keys=3, rate_limit_window=2.0, latency=0.005, ids_page_size=100, spurious_rate_limit_rate=0.01, reference_accounts=5, write_to_db=False, concurrency=1):
+
+  '''
+  Runs the crawler end to end against a FakeTwitterAPI pool serving a synthetic dataset, with shortened rate limit windows, to measure crawl throughput and rate limit handling offline and repeatably.
+
+  Keyword Arguments:
+  ===
+  number_of_users -- the number of accounts in the synthetic dataset
+  number_of_keys -- the number of emulated credential sets
+  rate_limit_window -- length of the emulated rate limit windows, in seconds
+  latency -- seconds each emulated API call takes
+  ids_page_size -- the most ids per emulated follower page, small so that paging runs into the rate limits
+  spurious_rate_limit_rate -- share of calls answered with a 429 regardless of the budget
+  reference_accounts -- the number of most followed accounts crawled
+  write_to_db -- also run main.get_users on the reference accounts, writing to the database configured in clients; otherwise only the Twitter side of the crawl (lookups and all the follower pages of the reference accounts) runs
+  concurrency -- the concurrency of main.get_users, 1 for the serial crawl
+
+  return: dictionary of the calls made, 429s answered, time taken and throughputs
+
+  '''
+
+  # Imported here so the codec benchmark runs without tweepy
+  import tweepy
+  import main
+  import utils
+  import cache
+  import scheduler
+  import faketwitter
+
+  dataset = faketwitter.TwitterDataset.synthetic(number_of_users)
+  fake_apis = faketwitter.fake_api_pool(dataset, number_of_keys, rate_limit_window=rate_limit_window, latency=latency, ids_page_size=ids_page_size, spurious_rate_limit_rate=spurious_rate_limit_rate)
+  rate_limit_scheduler = scheduler.RateLimitScheduler(fake_apis)
+  clients.configure(twitter_api=cache.CachedAPI(rate_limit_scheduler, cache.ResponseCache(':memory:')))
+  top_user_ids = sorted(dataset.users, key=lambda user_id: len(dataset.followers[user_id]), reverse=True)[:reference_accounts]
+  top_handles = [dataset.users[user_id]['screen_name'] for user_id in top_user_ids]
+
+  try:
+    started_at = time.perf_counter()
+    top_users_by_category = main.get_top_users_by_followers(['benchmark'], {'benchmark': top_handles})
+    users_looked_up = len(utils.lookup_users(list(dataset.users)))
+    follower_ids_fetched = sum(
+      len(page)
+      for handle in top_handles
+      for page in tweepy.Cursor(clients.get_api().followers_ids, screen_name=handle).pages()
+    )
+    users_written = 0
+    if write_to_db:
+      write_counts = main.get_users(top_users_by_category, concurrency=concurrency)
+      users_written = write_counts['inserted'] + write_counts['updated']
+    seconds = time.perf_counter() - started_at
+  finally:
+    clients.configure(twitter_api=None)
+
+  calls_answered = sum(sum(fake_api.calls.values()) for fake_api in fake_apis)
+  rate_limited_calls = sum(sum(fake_api.rate_limited_calls.values()) for fake_api in fake_apis)
+  return {
+    'seconds': seconds,
+    'calls_made': rate_limit_scheduler.calls_made,
+    'calls_answered': calls_answered,
+    'rate_limited_calls': rate_limited_calls,
+    'calls_per_second': calls_answered / seconds,
+    'users_looked_up_per_second': users_looked_up / seconds,
+    'follower_ids_fetched': follower_ids_fetched,
+    'users_written': users_written
+  }
+
+def benchmark_graph_suite(sizes=tuple(GRAPH_SIZES), track_memory=True, with_mongo=False, workers=1):
+
+  '''
+  Times and memory-profiles graph building, tag propagation (the hops alone, then the whole main.propagate_tags path over the graph and over its 2-core, see pruning), snapshot round trips (see snapshot) and Mongo round trips on power law graphs grown by preferential attachment (see utils.generate_power_law_graph) of each size.
+
+  Keyword Arguments:
+  ===
+  sizes -- the keys of GRAPH_SIZES to run
+  track_memory -- also measure the peak memory of each stage, in a separate run under tracemalloc
+  with_mongo -- also time writing the users to, and reading them back from, a scratch database next to the one configured in clients
+  workers -- when more than 1, also time propagating the tags over that many processes on the graphs of at least parallelpropagation.PARALLEL_MIN_NODES users; tracemalloc only sees the parent process's memory
+
+  return: dictionary of size to stage to its 'seconds' and 'peak_bytes'
+
+  '''
+
+  # Imported here so the codec benchmark runs without the graph libraries
+  import main
+  import utils
+  import snapshot
+  import propagation
+  import parallelpropagation
+  import pruning
+
+  results = {}
+  for size in sizes:
+    number_of_users = GRAPH_SIZES[size]
+    stages = results[size] = {}
+
+    users = measure_stage(stages, 'generate_userinfo', lambda: utils.generate_power_law_userinfo(number_of_users, GRAPH_MEAN_FRIENDS), track_memory)
+    for user_index, user in enumerate(sorted(users, key=lambda user: len(user.followers), reverse=True)[:max(1, int(number_of_users * SEED_TAG_SHARE))]):
+      user.tags = [SEED_TAGS[user_index % len(SEED_TAGS)]]
+
+    csr_graph = measure_stage(stages, 'users_to_graph_csr', lambda: main.users_to_graph(users, fetch_unknown_users=False, backend='csr'), track_memory)
+    if number_of_users <= NETWORKX_MAX_USERS:
+      measure_stage(stages, 'users_to_graph_networkx', lambda: main.users_to_graph(users, fetch_unknown_users=False), track_memory)
+    # The hops alone, then the whole path that also ranks every node's tags and stores them on the graph
+    measure_stage(stages, 'propagate_graph_csr', lambda: propagation.propagate_graph(csr_graph), track_memory)
+    measure_stage(stages, 'propagate_tags_csr', lambda: main.propagate_tags(csr_graph), track_memory)
+    measure_stage(stages, 'propagate_tags_pruned', lambda: main.propagate_tags(csr_graph, graph_pruner=pruning.GraphPruner()), track_memory)
+    # Smaller graphs run on one core anyway
+    if workers > 1 and number_of_users >= parallelpropagation.PARALLEL_MIN_NODES:
+      measure_stage(stages, 'propagate_tags_parallel', lambda: main.propagate_tags(csr_graph, workers=workers), track_memory)
+    with tempfile.TemporaryDirectory() as snapshot_path:
+      measure_stage(stages, 'snapshot_save', lambda: snapshot.save_snapshot(csr_graph, snapshot_path), track_memory)
+      measure_stage(stages, 'snapshot_load', lambda: snapshot.load_snapshot(snapshot_path), track_memory)
+    del csr_graph
+
+    if with_mongo and number_of_users <= MONGO_MAX_USERS:
+      database_name = clients.config['database_name']
+      clients.configure(database_name=BENCHMARK_DATABASE_NAME)
+      try:
+        drop_database = lambda: clients.get_mongo_client().drop_database(BENCHMARK_DATABASE_NAME)
+        measure_stage(stages, 'mongo_write', lambda: utils.add_userinfo_to_db(users), track_memory, setup=drop_database)
+        measure_stage(stages, 'mongo_read', utils.hydrate_userinfo_objects_from_db, track_memory)
+        drop_database()
+      finally:
+        clients.configure(database_name=database_name)
+    del users
+
+  return results
+
+def measure_stage(stages, stage, run_stage, track_memory=True, setup=None):
+  # Time one run of the stage, after another one under tracemalloc for its peak memory, and return the timed run's result
+  if track_memory:
+    if setup is not None:
+      setup()
+    gc.collect()
+    tracemalloc.start()
+    run_stage()
+    stages.setdefault(stage, {})['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+  if setup is not None:
+    setup()
+  gc.collect()
+  started_at = time.perf_counter()
+  result = run_stage()
+  stages.setdefault(stage, {})['seconds'] = time.perf_counter() - started_at
+  return result
+
+def compare_to_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+
+  '''
+  Compares benchmark results with a baseline of the same shape.
+
+  Keyword Arguments:
+  ===
+  results -- dictionary of size to stage to metric ('seconds' or 'peak_bytes') to value, as returned by benchmark_graph_suite
+  baseline -- the stored results to compare with
+  tolerance -- the share by which a metric may exceed its baseline value
+
+  return: the list of regressions, as readable strings, empty when there are none; a metric missing from the baseline is a regression too, so a new stage is not left unchecked
+
+  '''
+
+  regressions = []
+  for size, stages in results.items():
+    for stage, metrics in stages.items():
+      for metric, value in metrics.items():
+        baseline_value = baseline.get(size, {}).get(stage, {}).get(metric)
+        if baseline_value is None:
+          regressions.append('{0} {1} {2}: {3:.4g} but not in the baseline, regenerate it with --save-baseline'.format(size, stage, metric, value))
+          continue
+        if metric == 'seconds':
+          value, baseline_value = max(value, MIN_COMPARED_SECONDS), max(baseline_value, MIN_COMPARED_SECONDS)
+        if value > baseline_value * (1 + tolerance):
+          regressions.append('{0} {1} {2}: {3:.4g} against {4:.4g} in the baseline'.format(size, stage, metric, value, baseline_value))
+  return regressions
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser(description='Benchmarks of the storage and graph code paths.')
+  parser.add_argument('suites', nargs='*', choices=['codec', 'crawl', 'graph'], default=['codec', 'crawl', 'graph'], help='the benchmarks to run, all of them by default')
+  parser.add_argument('--lists', type=int, default=200, help='number of id lists in the id codec benchmark')
+  parser.add_argument('--ids-per-list', type=int, default=5000, help='number of ids in each list')
+  parser.add_argument('--mongo', action='store_true', help='also measure reads from and crawl writes to the MongoDB database configured in clients')
+  parser.add_argument('--crawl-users', type=int, default=5000, help='number of accounts in the synthetic dataset of the crawl benchmark')
+  parser.add_argument('--keys', type=int, default=3, help='number of emulated credential sets in the crawl benchmark')
+  parser.add_argument('--latency', type=float, default=0.005, help='seconds each emulated API call takes')
+  parser.add_argument('--concurrency', type=int, default=1, help='concurrency of the get_users crawl run with --mongo')
+  parser.add_argument('--sizes', default=','.join(GRAPH_SIZES), help='comma separated graph sizes of the graph benchmark, among ' + ', '.join(GRAPH_SIZES))
+  parser.add_argument('--workers', type=int, default=1, help='also time tag propagation over this many processes in the graph benchmark')
+  parser.add_argument('--no-memory', action='store_true', help='only time the graph benchmark stages, without the tracemalloc runs')
+  parser.add_argument('--baseline', default=BASELINE_PATH, help='the stored graph benchmark results to compare with')
+  parser.add_argument('--save-baseline', action='store_true', help='store the graph benchmark results as the new baseline instead of comparing with it')
+  arguments = parser.parse_args()
+
+  if 'codec' in arguments.suites:
+    collection = None
+    if arguments.mongo:
+      collection = clients.get_db().benchmark_adjacency
+    pprint.pprint(benchmark_id_codec(arguments.lists, arguments.ids_per_list, collection))
+
+  if 'crawl' in arguments.suites:
+    pprint.pprint(benchmark_crawl(arguments.crawl_users, arguments.keys, latency=arguments.latency, write_to_db=arguments.mongo, concurrency=arguments.concurrency))
+
+  if 'graph' in arguments.suites:
+    graph_results = benchmark_graph_suite(arguments.sizes.split(','), not arguments.no_memory, arguments.mongo, arguments.workers)
+    pprint.pprint(graph_results)
+    if arguments.save_baseline:
+      with open(arguments.baseline, 'w') as baseline_file:
+        json.dump(graph_results, baseline_file, indent=2, sort_keys=True)
+    else:
+      try:
+        with open(arguments.baseline) as baseline_file:
+          baseline = json.load(baseline_file)
+      except FileNotFoundError:
+        baseline = None
+        print('No baseline at ' + arguments.baseline + ', run with --save-baseline to store one')
+      if baseline is not None:
+        regressions = compare_to_baseline(graph_results, baseline)
+        for regression in regressions:
+          print('Regression: ' + regression)
+        if regressions:
+          sys.exit(1)
@@ -0,0 +1,250 @@
+#region Imports
+
+# System libraries
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+from collections import Counter
+
+# Third party libraries (pip)
+import tweepy # https://tweepy.readthedocs.io/en/latest/index.html
+
+#endregion
+
+#region Constants
+
+CACHE_PATH = 'twitter_cache.sqlite'
+
+# How long a cached response stays fresh, in seconds, by endpoint
+DEFAULT_TTLS = {
+  'get_user': 24 * 60 * 60,
+  'followers_ids': 3 * 24 * 60 * 60,
+  'friends_ids': 3 * 24 * 60 * 60
+}
+
+# Least recently used entries are evicted once the cache grows past this many bytes
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+#endregion
+
+class ResponseCache:
+
+  '''
+  Disk-backed (SQLite) cache of Twitter API responses, keyed by endpoint and arguments, with a TTL per endpoint and LRU eviction under a size cap.
+  '''
+
+  def __init__(self, path=CACHE_PATH, ttls=None, max_bytes=DEFAULT_MAX_BYTES):
+    self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+    self.max_bytes = max_bytes
+    self.hits = Counter()
+    self.misses = Counter()
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    self._connection.execute('''
+      CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        endpoint TEXT NOT NULL,
+        value TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        stored_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+      )
+    ''')
+    self._connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+    self._connection.commit()
+    self._total_bytes = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+  def get(self, endpoint, key):
+
+    '''
+    Gets a cached response.
+
+    Keyword Arguments:
+    ===
+    endpoint -- the name of the API method the response came from
+    key -- the normalized arguments of the call, as a string
+
+    return: the cached response decoded from JSON, or None if it is missing or expired
+
+    '''
+
+    now = time.time()
+    with self._lock:
+      row = self._connection.execute(
+        'SELECT value, stored_at FROM responses WHERE key = ?', (cache_key(endpoint, key),)
+      ).fetchone()
+      if row is None or now - row[1] > self.ttls.get(endpoint, 0):
+        self.misses[endpoint] += 1
+        return None
+      self._connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, cache_key(endpoint, key)))
+      self._connection.commit()
+      self.hits[endpoint] += 1
+      return json.loads(row[0])
+
+  def put(self, endpoint, key, value):
+    encoded_value = json.dumps(value)
+    now = time.time()
+    with self._lock:
+      previous_row = self._connection.execute(
+        'SELECT size FROM responses WHERE key = ?', (cache_key(endpoint, key),)
+      ).fetchone()
+      if previous_row is not None:
+        self._total_bytes -= previous_row[0]
+      self._connection.execute(
+        'INSERT OR REPLACE INTO responses (key, endpoint, value, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (cache_key(endpoint, key), endpoint, encoded_value, len(encoded_value), now, now)
+      )
+      self._total_bytes += len(encoded_value)
+      if self._total_bytes > self.max_bytes:
+        self._evict()
+      self._connection.commit()
+
+  def stats(self):
+    return {
+      'hits': dict(self.hits),
+      'misses': dict(self.misses),
+      'bytes': self._total_bytes
+    }
+
+  def close(self):
+    self._connection.close()
+
+  def _evict(self):
+    # Drop least recently used entries until the cache is back under 90% of its cap
+    target_bytes = self.max_bytes * 0.9
+    rows = self._connection.execute('SELECT key, size FROM responses ORDER BY accessed_at')
+    keys_to_delete = []
+    for key, size in rows:
+      if self._total_bytes <= target_bytes:
+        break
+      keys_to_delete.append((key,))
+      self._total_bytes -= size
+    self._connection.executemany('DELETE FROM responses WHERE key = ?', keys_to_delete)
+
+class CachedAPI:
+
+  '''
+  Wraps a tweepy.API-like object (e.g. the rate limit scheduler), answering get_user, lookup_users, followers_ids and friends_ids from a ResponseCache when possible.
+
+  Profiles are cached one per account, so a profile fetched through lookup_users also serves later get_user calls and vice versa.
+  '''
+
+  def __init__(self, api, response_cache):
+    self.api = api
+    self.cache = response_cache
+    self._bypass = threading.local()
+
+  def __getattr__(self, name):
+    if name.startswith('_') or 'api' not in self.__dict__:
+      raise AttributeError(name)
+    return getattr(self.api, name)
+
+  @contextlib.contextmanager
+  def bypassing_cache(self):
+
+    '''
+    Within the block, the calls made from this thread go to Twitter, and their responses replace the cached ones, e.g. to refresh stored users whose cached id pages may be days old.
+
+    '''
+
+    self._bypass.active = True
+    try:
+      yield self
+    finally:
+      self._bypass.active = False
+
+  def get_user(self, *args, **kwargs):
+    if 'screen_name' in kwargs:
+      key = screen_name_key(kwargs['screen_name'])
+    elif 'user_id' in kwargs:
+      key = user_id_key(kwargs['user_id'])
+    else:
+      # The id parameter takes either a user id or a screen name
+      identifier = args[0] if args else kwargs.get('id')
+      key = user_id_key(identifier) if not isinstance(identifier, str) or identifier.isdigit() else screen_name_key(identifier)
+    cached_user = self._cached_response('get_user', key)
+    if cached_user is not None:
+      return tweepy.models.User.parse(self.api, cached_user)
+    tweepy_user = self.api.get_user(*args, **kwargs)
+    self._store_user(tweepy_user)
+    return tweepy_user
+
+  def lookup_users(self, user_ids=None, screen_names=None, *args, **kwargs):
+    found_users = []
+    missing_user_ids = []
+    missing_screen_names = []
+    for identifiers, missing_identifiers, key_function in (
+      (user_ids or [], missing_user_ids, user_id_key),
+      (screen_names or [], missing_screen_names, screen_name_key)
+    ):
+      for identifier in identifiers:
+        cached_user = self._cached_response('get_user', key_function(identifier))
+        if cached_user is not None:
+          found_users.append(tweepy.models.User.parse(self.api, cached_user))
+        else:
+          missing_identifiers.append(identifier)
+
+    if missing_user_ids or missing_screen_names:
+      try:
+        fetched_users = self.api.lookup_users(user_ids=missing_user_ids or None, screen_names=missing_screen_names or None, *args, **kwargs)
+      except tweepy.TweepError as error:
+        # Error 17 means none of the requested accounts exist, which only matters if nothing came from the cache either
+        if error.api_code != 17 or not found_users:
+          raise
+        fetched_users = []
+      for tweepy_user in fetched_users:
+        self._store_user(tweepy_user)
+      found_users.extend(fetched_users)
+
+    return found_users
+
+  @property
+  def followers_ids(self):
+    return self._cached_ids_method('followers_ids')
+
+  @property
+  def friends_ids(self):
+    return self._cached_ids_method('friends_ids')
+
+  def _cached_ids_method(self, endpoint):
+
+    def cached_call(*args, **kwargs):
+      key = json.dumps([list(args), sorted(kwargs.items())])
+      cached_page = self._cached_response(endpoint, key)
+      if cached_page is not None:
+        # Paginated calls return the ids with their (previous, next) cursors
+        return cached_page['ids'] if cached_page['cursors'] is None else (cached_page['ids'], tuple(cached_page['cursors']))
+      page = getattr(self.api, endpoint)(*args, **kwargs)
+      if isinstance(page, tuple):
+        self.cache.put(endpoint, key, {'ids': list(page[0]), 'cursors': list(page[1])})
+      else:
+        self.cache.put(endpoint, key, {'ids': list(page), 'cursors': None})
+      return page
+
+    cached_call.pagination_mode = 'cursor'
+    return cached_call
+
+  def _cached_response(self, endpoint, key):
+    if getattr(self._bypass, 'active', False):
+      return None
+    return self.cache.get(endpoint, key)
+
+  def _store_user(self, tweepy_user):
+    self.cache.put('get_user', user_id_key(tweepy_user._json['id']), tweepy_user._json)
+    self.cache.put('get_user', screen_name_key(tweepy_user._json['screen_name']), tweepy_user._json)
+
+#region Helpers
+
+def cache_key(endpoint, key):
+  return endpoint + ':' + key
+
+def user_id_key(user_id):
+  return 'user_id=' + str(int(user_id))
+
+def screen_name_key(screen_name):
+  # Screen names are case insensitive on Twitter
+  return 'screen_name=' + screen_name.lower()
+
+#endregion
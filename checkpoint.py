@@ -0,0 +1,106 @@
+#region Imports
+
+# System libraries
+import os
+import json
+import time
+import base64
+from array import array
+
+#endregion
+
+#region Constants
+
+CHECKPOINT_PATH = 'crawl_checkpoint.json'
+
+# Save the crawl state at least this often while an account's followers are being processed, in seconds
+CHECKPOINT_INTERVAL = 60
+
+#endregion
+
+class CrawlState:
+
+  '''
+  Progress of a get_users crawl, saved periodically so that an interrupted crawl can be resumed where it stopped.
+
+  Attributes:
+  ===
+  top_users_by_category -- the input of the crawl
+  pending_accounts -- the frontier, the handles of the reference accounts that have not been completed yet, in crawl order
+  account_progress -- for each started reference account, its follower pagination cursor, the number of pages done, the sampled follower ids still to be processed, the follower ids accepted so far and the sampler's own state (see sampling.FollowerSampler)
+  seen_follower_ids -- the set of follower ids already processed, across all accounts
+
+  '''
+
+  def __init__(self, top_users_by_category=None):
+    self.top_users_by_category = top_users_by_category or {}
+    self.pending_accounts = list(dict.fromkeys(
+      user_data[0] for category_data in self.top_users_by_category.values() for user_data in category_data
+    ))
+    self.account_progress = {}
+    self.seen_follower_ids = set()
+    self.last_saved_at = time.time()
+
+  def get_account_progress(self, handle):
+    if handle not in self.account_progress:
+      self.account_progress[handle] = {
+        'cursor': -1,
+        'pages_done': 0,
+        'sampled_follower_ids': [],
+        'followers': []
+      }
+    return self.account_progress[handle]
+
+  def finish_account(self, handle):
+    self.pending_accounts.remove(handle)
+    self.account_progress.pop(handle, None)
+
+  def is_save_due(self):
+    return time.time() - self.last_saved_at >= CHECKPOINT_INTERVAL
+
+  def save(self, path=CHECKPOINT_PATH):
+
+    '''
+    Saves the crawl state as JSON, replacing the previous checkpoint atomically so a crash mid-write never leaves a broken file.
+
+    Keyword Arguments:
+    ===
+    path -- the file to save the checkpoint to
+
+    '''
+
+    checkpoint = {
+      'top_users_by_category': self.top_users_by_category,
+      'pending_accounts': self.pending_accounts,
+      'account_progress': self.account_progress,
+      'seen_follower_ids': encode_id_set(self.seen_follower_ids)
+    }
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as checkpoint_file:
+      json.dump(checkpoint, checkpoint_file)
+    os.replace(temporary_path, path)
+    self.last_saved_at = time.time()
+
+  @classmethod
+  def load(cls, path=CHECKPOINT_PATH):
+    with open(path) as checkpoint_file:
+      checkpoint = json.load(checkpoint_file)
+    crawl_state = cls()
+    crawl_state.top_users_by_category = checkpoint['top_users_by_category']
+    crawl_state.pending_accounts = checkpoint['pending_accounts']
+    crawl_state.account_progress = checkpoint['account_progress']
+    crawl_state.seen_follower_ids = decode_id_set(checkpoint['seen_follower_ids'])
+    return crawl_state
+
+#region Helpers
+
+def encode_id_set(ids):
+  # Store the set as its sorted 64-bit ids, packed, so large seen-sets stay compact on disk
+  return base64.b64encode(array('q', sorted(ids)).tobytes()).decode('ascii')
+
+def decode_id_set(encoded_ids):
+  ids = array('q')
+  ids.frombytes(base64.b64decode(encoded_ids))
+  return set(ids)
+
+#endregion
@@ -1,12 +1,70 @@
+import datetime
+from array import array
+
+# idcodec, and numpy with it, is imported where ids are decoded, so importing classes stays fast
+
 class UserInfo:
-  
-  def __init__(self, id="N/A", description="N/A", handle="@N/A", friends=[], followers=[], tags=[]):
+
+  # No per-instance __dict__, and friends/followers are held as packed 64-bit id buffers rather than lists of Python ints
+  __slots__ = ('id', 'description', 'handle', '_friends', '_followers', 'tags', 'friends_count', 'followers_count', 'fetched_at', 'fetched_friends_count', 'fetched_followers_count', 'followers_sampled', '_adjacency_loader')
+
+  def __init__(self, id="N/A", description="N/A", handle="@N/A", friends=None, followers=None, tags=None, friends_count=None, followers_count=None, fetched_at=None, followers_sampled=None, fetched_friends_count=None, fetched_followers_count=None, adjacency_loader=None):
     self.id = id
     self.description = description
     self.handle = handle
-    self.friends = friends
-    self.followers = followers
-    self.tags = tags
+    self.tags = tags if tags is not None else []
+    # The profile's counts, which are known without fetching any id list (None when unknown)
+    self.friends_count = friends_count
+    self.followers_count = followers_count
+    # When friends and followers were last downloaded from Twitter (None when unknown)
+    self.fetched_at = fetched_at
+    # The profile's counts when friends and followers were last downloaded, which refreshes compare the current counts with (None when unknown)
+    self.fetched_friends_count = fetched_friends_count
+    self.fetched_followers_count = fetched_followers_count
+    # True when followers is a sample of the account's followers (e.g. a reference account of a crawl), which is kept rather than downloaded again
+    self.followers_sampled = followers_sampled
+    # Function taking 'friends' or 'followers' and returning those ids, called on first access to a list that was not given
+    self._adjacency_loader = adjacency_loader
+    self._friends = to_id_array(friends) if friends is not None else None
+    self._followers = to_id_array(followers) if followers is not None else None
+
+  @property
+  def friends(self):
+    if self._friends is None:
+      self._friends = self._load_ids('friends')
+    return self._friends
+
+  @friends.setter
+  def friends(self, ids):
+    self._friends = to_id_array(ids)
+
+  @property
+  def followers(self):
+    if self._followers is None:
+      self._followers = self._load_ids('followers')
+    return self._followers
+
+  @followers.setter
+  def followers(self, ids):
+    self._followers = to_id_array(ids)
+
+  def is_loaded(self, id_type):
+    # Whether the friends or followers are held, so reading them costs no API call
+    return (self._friends if id_type == 'friends' else self._followers) is not None or self._adjacency_loader is None
+
+  def load_adjacency(self, id_types=('friends', 'followers')):
+    # Fetches the lists not loaded yet now rather than on first access, e.g. where fetch errors are handled
+    for id_type in id_types:
+      getattr(self, id_type)
+    return self
+
+  def _load_ids(self, id_type):
+    if self._adjacency_loader is None:
+      return to_id_array(())
+    ids = to_id_array(self._adjacency_loader(id_type))
+    self.fetched_at = datetime.datetime.now(datetime.timezone.utc)
+    setattr(self, 'fetched_' + id_type + '_count', getattr(self, id_type + '_count'))
+    return ids
 
   def __str__(self):
     return """
@@ -16,4 +74,19 @@ class UserInfo:
       Friends: {3}\n
       Followers: {4}\n
       Tags: {5}
-    """.format(self.id, self.description, self.handle, self.friends, self.followers, self.tags)
\ No newline at end of file
+    """.format(self.id, self.description, self.handle, self._describe_ids('friends'), self._describe_ids('followers'), self.tags)
+
+  def _describe_ids(self, id_type):
+    # Printing a user never fetches its lists
+    if not self.is_loaded(id_type):
+      return 'not loaded ({0} on the profile)'.format(getattr(self, id_type + '_count'))
+    return list(getattr(self, id_type))
+
+def to_id_array(ids):
+  import idcodec
+  # Buffers that are already packed (or encoded, see idcodec.PackedIds) are kept as they are, without a copy
+  if isinstance(ids, array) and ids.typecode == 'q' or isinstance(ids, idcodec.PackedIds):
+    return ids
+  if isinstance(ids, (bytes, bytearray)):
+    return idcodec.decode_ids_to_array(ids)
+  return array('q', ids)
@@ -0,0 +1,275 @@
+#region Imports
+
+# System libraries
+from array import array
+
+# Third party libraries (pip)
+import numpy as np # https://numpy.org/doc/stable/
+import networkx as nx # https://networkx.github.io/documentation/stable/install.html
+
+# Custom libraries
+import classes
+
+#endregion
+
+# Per-node attributes kept as columns, in the same order as the dense node indexes
+NODE_COLUMNS = ('handle', 'description', 'tags', 'friends_count', 'followers_count')
+
+class CSRGraph:
+
+  '''
+  Compact directed graph of users, an alternative to the networkx.DiGraph built by main.users_to_graph for graphs too big to hold as Python objects.
+
+  Twitter ids are mapped to dense int32 node indexes, and edges (user -> friend, i.e. follower -> followed) are held as CSR arrays, once sorted by source (friends) and once by destination (followers).
+
+  Attributes:
+  ===
+  node_ids -- int64 array of the Twitter id of each node index
+  friends_indptr, friends_indices -- CSR adjacency, the friends of node i are friends_indices[friends_indptr[i]:friends_indptr[i + 1]]
+  followers_indptr, followers_indices -- CSC adjacency, the followers of node i are followers_indices[followers_indptr[i]:followers_indptr[i + 1]]
+  columns -- dictionary of node attribute name to the list of its values by node index
+  graph -- dictionary of graph-level data, like networkx.DiGraph.graph
+
+  '''
+
+  def __init__(self, node_ids, friends_indptr, friends_indices, followers_indptr, followers_indices, columns=None):
+    self.node_ids = node_ids
+    self.friends_indptr = friends_indptr
+    self.friends_indices = friends_indices
+    self.followers_indptr = followers_indptr
+    self.followers_indices = followers_indices
+    self.columns = columns if columns is not None else {}
+    self.graph = {}
+    # Sorted view of the ids, to map Twitter ids back to node indexes with a binary search
+    self._sorted_order = np.argsort(node_ids, kind='stable').astype(np.int32)
+    self._sorted_ids = node_ids[self._sorted_order]
+
+  #region Construction
+
+  @classmethod
+  def from_edge_arrays(cls, node_ids, source_indexes, destination_indexes, columns=None):
+
+    '''
+    Builds a CSRGraph from parallel arrays of edge endpoints, given as node indexes. Duplicate edges are dropped.
+
+    Keyword Arguments:
+    ===
+    node_ids -- int64 array of the Twitter id of each node index
+    source_indexes -- array of the node index each edge starts from (the follower)
+    destination_indexes -- array of the node index each edge points to (the followed account)
+    columns -- dictionary of node attribute name to the list of its values by node index
+
+    return: the CSRGraph
+
+    '''
+
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    number_of_nodes = len(node_ids)
+    # Encoding each edge as a single int64 key sorts it by source then destination, and makes duplicates adjacent
+    edge_keys = sorted_unique(np.asarray(source_indexes, dtype=np.int64) * number_of_nodes + np.asarray(destination_indexes, dtype=np.int64))
+    sources = (edge_keys // max(number_of_nodes, 1)).astype(np.int32)
+    destinations = (edge_keys % max(number_of_nodes, 1)).astype(np.int32)
+
+    friends_indptr = indptr_from_sorted(sources, number_of_nodes)
+    # The edges are already sorted by source, so a stable sort by destination keeps each follower row sorted too
+    by_destination = np.argsort(destinations, kind='stable')
+    followers_indptr = indptr_from_sorted(destinations[by_destination], number_of_nodes)
+
+    return cls(node_ids, friends_indptr, destinations, followers_indptr, sources[by_destination], columns)
+
+  @classmethod
+  def from_userinfo(cls, users, resolve_unknown_users=None):
+
+    '''
+    Builds a CSRGraph from UserInfo objects, with the same edges as main.users_to_graph.
+
+    Keyword Arguments:
+    ===
+    users -- the list (or any iterable) of UserInfo objects as nodes in the graph
+    resolve_unknown_users -- optional function taking the list of ids of friends and followers that are not among users, and returning their UserInfo objects (or None) in the same order, called once after all the edges are collected. Unresolved nodes are kept as stubs
+
+    return: the CSRGraph representing the given UserInfo objects
+
+    '''
+
+    user_ids = array('q')
+    user_columns = {column: [] for column in NODE_COLUMNS}
+    source_ids = array('q')
+    destination_ids = array('q')
+    for user in users:
+      user_ids.append(user.id)
+      for column in NODE_COLUMNS:
+        user_columns[column].append(getattr(user, column))
+      # Edges go from the follower to the followed account
+      source_ids.extend(array('q', [user.id]) * len(user.friends))
+      destination_ids.extend(user.friends)
+      source_ids.extend(user.followers)
+      destination_ids.extend(array('q', [user.id]) * len(user.followers))
+
+    user_ids = np.frombuffer(user_ids, dtype=np.int64)
+    source_ids = np.frombuffer(source_ids, dtype=np.int64)
+    destination_ids = np.frombuffer(destination_ids, dtype=np.int64)
+
+    # Nodes are indexed in order of first appearance, the given users first
+    all_ids = np.concatenate((user_ids, source_ids, destination_ids))
+    unique_ids, first_positions = np.unique(all_ids, return_index=True)
+    appearance_order = np.argsort(first_positions, kind='stable')
+    node_ids = unique_ids[appearance_order]
+    node_index_of_unique = np.empty(len(unique_ids), dtype=np.int64)
+    node_index_of_unique[appearance_order] = np.arange(len(unique_ids))
+
+    # The first occurrence of a user wins, like in users_to_graph
+    _, first_user_positions = np.unique(user_ids, return_index=True)
+    first_user_positions.sort()
+    columns = {column: [None] * len(node_ids) for column in NODE_COLUMNS}
+    for position in first_user_positions:
+      node_index = node_index_of_unique[np.searchsorted(unique_ids, user_ids[position])]
+      for column in NODE_COLUMNS:
+        columns[column][node_index] = user_columns[column][position]
+
+    number_of_known_users = len(first_user_positions)
+    unknown_user_ids = node_ids[number_of_known_users:].tolist()
+    unknown_users = resolve_unknown_users(unknown_user_ids) if resolve_unknown_users is not None and unknown_user_ids else [None] * len(unknown_user_ids)
+    for node_index, unknown_user in enumerate(unknown_users, start=number_of_known_users):
+      if unknown_user is None:
+        unknown_user = classes.UserInfo(id=unknown_user_ids[node_index - number_of_known_users])
+      for column in NODE_COLUMNS:
+        columns[column][node_index] = getattr(unknown_user, column)
+
+    return cls.from_edge_arrays(
+      node_ids,
+      node_index_of_unique[np.searchsorted(unique_ids, source_ids)],
+      node_index_of_unique[np.searchsorted(unique_ids, destination_ids)],
+      columns
+    )
+
+  @classmethod
+  def from_networkx(cls, users_graph):
+
+    '''
+    Converts a networkx.DiGraph built by main.users_to_graph into a CSRGraph.
+
+    Keyword Arguments:
+    ===
+    users_graph -- the networkx.DiGraph, with Twitter ids as nodes and optionally a UserInfo object as each node's 'userinfo' attribute
+
+    return: the CSRGraph
+
+    '''
+
+    node_ids = np.fromiter(users_graph.nodes, dtype=np.int64, count=users_graph.number_of_nodes())
+    node_index = {node_id: node_index for node_index, node_id in enumerate(node_ids.tolist())}
+    edges = np.array([(node_index[source], node_index[destination]) for source, destination in users_graph.edges], dtype=np.int64).reshape(-1, 2)
+
+    columns = {column: [] for column in NODE_COLUMNS}
+    for node_id, node_attributes in users_graph.nodes(data=True):
+      userinfo = node_attributes.get('userinfo') or classes.UserInfo(id=node_id)
+      for column in NODE_COLUMNS:
+        columns[column].append(getattr(userinfo, column))
+
+    return cls.from_edge_arrays(node_ids, edges[:, 0], edges[:, 1], columns)
+
+  def to_networkx(self):
+
+    '''
+    Converts the CSRGraph into a networkx.DiGraph like the one built by main.users_to_graph, for small graphs.
+
+    Each node gets a UserInfo object whose friends and followers are its neighbours in the graph.
+
+    return: the networkx.DiGraph
+
+    '''
+
+    users_graph = nx.DiGraph()
+    for node_index, node_id in enumerate(self.node_ids.tolist()):
+      userinfo = classes.UserInfo(
+        id = node_id,
+        friends = self.node_ids[self.friends_indices[self.friends_indptr[node_index]:self.friends_indptr[node_index + 1]]],
+        followers = self.node_ids[self.followers_indices[self.followers_indptr[node_index]:self.followers_indptr[node_index + 1]]],
+        **{column: self.columns[column][node_index] for column in NODE_COLUMNS if column in self.columns}
+      )
+      users_graph.add_node(node_id, userinfo=userinfo)
+    users_graph.add_edges_from(self.edges())
+    return users_graph
+
+  #endregion
+
+  #region Queries
+
+  def number_of_nodes(self):
+    return len(self.node_ids)
+
+  def number_of_edges(self):
+    return len(self.friends_indices)
+
+  def __len__(self):
+    return self.number_of_nodes()
+
+  def __contains__(self, node_id):
+    position = np.searchsorted(self._sorted_ids, node_id)
+    return position < len(self._sorted_ids) and self._sorted_ids[position] == node_id
+
+  def node_indexes(self, node_ids):
+
+    '''
+    Maps Twitter ids to their dense node indexes.
+
+    Keyword Arguments:
+    ===
+    node_ids -- a Twitter id or an array of Twitter ids, all of which must be in the graph
+
+    return: the node index or int32 array of node indexes
+
+    '''
+
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    positions = np.searchsorted(self._sorted_ids, node_ids)
+    if np.any(positions >= len(self._sorted_ids)) or np.any(self._sorted_ids[np.minimum(positions, len(self._sorted_ids) - 1)] != node_ids):
+      raise KeyError('Node not in the graph')
+    return self._sorted_order[positions]
+
+  def successors(self, node_id):
+    # The friends of the node, as Twitter ids
+    node_index = self.node_indexes(node_id)
+    return self.node_ids[self.friends_indices[self.friends_indptr[node_index]:self.friends_indptr[node_index + 1]]]
+
+  def predecessors(self, node_id):
+    # The followers of the node, as Twitter ids
+    node_index = self.node_indexes(node_id)
+    return self.node_ids[self.followers_indices[self.followers_indptr[node_index]:self.followers_indptr[node_index + 1]]]
+
+  def has_edge(self, source_id, destination_id):
+    if source_id not in self or destination_id not in self:
+      return False
+    source_index = self.node_indexes(source_id)
+    destination_index = self.node_indexes(destination_id)
+    # Each row of friends is sorted, so a binary search finds the edge
+    row = self.friends_indices[self.friends_indptr[source_index]:self.friends_indptr[source_index + 1]]
+    position = np.searchsorted(row, destination_index)
+    return bool(position < len(row) and row[position] == destination_index)
+
+  def edges(self):
+    sources = np.repeat(np.arange(self.number_of_nodes(), dtype=np.int32), np.diff(self.friends_indptr))
+    return zip(self.node_ids[sources].tolist(), self.node_ids[self.friends_indices].tolist())
+
+  #endregion
+
+#region Helpers
+
+def sorted_unique(values):
+  # Sort in place and drop repeats, much cheaper than np.unique on tens of millions of keys
+  values = np.sort(values)
+  if len(values) == 0:
+    return values
+  keep = np.empty(len(values), dtype=bool)
+  keep[0] = True
+  np.not_equal(values[1:], values[:-1], out=keep[1:])
+  return values[keep]
+
+def indptr_from_sorted(row_indexes, number_of_rows):
+  # Row i spans indptr[i]:indptr[i + 1] of the entries sorted by row
+  indptr = np.zeros(number_of_rows + 1, dtype=np.int64)
+  np.cumsum(np.bincount(row_indexes, minlength=number_of_rows), out=indptr[1:])
+  return indptr
+
+#endregion
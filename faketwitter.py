@@ -0,0 +1,301 @@
+#region Imports
+
+# System libraries
+import json
+import time
+import random
+import threading
+from collections import Counter
+
+# Third party libraries (pip)
+import tweepy # https://tweepy.readthedocs.io/en/latest/index.html
+
+# Custom libraries
+import utils
+
+#endregion
+
+#region Constants
+
+# Calls allowed per 15 minute window on the fake endpoints, the same as Twitter's for user auth
+FAKE_ENDPOINT_LIMITS = {
+  'get_user': 900,
+  'lookup_users': 900,
+  'followers_ids': 15,
+  'friends_ids': 15
+}
+FAKE_RATE_LIMIT_WINDOW = 15 * 60
+
+# Largest page the ids endpoints serve, and the most accounts users/lookup resolves at once
+IDS_PAGE_SIZE = 5000
+LOOKUP_LIMIT = 100
+
+#endregion
+
+class TwitterDataset:
+
+  '''
+  The accounts and follow relationships a FakeTwitterAPI serves, either generated or recorded from the real API with a RecordingAPI.
+
+  Attributes:
+  ===
+  users -- dictionary of user id to the user's JSON, as the API returns it
+  followers -- dictionary of user id to the list of ids of the user's followers
+  friends -- dictionary of user id to the list of ids of the accounts the user follows
+
+  '''
+
+  def __init__(self, users=None, followers=None, friends=None):
+    self.users = users if users is not None else {}
+    self.followers = followers if followers is not None else {}
+    self.friends = friends if friends is not None else {}
+    self._ids_by_screen_name = {user['screen_name'].lower(): user_id for user_id, user in self.users.items()}
+
+  @classmethod
+  def synthetic(cls, number_of_users=1000, mean_friends=50, exponent=2.1, seed=0):
+
+    '''
+    Generates a dataset with a power law follower graph, where a few accounts gather most of the followers, like on Twitter (see utils.generate_power_law_graph).
+
+    Keyword Arguments:
+    ===
+    number_of_users -- the number of accounts
+    mean_friends -- the average number of accounts each account follows
+    exponent -- the power law exponent of the follower counts
+    seed -- the random seed, the same seed always gives the same dataset
+
+    return: the TwitterDataset
+
+    '''
+
+    user_ids, source_indexes, destination_indexes = utils.generate_power_law_graph(number_of_users, mean_friends, exponent, seed)
+    dataset = cls()
+    for user_id in user_ids.tolist():
+      dataset.followers[user_id] = []
+      dataset.friends[user_id] = []
+    for source_id, destination_id in zip(user_ids[source_indexes].tolist(), user_ids[destination_indexes].tolist()):
+      dataset.friends[source_id].append(destination_id)
+      dataset.followers[destination_id].append(source_id)
+    for user_id in user_ids.tolist():
+      dataset.add_user({
+        'id': user_id,
+        'id_str': str(user_id),
+        'screen_name': 'user' + str(user_id),
+        'description': 'Synthetic account ' + str(user_id),
+        'followers_count': len(dataset.followers[user_id]),
+        'friends_count': len(dataset.friends[user_id])
+      })
+    return dataset
+
+  @classmethod
+  def load(cls, path):
+    with open(path) as dataset_file:
+      dataset_json = json.load(dataset_file)
+    return cls(
+      {int(user_id): user for user_id, user in dataset_json['users'].items()},
+      {int(user_id): ids for user_id, ids in dataset_json['followers'].items()},
+      {int(user_id): ids for user_id, ids in dataset_json['friends'].items()}
+    )
+
+  def save(self, path):
+    with open(path, 'w') as dataset_file:
+      json.dump({'users': self.users, 'followers': self.followers, 'friends': self.friends}, dataset_file)
+
+  def add_user(self, user_json):
+    self.users[user_json['id']] = user_json
+    self._ids_by_screen_name[user_json['screen_name'].lower()] = user_json['id']
+
+  def find_user_id(self, identifier=None, user_id=None, screen_name=None):
+    # The id parameter of the API takes either a user id or a screen name
+    if identifier is not None:
+      if isinstance(identifier, int) or str(identifier).isdigit():
+        user_id = int(identifier)
+      else:
+        screen_name = identifier
+    if screen_name is not None:
+      return self._ids_by_screen_name.get(screen_name.lower())
+    if user_id is not None and int(user_id) in self.users:
+      return int(user_id)
+    return None
+
+class FakeResponse:
+
+  def __init__(self, status_code, headers):
+    self.status_code = status_code
+    self.headers = headers
+
+class FakeTwitterAPI:
+
+  '''
+  In-process stand-in for one tweepy.API (one credential set), serving get_user, lookup_users, followers_ids and friends_ids from a TwitterDataset, so the crawler can run and be benchmarked offline and repeatably.
+
+  Calls are rate limited per endpoint like on Twitter: every response carries x-rate-limit-* headers in last_response, and a call over the limit raises tweepy.RateLimitError with a 429 response. Pass several instances to scheduler.RateLimitScheduler to emulate a pool of keys.
+
+  Keyword Arguments:
+  ===
+  dataset -- the TwitterDataset to serve
+  endpoint_limits -- calls allowed per window by endpoint, FAKE_ENDPOINT_LIMITS when None
+  rate_limit_window -- length of a rate limit window, in seconds, e.g. a few seconds to benchmark rate limit handling without waiting 15 minutes
+  latency -- seconds every call takes, on top of a uniform random share of latency_jitter seconds
+  ids_page_size -- the most ids served per page, smaller than Twitter's to make the crawler go through more pages
+  spurious_rate_limit_rate -- share of calls answered with a 429 even though the budget is not spent, as Twitter sometimes does
+  seed -- the random seed of the latency jitter and of the spurious 429s
+
+  '''
+
+  def __init__(self, dataset, endpoint_limits=None, rate_limit_window=FAKE_RATE_LIMIT_WINDOW, latency=0.0, latency_jitter=0.0, ids_page_size=IDS_PAGE_SIZE, spurious_rate_limit_rate=0.0, seed=0):
+    self.dataset = dataset
+    self.endpoint_limits = dict(FAKE_ENDPOINT_LIMITS, **(endpoint_limits or {}))
+    self.rate_limit_window = rate_limit_window
+    self.latency = latency
+    self.latency_jitter = latency_jitter
+    self.ids_page_size = ids_page_size
+    self.spurious_rate_limit_rate = spurious_rate_limit_rate
+    self.last_response = None
+    self.calls = Counter()
+    self.rate_limited_calls = Counter()
+    self._windows = {}
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+
+  def get_user(self, id=None, user_id=None, screen_name=None, **kwargs):
+    self._begin_call('get_user')
+    found_user_id = self.dataset.find_user_id(id, user_id, screen_name)
+    if found_user_id is None:
+      raise tweepy.TweepError([{'code': 50, 'message': 'User not found.'}], FakeResponse(404, self.last_response.headers), 50)
+    return tweepy.models.User.parse(self, self.dataset.users[found_user_id])
+
+  def lookup_users(self, user_ids=None, screen_names=None, **kwargs):
+    self._begin_call('lookup_users')
+    identifiers = [('user_id', user_id) for user_id in user_ids or []] + [('screen_name', screen_name) for screen_name in screen_names or []]
+    if len(identifiers) > LOOKUP_LIMIT:
+      raise tweepy.TweepError([{'code': 18, 'message': 'Too many terms specified in query.'}], FakeResponse(403, self.last_response.headers), 18)
+    found_user_ids = dict.fromkeys(
+      found_user_id for found_user_id in (self.dataset.find_user_id(**{parameter: identifier}) for parameter, identifier in identifiers)
+      if found_user_id is not None
+    )
+    if not found_user_ids:
+      raise tweepy.TweepError([{'code': 17, 'message': 'No user matches for specified terms.'}], FakeResponse(404, self.last_response.headers), 17)
+    return [tweepy.models.User.parse(self, self.dataset.users[found_user_id]) for found_user_id in found_user_ids]
+
+  @property
+  def followers_ids(self):
+    return self._ids_method('followers_ids', self.dataset.followers)
+
+  @property
+  def friends_ids(self):
+    return self._ids_method('friends_ids', self.dataset.friends)
+
+  def _ids_method(self, endpoint, ids_by_user):
+
+    def ids_call(id=None, user_id=None, screen_name=None, cursor=None, count=IDS_PAGE_SIZE, **kwargs):
+      self._begin_call(endpoint)
+      found_user_id = self.dataset.find_user_id(id, user_id, screen_name)
+      if found_user_id is None:
+        raise tweepy.TweepError([{'code': 34, 'message': 'Sorry, that page does not exist.'}], FakeResponse(404, self.last_response.headers), 34)
+      # Cursors are offsets into the id list, shifted by one so that 0 can mean the end like on Twitter
+      ids = ids_by_user.get(found_user_id, [])
+      start = 0 if cursor is None or int(cursor) == -1 else int(cursor) - 1
+      end = start + min(int(count), self.ids_page_size)
+      page = list(ids[start:end])
+      if cursor is None:
+        return page
+      return page, (-(start + 1) if start > 0 else 0, end + 1 if end < len(ids) else 0)
+
+    # Lets tweepy.Cursor paginate the fake methods like the real ones
+    ids_call.pagination_mode = 'cursor'
+    return ids_call
+
+  def _begin_call(self, endpoint):
+    with self._lock:
+      sleep_time = self.latency + self._random.uniform(0, self.latency_jitter) if self.latency or self.latency_jitter else 0
+      spurious_rate_limit = self.spurious_rate_limit_rate > 0 and self._random.random() < self.spurious_rate_limit_rate
+    if sleep_time > 0:
+      time.sleep(sleep_time)
+
+    with self._lock:
+      now = time.time()
+      limit = self.endpoint_limits.get(endpoint, FAKE_ENDPOINT_LIMITS['get_user'])
+      window = self._windows.get(endpoint)
+      if window is None or now >= window['reset_at']:
+        window = self._windows[endpoint] = {'remaining': limit, 'reset_at': now + self.rate_limit_window}
+      self.calls[endpoint] += 1
+      rate_limited = spurious_rate_limit or window['remaining'] <= 0
+      if not rate_limited:
+        window['remaining'] -= 1
+      headers = {
+        'x-rate-limit-limit': str(limit),
+        'x-rate-limit-remaining': str(0 if rate_limited else window['remaining']),
+        'x-rate-limit-reset': str(int(window['reset_at']) + 1)
+      }
+      if rate_limited:
+        self.rate_limited_calls[endpoint] += 1
+        self.last_response = FakeResponse(429, headers)
+      else:
+        self.last_response = FakeResponse(200, headers)
+
+    if rate_limited:
+      raise tweepy.RateLimitError([{'code': 88, 'message': 'Rate limit exceeded'}], self.last_response, 88)
+
+class RecordingAPI:
+
+  '''
+  Wraps a tweepy.API-like object, copying the users and follower/friend id pages it returns into a TwitterDataset, to be saved and replayed later through a FakeTwitterAPI.
+
+  Replays serve the ids recorded for each account, in the order they were recorded, so pages that were never fetched are missing from the replay.
+  '''
+
+  def __init__(self, api, dataset=None):
+    self.api = api
+    self.dataset = dataset if dataset is not None else TwitterDataset()
+
+  def __getattr__(self, name):
+    if name.startswith('_') or 'api' not in self.__dict__:
+      raise AttributeError(name)
+    return getattr(self.api, name)
+
+  def get_user(self, *args, **kwargs):
+    tweepy_user = self.api.get_user(*args, **kwargs)
+    self.dataset.add_user(tweepy_user._json)
+    return tweepy_user
+
+  def lookup_users(self, *args, **kwargs):
+    tweepy_users = self.api.lookup_users(*args, **kwargs)
+    for tweepy_user in tweepy_users:
+      self.dataset.add_user(tweepy_user._json)
+    return tweepy_users
+
+  @property
+  def followers_ids(self):
+    return self._recorded_ids_method('followers_ids', self.dataset.followers)
+
+  @property
+  def friends_ids(self):
+    return self._recorded_ids_method('friends_ids', self.dataset.friends)
+
+  def _recorded_ids_method(self, endpoint, ids_by_user):
+
+    def recorded_call(id=None, user_id=None, screen_name=None, cursor=None, **kwargs):
+      call_arguments = {name: value for name, value in (('id', id), ('user_id', user_id), ('screen_name', screen_name), ('cursor', cursor)) if value is not None}
+      result = getattr(self.api, endpoint)(**call_arguments, **kwargs)
+      page = result[0] if isinstance(result, tuple) else result
+      recorded_user_id = self.dataset.find_user_id(id, user_id, screen_name)
+      if recorded_user_id is None:
+        # The ids have to be filed under the account's id, so record the account first
+        recorded_user_id = self.get_user(id=id, user_id=user_id, screen_name=screen_name)._json['id']
+      if cursor is None or int(cursor) == -1:
+        ids_by_user[recorded_user_id] = []
+      ids_by_user.setdefault(recorded_user_id, []).extend(page)
+      return result
+
+    recorded_call.pagination_mode = 'cursor'
+    return recorded_call
+
+#region Helpers
+
+def fake_api_pool(dataset, number_of_keys=1, **options):
+  # One FakeTwitterAPI per emulated credential set, each with its own rate limit budgets, all serving the same dataset
+  seed = options.pop('seed', 0)
+  return [FakeTwitterAPI(dataset, seed=seed + key_index, **options) for key_index in range(number_of_keys)]
+
+#endregion
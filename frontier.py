@@ -0,0 +1,285 @@
+#region Imports
+
+# System libraries
+import time
+import heapq
+from collections import Counter
+
+# Custom libraries
+import utils
+import clients
+import sampling
+
+#endregion
+
+#region Constants
+
+# Reference accounts are at depth 0, their followers at depth 1, followers of followers at depth 2, and so on
+FRONTIER_MAX_DEPTH = 2
+
+# Crawled accounts kept in memory before they are written to the database
+FRONTIER_FLUSH_SIZE = 100
+
+# The heap is rebuilt without its outdated entries once they outnumber the pending nodes, and it has at least this many entries
+FRONTIER_COMPACTION_MIN_ENTRIES = 1024
+
+#endregion
+
+#region Priorities
+
+# A priority takes a FrontierNode and returns a number (or a tuple of numbers), the pending node with the highest one is crawled next
+
+def tagged_neighbours_priority(node):
+  # Accounts following many of the tagged accounts crawled so far get the most reliable tags, then the closest to the reference accounts
+  return (node.tagged_neighbours, -node.depth)
+
+def followers_count_priority(node):
+  # Needs the profile, so nodes that were not looked up yet come first to get one, 100 per lookup
+  if node.profile is None:
+    return (float('inf'), 0)
+  return (node.profile['followers_count'], 0)
+
+#endregion
+
+class FrontierNode:
+
+  '''
+  An account discovered by the crawl.
+
+  Attributes:
+  ===
+  user_id -- the Twitter id of the account
+  depth -- the fewest follower hops from a reference account
+  tags -- Counter of the tags of the crawled accounts it follows (the reference accounts' categories, then the tags they passed on)
+  tagged_neighbours -- the number of crawled accounts with tags it follows
+  profile -- the account's user JSON once looked up, None before
+  discovery_order -- the number of accounts discovered before it, breaking priority ties
+
+  '''
+
+  __slots__ = ('user_id', 'depth', 'tags', 'tagged_neighbours', 'profile', 'discovery_order', 'version')
+
+  def __init__(self, user_id, depth, discovery_order, profile=None):
+    self.user_id = user_id
+    self.depth = depth
+    self.discovery_order = discovery_order
+    self.tags = Counter()
+    self.tagged_neighbours = 0
+    self.profile = profile
+    # Bumped whenever the node is queued again with a new priority, so older heap entries can be told apart
+    self.version = 0
+
+class CrawlFrontier:
+
+  '''
+  Priority queue of the accounts left to crawl, expanded from the reference accounts through their followers up to max_depth hops.
+
+  Priorities change as accounts are crawled, so a node is queued again whenever its priority may have changed, and the outdated entries are skipped when they come up, or dropped all at once when they outnumber the pending nodes.
+
+  Keyword Arguments:
+  ===
+  max_depth -- the deepest hop crawled, the accounts at that depth are crawled but not expanded
+  priority -- the priority function (see tagged_neighbours_priority)
+
+  '''
+
+  def __init__(self, max_depth=FRONTIER_MAX_DEPTH, priority=tagged_neighbours_priority):
+    self.max_depth = max_depth
+    self.priority = priority
+    self.nodes = {}
+    self.done_ids = set()
+    self._heap = []
+    self._nodes_discovered = 0
+
+  def __len__(self):
+    return len(self.nodes)
+
+  def add_seed(self, profile, tags):
+    node = self.nodes[profile['id']] = self._new_node(profile['id'], 0, profile)
+    node.tags.update(tags)
+    self._push(node)
+
+  def add_followers(self, crawled_node, follower_ids):
+    # The followers of a crawled account inherit its tags, and are one hop further from the reference accounts
+    if crawled_node.depth >= self.max_depth:
+      return
+    crawled_tags = list(crawled_node.tags)
+    for follower_id in follower_ids:
+      if follower_id in self.done_ids:
+        continue
+      node = self.nodes.get(follower_id)
+      if node is None:
+        node = self.nodes[follower_id] = self._new_node(follower_id, crawled_node.depth + 1)
+      node.depth = min(node.depth, crawled_node.depth + 1)
+      if crawled_tags:
+        node.tags.update(crawled_tags)
+        node.tagged_neighbours += 1
+      self._push(node)
+
+  def set_profile(self, node, profile):
+    node.profile = profile
+    self._push(node)
+
+  def pop(self):
+    # The pending node with the highest priority, None once the frontier is empty
+    while self._heap:
+      _, _, user_id, version = heapq.heappop(self._heap)
+      node = self.nodes.get(user_id)
+      if node is not None and node.version == version:
+        del self.nodes[user_id]
+        return node
+    return None
+
+  def pop_unscreened(self, batch_size):
+    # Takes up to batch_size of the nodes that come next and still need their profile, stopping at the first node that has one
+    unscreened_nodes = []
+    while self._heap and len(unscreened_nodes) < batch_size:
+      _, _, user_id, version = self._heap[0]
+      node = self.nodes.get(user_id)
+      if node is None or node.version != version:
+        heapq.heappop(self._heap)
+        continue
+      if node.profile is not None:
+        break
+      heapq.heappop(self._heap)
+      # Queued again once the profile is set
+      node.version += 1
+      unscreened_nodes.append(node)
+    return unscreened_nodes
+
+  def requeue(self, nodes):
+    # Queues nodes taken by pop_unscreened again, e.g. when their lookup failed
+    for node in nodes:
+      if node.user_id in self.nodes:
+        self._push(node)
+
+  def drop(self, node):
+    self.nodes.pop(node.user_id, None)
+    self.done_ids.add(node.user_id)
+
+  def _new_node(self, user_id, depth, profile=None):
+    self._nodes_discovered += 1
+    return FrontierNode(user_id, depth, self._nodes_discovered, profile)
+
+  def _push(self, node):
+    node.version += 1
+    # heapq is a min-heap, so priorities are negated; ties go to the node discovered first, however often it was queued again
+    priority = self.priority(node)
+    negated_priority = tuple(-value for value in priority) if isinstance(priority, tuple) else -priority
+    heapq.heappush(self._heap, (negated_priority, node.discovery_order, node.user_id, node.version))
+    if len(self._heap) >= FRONTIER_COMPACTION_MIN_ENTRIES and len(self._heap) > 2 * len(self.nodes):
+      self._compact()
+
+  def _compact(self):
+    # Keeps only the latest entry of each pending node
+    self._heap = [
+      entry for entry in self._heap
+      if entry[2] in self.nodes and self.nodes[entry[2]].version == entry[3]
+    ]
+    heapq.heapify(self._heap)
+
+def crawl_frontier(top_users_by_category, max_depth=FRONTIER_MAX_DEPTH, priority=tagged_neighbours_priority, max_api_calls=None, max_seconds=None, follower_sampler=None, page_limits=None):
+
+  '''
+  Crawls outwards from the reference accounts through their followers, up to max_depth hops, always crawling the pending account with the highest priority next, and stores every crawled account into the database as a UserInfo object with its friends and followers (only its friends at max_depth, as its followers are not crawled).
+
+  The crawl stops once every account within max_depth is crawled, as soon as a budget is spent, or when a profile lookup fails (the accounts it was for stay pending). Budgets are checked before each account, so the last account can go over them by its own calls. The accounts crawled are written to the database however the crawl stops.
+
+  Keyword Arguments:
+  ===
+  top_users_by_category -- a dictionary of categories, with the values being the list of (handle, followers) of the reference accounts of that category, as returned by get_top_users_by_followers
+  max_depth -- the deepest hop crawled (1 for the followers of the reference accounts, 2 for their followers too)
+  priority -- the priority function ordering the pending accounts, e.g. tagged_neighbours_priority or followers_count_priority
+  max_api_calls -- the most Twitter calls made, counted by the rate limit scheduler (cached answers are free); no limit when None
+  max_seconds -- the most seconds spent crawling; no limit when None
+  follower_sampler -- the sampling.FollowerSampler whose thresholds accounts have to pass to be crawled, the default thresholds when None
+  page_limits -- the most id pages fetched per account for 'friends' and 'followers', see utils.tweepy_user_to_userinfo_object
+
+  return: crawl_report -- the number of accounts 'crawled', 'screened_out' and 'failed', the 'pending' ones left, the 'api_calls' and 'seconds' spent, the deepest hop crawled as 'max_depth_crawled', the database 'write_counts', and the reason the crawl 'stopped' ('frontier_exhausted', 'api_budget', 'time_budget' or 'lookup_failed')
+
+  '''
+
+  import tweepy
+
+  follower_sampler = follower_sampler or sampling.FollowerSampler()
+  api = clients.get_api()
+  started_at = time.time()
+  calls_made_at_start = api_calls_made(api)
+  crawl_report = {'crawled': 0, 'screened_out': 0, 'failed': 0, 'max_depth_crawled': 0, 'write_counts': {'inserted': 0, 'updated': 0}}
+
+  account_frontier = CrawlFrontier(max_depth, priority)
+  tags_by_handle = {}
+  for category, category_data in top_users_by_category.items():
+    for user_data in category_data:
+      tags_by_handle.setdefault(user_data[0], []).append(category)
+  reference_handles = list(tags_by_handle)
+  for handle, tweepy_user_object in zip(reference_handles, utils.lookup_users(reference_handles)):
+    if tweepy_user_object is None:
+      print("Failed to find that user, Skipping...")
+      continue
+    account_frontier.add_seed(tweepy_user_object._json, tags_by_handle[handle])
+
+  userinfo_objects_to_add = []
+  crawl_report['stopped'] = 'frontier_exhausted'
+  while True:
+    if max_api_calls is not None and api_calls_made(api) - calls_made_at_start >= max_api_calls:
+      crawl_report['stopped'] = 'api_budget'
+      break
+    if max_seconds is not None and time.time() - started_at >= max_seconds:
+      crawl_report['stopped'] = 'time_budget'
+      break
+
+    # Screen the accounts coming next with batched profile lookups before spending id pages on them
+    unscreened_nodes = account_frontier.pop_unscreened(utils.LOOKUP_BATCH_SIZE)
+    if unscreened_nodes:
+      try:
+        tweepy_user_objects = utils.lookup_users([node.user_id for node in unscreened_nodes])
+      except tweepy.TweepError:
+        print("Failed to look up the next accounts, Stopping...")
+        account_frontier.requeue(unscreened_nodes)
+        crawl_report['stopped'] = 'lookup_failed'
+        break
+      for node, tweepy_user_object in zip(unscreened_nodes, tweepy_user_objects):
+        if tweepy_user_object is None or tweepy_user_object._json.get('protected') or not follower_sampler.qualifies(tweepy_user_object._json):
+          account_frontier.drop(node)
+          crawl_report['screened_out'] += 1
+        else:
+          account_frontier.set_profile(node, tweepy_user_object._json)
+      continue
+
+    node = account_frontier.pop()
+    if node is None:
+      break
+    account_frontier.done_ids.add(node.user_id)
+    # The followers of the accounts at max_depth are never crawled, so only their friends, which tags travel along, are fetched and stored
+    expanded = node.depth < max_depth
+    try:
+      userinfo_object = utils.tweepy_user_to_userinfo_object(tweepy.models.User.parse(api, node.profile), 'lazy', page_limits)
+      userinfo_object.load_adjacency(('friends', 'followers') if expanded else ('friends',))
+    except tweepy.TweepError:
+      print("Failed to run the command on that user, Skipping...")
+      crawl_report['failed'] += 1
+      continue
+    crawl_report['crawled'] += 1
+    crawl_report['max_depth_crawled'] = max(crawl_report['max_depth_crawled'], node.depth)
+    if expanded:
+      account_frontier.add_followers(node, userinfo_object.followers)
+
+    userinfo_objects_to_add.append(userinfo_object)
+    if len(userinfo_objects_to_add) >= FRONTIER_FLUSH_SIZE:
+      utils.add_write_counts(crawl_report['write_counts'], utils.add_userinfo_to_db(userinfo_objects_to_add))
+      userinfo_objects_to_add = []
+
+  utils.add_write_counts(crawl_report['write_counts'], utils.add_userinfo_to_db(userinfo_objects_to_add))
+  crawl_report['pending'] = len(account_frontier)
+  crawl_report['api_calls'] = api_calls_made(api) - calls_made_at_start
+  crawl_report['seconds'] = time.time() - started_at
+  return crawl_report
+
+#region Helpers
+
+def api_calls_made(api):
+  # Counted by scheduler.RateLimitScheduler, also through the response cache; clients without a count never run out of budget
+  return getattr(api, 'calls_made', 0)
+
+#endregion
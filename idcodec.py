@@ -0,0 +1,176 @@
+#region Imports
+
+# System libraries
+from array import array
+
+# Third party libraries (pip)
+import numpy as np # https://numpy.org/doc/stable/
+
+#endregion
+
+#region Constants
+
+# Number of ids decoded at a time when iterating over an encoded list
+DECODE_BLOCK_SIZE = 4096
+
+# A 64-bit value takes at most 10 groups of 7 bits
+MAX_VARINT_BYTES = 10
+
+#endregion
+
+# Lists of Twitter ids (friends, followers) are encoded by sorting them, delta-encoding them (each id is stored as its
+# difference with the previous one, the first one as is) and writing each delta as an unsigned LEB128 varint: 7 bits per
+# byte, least significant group first, with the high bit set on every byte but the last of a value. Both directions are
+# vectorized with numpy, and an encoded list is plain bytes, so it is stored as BSON binary. The order of the ids is not
+# kept, duplicates are.
+
+def encode_ids(ids):
+
+  '''
+  Encodes a list of ids.
+
+  Keyword Arguments:
+  ===
+  ids -- any iterable of non-negative 64-bit ids (list, array('q'), numpy array)
+
+  return: the encoded ids, as bytes
+
+  '''
+
+  values = np.sort(as_id_array(ids))
+  if len(values) == 0:
+    return b''
+  if values[0] < 0:
+    raise ValueError('Only non-negative ids can be encoded')
+
+  deltas = np.diff(values, prepend=np.int64(0)).astype(np.uint64)
+  byte_counts = np.ones(len(deltas), dtype=np.int64)
+  for group in range(1, MAX_VARINT_BYTES):
+    byte_counts += deltas >= np.uint64(1) << np.uint64(7 * group)
+  value_ends = np.cumsum(byte_counts)
+  value_starts = value_ends - byte_counts
+
+  # Write the k-th byte of every value that has more than k bytes, one vectorized pass per byte position
+  encoded = np.empty(value_ends[-1], dtype=np.uint8)
+  for group in range(int(byte_counts.max())):
+    has_group = byte_counts > group
+    group_bits = (deltas[has_group] >> np.uint64(7 * group)) & np.uint64(0x7f)
+    continuation = np.where(byte_counts[has_group] > group + 1, np.uint64(0x80), np.uint64(0))
+    encoded[value_starts[has_group] + group] = group_bits | continuation
+
+  return encoded.tobytes()
+
+def decode_ids(encoded_ids):
+
+  '''
+  Decodes a list of ids encoded by encode_ids.
+
+  Keyword Arguments:
+  ===
+  encoded_ids -- the encoded ids, as bytes or any buffer
+
+  return: the sorted ids, as an int64 numpy array
+
+  '''
+
+  return np.cumsum(decode_deltas(np.frombuffer(encoded_ids, dtype=np.uint8))).astype(np.int64)
+
+def decode_ids_to_array(encoded_ids):
+  # Same as decode_ids, as the packed array('q') buffer UserInfo holds
+  ids = array('q')
+  ids.frombytes(decode_ids(encoded_ids).tobytes())
+  return ids
+
+def iter_ids(encoded_ids, block_size=DECODE_BLOCK_SIZE):
+
+  '''
+  Decodes a list of ids encoded by encode_ids while iterating over it, block_size ids at a time, without materializing the whole list.
+
+  Keyword Arguments:
+  ===
+  encoded_ids -- the encoded ids, as bytes or any buffer
+  block_size -- the number of ids decoded at a time
+
+  return: a generator of the sorted ids, as Python ints
+
+  '''
+
+  encoded = np.frombuffer(encoded_ids, dtype=np.uint8)
+  # The last byte of each value is the only one without its high bit set
+  value_ends = np.flatnonzero(encoded < 0x80) + 1
+  previous_id = np.uint64(0)
+  block_start = 0
+  for block_end in value_ends[block_size - 1::block_size].tolist() + [len(encoded)]:
+    if block_end <= block_start:
+      continue
+    block_ids = np.cumsum(decode_deltas(encoded[block_start:block_end])) + previous_id
+    previous_id = block_ids[-1]
+    block_start = block_end
+    yield from block_ids.astype(np.int64).tolist()
+
+def decode_deltas(encoded):
+  # Rebuild each varint by OR-ing its 7-bit groups shifted into place
+  if len(encoded) == 0:
+    return np.zeros(0, dtype=np.uint64)
+  is_last_byte = encoded < 0x80
+  if not is_last_byte[-1]:
+    raise ValueError('Truncated id list')
+  value_starts = np.concatenate(([0], np.flatnonzero(is_last_byte)[:-1] + 1))
+  value_of_byte = np.repeat(np.arange(len(value_starts)), np.diff(np.append(value_starts, len(encoded))))
+  shifts = (np.arange(len(encoded)) - value_starts[value_of_byte]).astype(np.uint64) * np.uint64(7)
+  groups = (encoded & 0x7f).astype(np.uint64) << shifts
+  return np.bitwise_or.reduceat(groups, value_starts)
+
+def as_id_array(ids):
+  if isinstance(ids, PackedIds):
+    return ids.to_numpy()
+  if isinstance(ids, array) and ids.typecode == 'q':
+    return np.frombuffer(ids, dtype=np.int64)
+  return np.fromiter(ids, dtype=np.int64) if not isinstance(ids, (list, tuple, np.ndarray)) else np.asarray(ids, dtype=np.int64)
+
+class PackedIds:
+
+  '''
+  In-memory encoded list of ids, usable as UserInfo.friends or UserInfo.followers in place of an array('q') for accounts with large adjacency lists. It takes less memory than the packed 64-bit buffer, the denser the ids the less, and is decoded on access.
+
+  Attributes:
+  ===
+  data -- the ids encoded by encode_ids, as bytes
+
+  '''
+
+  __slots__ = ('data', '_length')
+
+  def __init__(self, data=b''):
+    self.data = bytes(data)
+    self._length = int(np.count_nonzero(np.frombuffer(self.data, dtype=np.uint8) < 0x80))
+
+  @classmethod
+  def from_ids(cls, ids):
+    return cls(encode_ids(ids))
+
+  def __len__(self):
+    return self._length
+
+  def __iter__(self):
+    return iter_ids(self.data)
+
+  def __eq__(self, other):
+    if isinstance(other, PackedIds):
+      return self.data == other.data
+    return NotImplemented
+
+  def __hash__(self):
+    return hash(self.data)
+
+  def __repr__(self):
+    return 'PackedIds({0} ids, {1} bytes)'.format(self._length, len(self.data))
+
+  def to_numpy(self):
+    return decode_ids(self.data)
+
+  def to_array(self):
+    return decode_ids_to_array(self.data)
+
+  def tolist(self):
+    return self.to_numpy().tolist()
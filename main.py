@@ -1,29 +1,18 @@
 #region Imports & Init API variables
 
 # System libraries
+import os
 import json
 import random
-import copy
-import pprint
-
-# Third party libraries (pip)
-import tweepy # https://tweepy.readthedocs.io/en/latest/index.html
-from googlesearch import search # https://github.com/MarioVilas/googlesearch
-import pandas as pd
-import networkx as nx # https://networkx.github.io/documentation/stable/install.html
-from faker import Faker # https://faker.readthedocs.io/en/stable/
+import argparse
 
 # Custom libraries
 import utils
 import classes
+import checkpoint
+import sampling
 
-# Open credentials.json and load the information to create the tweepy API object for queries
-with open('credentials.json') as credentials_file:
-  credentials = json.load(credentials_file)
-
-auth = tweepy.OAuthHandler(credentials['consumer_key'], credentials['consumer_secret'])
-auth.set_access_token(credentials['access_token'], credentials['access_token_secret'])
-api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True, compression=True)
+# networkx and the graph, storage and crawl modules (csrgraph, propagation, pruning, tagindex, snapshot, refresh, pipeline and frontier) are imported where they are used, as networkx, numpy and scipy take much longer to import than the rest, so importing main stays fast (see TestImportTime)
 
 #endregion
 
@@ -59,121 +48,221 @@ def get_top_users_by_followers(category_list, reference_accounts_by_category):
   '''
 
   top_users_by_category = {}
-  
+
+  # Resolve every reference account of the requested categories in batched lookups
+  handles_to_lookup = [
+    account_handle
+    for category, users_in_category in reference_accounts_by_category.items() if category in category_list
+    for account_handle in users_in_category
+  ]
+  tweepy_user_objects = dict(zip(handles_to_lookup, utils.lookup_users(handles_to_lookup)))
+
   for category in reference_accounts_by_category.keys():
+    if category not in category_list:
+      continue
     users_in_category = reference_accounts_by_category[category]
     for account_handle in users_in_category:
       print(account_handle)
-      tweepy_user_object = api.get_user(account_handle)
+      tweepy_user_object = tweepy_user_objects[account_handle]
+      if tweepy_user_object is None:
+        print("Failed to find that user, Skipping...")
+        continue
       num_followers = tweepy_user_object._json['followers_count']
-      if category in category_list:
-        if category not in top_users_by_category.keys():
-          top_users_by_category[category] = [(account_handle, num_followers)]
-        else:
-          top_users_by_category[category].append((account_handle, num_followers))
+      if category not in top_users_by_category.keys():
+        top_users_by_category[category] = [(account_handle, num_followers)]
+      else:
+        top_users_by_category[category].append((account_handle, num_followers))
 
   for category, category_data in top_users_by_category.items():
     top_users_by_category[category] = sorted(category_data, key=lambda tup: tup[1], reverse=True)[:9]
 
   return top_users_by_category
 
-def get_users(top_users_by_category):
+def get_users(top_users_by_category=None, resume=False, checkpoint_path=checkpoint.CHECKPOINT_PATH, follower_sampler=None, concurrency=1, frontier_options=None):
 
   '''
-  Gets all followers of each user in top_users_by_category that follows 5 or more other accounts, and stores them into the database as a UserInfo object.
+  Gets a uniform sample of the followers of each user in top_users_by_category that follow 10 or more accounts and have 5 or more followers, and stores them into the database as UserInfo objects, along with the users themselves.
+
+  The crawl state (follower cursors, sampled and already processed follower ids, and the accounts left to crawl) is checkpointed periodically, with the UserInfo objects gathered so far flushed to the database at each checkpoint.
 
   Keyword Arguments:
   ===
-  top_users_by_category -- a dictionary of categories, with the values being the list of users of that category, sorted by followers descending
+  top_users_by_category -- a dictionary of categories, with the values being the list of users of that category, sorted by followers descending (not needed when resuming)
+  resume -- continue the crawl saved at checkpoint_path instead of starting a new one
+  checkpoint_path -- the file the crawl state is saved to
+  follower_sampler -- the sampling.FollowerSampler choosing the followers of each user, a stratified sampler of 10 followers when None
+  concurrency -- 1 to make one Twitter call at a time, or the number of accounts crawled at once by the concurrent pipeline (see pipeline.GatheringPipeline), for crawls bound by network latency rather than rate limits
+  frontier_options -- to crawl outwards from the reference accounts by priority instead (see frontier.crawl_frontier), the dictionary of its options, e.g. {'max_depth': 2, 'max_api_calls': 10000}, which may be empty; that crawl is not checkpointed and takes one account at a time, so resume, checkpoint_path and concurrency do not apply
 
-  return: result_ids -- the ObjectIds of the UserInfo objects that have been inserted into the database
+  return: write_counts -- the number of UserInfo objects 'inserted' into the database, and of those already there that were 'updated'
 
   '''
-  userinfo_objects_to_add = []
-  already_processed_follower_ids = []
 
-  for category, category_data in top_users_by_category.items():
-    for user_data in category_data:
-      tweepy_user_object = api.get_user(user_data[0])
-      userinfo_object = utils.tweepy_user_to_userinfo_object(tweepy_user_object)
-      current_user_followers = []
-      # # =================
-      for page in tweepy.Cursor(api.followers_ids, screen_name=user_data[0]).pages(1):
-        for follower_id in random.sample(page, 10):
-          if follower_id not in already_processed_follower_ids:
-            try:
-              follower_user_object = api.get_user(follower_id)
-              print(follower_user_object)
-              if follower_user_object._json['friends_count'] >= 10 and follower_user_object._json['followers_count'] >= 5 and follower_id not in already_processed_follower_ids:
-                follower_userinfo_object = utils.tweepy_user_to_userinfo_object(follower_user_object)
-                userinfo_objects_to_add.append(follower_userinfo_object)
-                current_user_followers.append(follower_id)
-            except tweepy.TweepError:
-              print("Failed to run the command on that user, Skipping...")
-              continue
-          already_processed_follower_ids.append(follower_id)
-      userinfo_object.followers = current_user_followers
-      userinfo_objects_to_add.append(userinfo_object)
-      # =================
-      # for page in tweepy.Cursor(api.followers_ids, screen_name=user_data[0]).pages():
-      #   for follower_id in page:
-      #     if follower_id not in already_processed_follower_ids:
-      #       try:
-      #         follower_user_object = api.get_user(follower_id)
-      #         if follower_user_object._json['friends_count'] >= 10 and follower_id not in already_processed_follower_ids:
-      #           follower_userinfo_object = utils.tweepy_user_to_userinfo_object(follower_user_object)
-      #           followers_to_add.append(follower_userinfo_object)
-      #       except tweepy.TweepError:
-      #         print("Failed to run the command on that user, Skipping...")
-      #         continue
-      #     already_processed_follower_ids.append(follower_id)
-
-  print(userinfo_objects_to_add)
-  result_ids = utils.add_userinfo_to_db(userinfo_objects_to_add)
-  
-  return result_ids
+  follower_sampler = follower_sampler or sampling.FollowerSampler()
+
+  if frontier_options is not None:
+    import frontier
+    crawl_report = frontier.crawl_frontier(top_users_by_category, follower_sampler=follower_sampler, **frontier_options)
+    print(crawl_report)
+    return crawl_report['write_counts']
+
+  if resume and os.path.exists(checkpoint_path):
+    crawl_state = checkpoint.CrawlState.load(checkpoint_path)
+  else:
+    crawl_state = checkpoint.CrawlState(top_users_by_category)
+
+  # Resolve all the reference accounts left to crawl up front in batched lookups
+  reference_handles = list(crawl_state.pending_accounts)
+  reference_user_objects = dict(zip(reference_handles, utils.lookup_users(reference_handles)))
+
+  if concurrency > 1:
+    import pipeline
+    write_counts = pipeline.gather_users(crawl_state, reference_user_objects, follower_sampler, checkpoint_path, concurrency)
+  else:
+    write_counts = gather_users_serially(crawl_state, reference_user_objects, follower_sampler, checkpoint_path)
+
+  # The crawl is complete, so there is nothing left to resume
+  if os.path.exists(checkpoint_path):
+    os.remove(checkpoint_path)
+
+  return write_counts
+
+def gather_users_serially(crawl_state, reference_user_objects, follower_sampler, checkpoint_path):
+
+  '''
+  Runs the get_users crawl one Twitter call at a time.
+
+  Keyword Arguments:
+  ===
+  crawl_state -- the checkpoint.CrawlState of the crawl, new or resumed
+  reference_user_objects -- dictionary of the handles of crawl_state.pending_accounts to their tweepy.User objects (None for accounts that were not found)
+  follower_sampler -- the sampling.FollowerSampler choosing the followers of each account
+  checkpoint_path -- the file the crawl state is saved to
+
+  return: write_counts -- the number of UserInfo objects 'inserted' into the database, and of those already there that were 'updated'
+
+  '''
+
+  import tweepy
+
+  userinfo_objects_to_add = []
+  write_counts = {'inserted': 0, 'updated': 0}
+
+  for handle in list(crawl_state.pending_accounts):
+    tweepy_user_object = reference_user_objects[handle]
+    if tweepy_user_object is None:
+      print("Failed to find that user, Skipping...")
+      crawl_state.finish_account(handle)
+      continue
+    progress = crawl_state.get_account_progress(handle)
+    fetch_page = lambda cursor, handle=handle: utils.get_ids_page('followers', handle, cursor)
+
+    # Stop as soon as enough followers qualify, or once the sampler has walked its page budget
+    while not follower_sampler.is_complete(progress):
+      if not progress['sampled_follower_ids']:
+        progress['sampled_follower_ids'] = follower_sampler.next_candidates(progress, fetch_page, tweepy_user_object._json['followers_count'], crawl_state.seen_follower_ids, handle)
+        if not progress['sampled_follower_ids']:
+          break
+
+      sampled_follower_ids = progress['sampled_follower_ids']
+      # Screen the candidates with a single batched profile lookup
+      for sample_index, follower_user_object in enumerate(utils.lookup_users(sampled_follower_ids)):
+        follower_id = sampled_follower_ids[sample_index]
+        progress['sampled_follower_ids'] = sampled_follower_ids[sample_index + 1:]
+        if follower_user_object is None:
+          print("Failed to find that user, Skipping...")
+        else:
+          try:
+            print(follower_user_object)
+            if follower_sampler.qualifies(follower_user_object._json) and follower_id not in crawl_state.seen_follower_ids:
+              # Fetched here rather than on first access, so that protected accounts are skipped
+              follower_userinfo_object = utils.tweepy_user_to_userinfo_object(follower_user_object, adjacency='eager')
+              userinfo_objects_to_add.append(follower_userinfo_object)
+              progress['followers'].append(follower_id)
+          except tweepy.TweepError:
+            print("Failed to run the command on that user, Skipping...")
+            continue
+        crawl_state.seen_follower_ids.add(follower_id)
+        # Flush as the crawl goes, so memory stays flat however many users are gathered
+        if crawl_state.is_save_due() or len(userinfo_objects_to_add) >= utils.WRITE_CHUNK_SIZE:
+          utils.add_write_counts(write_counts, save_crawl_checkpoint(crawl_state, userinfo_objects_to_add, checkpoint_path))
+          userinfo_objects_to_add = []
+        # The candidates left are not needed once the sample is full
+        if follower_sampler.is_complete(progress):
+          progress['sampled_follower_ids'] = []
+          break
+
+    # Only the friends of a reference account are fetched, its followers are the sampled ones
+    userinfo_object = utils.tweepy_user_to_userinfo_object(tweepy_user_object)
+    userinfo_object.followers = progress['followers']
+    userinfo_object.followers_sampled = True
+    # Loaded here, as lists that are not loaded are left out of the database write
+    try:
+      userinfo_object.load_adjacency(('friends',))
+    except tweepy.TweepError:
+      print("Failed to get the friends of that user, Skipping them...")
+      userinfo_object.friends = ()
+    userinfo_objects_to_add.append(userinfo_object)
+    crawl_state.finish_account(handle)
+    utils.add_write_counts(write_counts, save_crawl_checkpoint(crawl_state, userinfo_objects_to_add, checkpoint_path))
+    userinfo_objects_to_add = []
+
+  return write_counts
 
 #endregion
 
 #region Part 2: Constructing the graph
 
-def users_to_graph(users):
+def users_to_graph(users, fetch_unknown_users=True, backend='networkx'):
 
   '''
   Converts a given list of UserInfo objects into a directed graph.
 
   Keyword Arguments:
   ===
-  users -- the list of UserInfo objects as nodes in the graph
+  users -- the list (or any iterable) of UserInfo objects as nodes in the graph
+  fetch_unknown_users -- whether friends and followers that are not among users are looked up on Twitter, in one batch after all the edges are added (profiles and counts only, without their own id lists), or left as stub nodes (e.g. for offline work)
+  backend -- 'networkx' for a networkx.DiGraph with a UserInfo object on each node, or 'csr' for a compact csrgraph.CSRGraph, for graphs with too many edges to hold as Python objects
 
   return: a directed graph representing the given UserInfo objects
 
   '''
-  
+
+  if backend == 'csr':
+    import csrgraph
+    return csrgraph.CSRGraph.from_userinfo(users, lookup_stub_userinfo_objects if fetch_unknown_users else None)
+
+  import networkx as nx # https://networkx.github.io/documentation/stable/install.html
   # foreach user in users, create an node in the graph, and link it to it's followers and friends as edges
   users_graph = nx.DiGraph()
+  userinfo_by_id = {}
   for user in users:
-    if user.id not in users_graph.nodes:
-    # Add a new node with the id as the node identifer
-      users_graph.add_node(user.id, userinfo=user)
+    if user.id not in userinfo_by_id:
+      # Add a new node with the id as the node identifer
+      userinfo_by_id[user.id] = user
+      users_graph.add_node(user.id)
     # Add directed edges with friends and followers
-    for friendid in user.friends:
-      if friendid not in users_graph.nodes:
-        friend_user = next((n_user for n_user in users if n_user.id == friendid), None)
-        if friend_user is None:
-          friend_user = utils.tweepy_user_to_userinfo_object(api.get_user(friendid))
-        users_graph.add_node(friendid, userinfo=friend_user)
-      users_graph.add_edge(user.id, friendid)
-    for followerid in user.followers:
-      if followerid not in users_graph.nodes:
-        follower_user = next((n_user for n_user in users if n_user.id == followerid), None)
-        if follower_user is None:
-          follower_user = utils.tweepy_user_to_userinfo_object(api.get_user(followerid))
-        users_graph.add_node(followerid, userinfo=follower_user)
-      users_graph.add_edge(followerid, user.id)
+    users_graph.add_edges_from((user.id, friendid) for friendid in user.friends)
+    users_graph.add_edges_from((followerid, user.id) for followerid in user.followers)
+
+  # Friends and followers that are not among users are resolved together once every edge is known
+  unknown_user_ids = [user_id for user_id in users_graph.nodes if user_id not in userinfo_by_id]
+  if fetch_unknown_users:
+    unknown_users = lookup_stub_userinfo_objects(unknown_user_ids)
+  else:
+    unknown_users = [None] * len(unknown_user_ids)
+  for unknown_user_id, unknown_user in zip(unknown_user_ids, unknown_users):
+    # Accounts that no longer exist, or were not looked up, are kept as stub nodes
+    userinfo_by_id[unknown_user_id] = unknown_user if unknown_user is not None else classes.UserInfo(id=unknown_user_id)
+
+  nx.set_node_attributes(users_graph, userinfo_by_id, 'userinfo')
 
   return users_graph
 
+def lookup_stub_userinfo_objects(user_ids):
+  # Nodes outside users only contribute the edges already known, so their own friends and followers are never fetched
+  return utils.lookup_userinfo_objects(user_ids, adjacency='counts')
+
 def assign_top_level_categories(users_graph, top_level_userinfo_objects):
 
   ''' 
@@ -192,6 +281,7 @@ def assign_top_level_categories(users_graph, top_level_userinfo_objects):
   # e.g. user_graph['node_A']
   # To access the node's attributes, it's simply user_graph['node_A'].attribute_A
 
+  import networkx as nx # https://networkx.github.io/documentation/stable/install.html
   users_graph_handles = nx.get_node_attributes(users_graph, 'handle').values()
   for top_level_userinfo in top_level_userinfo_objects:
     userinfo_tags = next((x[1] for x in top_level_reference_accounts if x[0] == top_level_userinfo_objects.handle.lower()), None)
@@ -212,33 +302,63 @@ def assign_top_level_categories(users_graph, top_level_userinfo_objects):
 
 #region Part 3: Categorization & Propagation
 
-def propagate_tags(users_graph):
-
-  users_graph_copy = copy.copy(users_graph)
-  # https://stackoverflow.com/questions/21627457/looping-through-nodes-and-extract-attributes-in-networkx
-  # First pass, the order matters, need to figure out when it shouldn't
-  for user_id, user_attributes in users_graph.nodes(data=True):
-    # e.x (873588304690, {'userinfo': <classes.UserInfo object at 0x000002BB4E0B2390>})
-    # user_attributes is all the attributes assigned to the node
-    userinfo_object = user_attributes['userinfo']
-    current_user_friends_tags = []
-    for friend_id in userinfo_object.friends:
-      friend_tags = tags_from_friend(users_graph_copy, friend_id)
-      current_user_friends_tags.extend(friend_tags)
-    userinfo_object.tags = list(set(userinfo_object.tags + current_user_friends_tags))
-  
+def propagate_tags(users_graph, hops=None, decay=None, tolerance=None, changed_node_ids=None, workers=1, graph_pruner=None, seed_tags=None):
+
+  '''
+  Propagates the tags of the tagged (e.g. top-level) nodes to the accounts that follow them, for up to hops levels, following the plan in categorize_node.
+
+  Each node's tags are replaced by its propagated tags, ranked by score, and the full scores are kept as users_graph.graph['tag_scores']. The result does not depend on node order.
+
+  Keyword Arguments:
+  ===
+  users_graph -- the graph of users to propagate tags over, a networkx.DiGraph or a csrgraph.CSRGraph
+  hops -- the maximum number of levels tags travel, propagation.DEFAULT_HOPS when None
+  decay -- the weight of a tag coming from one level further away, propagation.DEFAULT_DECAY when None
+  tolerance -- stop early once the scores stop changing by more than this, propagation.DEFAULT_TOLERANCE when None
+  changed_node_ids -- for a graph that was already propagated, the ids of the nodes added or changed since (including the followers of added or removed edges), to only recompute the nodes they affect instead of the whole graph
+  workers -- the number of processes a full propagation is spread over, None for one per core (see propagation.propagate_graph)
+  graph_pruner -- optionally, the pruning.GraphPruner whose core a full propagation runs on, the pruned nodes getting their tags in a final pass (see pruning.propagate_pruned); its report is kept as users_graph.graph['pruning_report']
+  seed_tags -- optional dictionary of node id to new seed tags, e.g. for a newly tagged reference account (list it in changed_node_ids too for a delta update); the nodes left out keep the seeds of the earlier propagation, or their current tags
+
+  return: users_graph -- the graph of users once the tags have been propagated
+
+  '''
+
+  import propagation
+  hops = propagation.DEFAULT_HOPS if hops is None else hops
+  decay = propagation.DEFAULT_DECAY if decay is None else decay
+  tolerance = propagation.DEFAULT_TOLERANCE if tolerance is None else tolerance
+
+  if changed_node_ids is not None and 'tag_scores' in users_graph.graph:
+    tag_scores, affected_node_ids = propagation.propagate_graph_delta(users_graph, changed_node_ids, hops, decay, tolerance, seed_tags)
+    propagation.apply_tag_scores(users_graph, tag_scores, affected_node_ids)
+    # A tag index built on the graph (see tagindex.index_graph) only has the affected users' postings replaced
+    if 'tag_index' in users_graph.graph:
+      users_graph.graph['tag_index'].update(tag_scores, affected_node_ids)
+  else:
+    if graph_pruner is not None:
+      import pruning
+      tag_scores, users_graph.graph['pruning_report'] = pruning.propagate_pruned(users_graph, graph_pruner, hops, decay, tolerance, workers, seed_tags)
+    else:
+      tag_scores = propagation.propagate_graph(users_graph, hops, decay, tolerance, workers, seed_tags)
+    propagation.apply_tag_scores(users_graph, tag_scores)
+    if 'tag_index' in users_graph.graph:
+      import tagindex
+      tagindex.index_graph(users_graph, users_graph.graph['tag_index'].min_score)
+
   return users_graph
 
-def categorize_node(user_graph_node):
+def categorize_node(users_graph, node_id):
 
   '''
   Given a graph node repsenting a UserInfo object, classify by keywords based on its friends.
 
   Keyword Argument:
   ===
-  graph_node -- the node in the directed graph to be classified
+  users_graph -- the graph of users the node belongs to
+  node_id -- the id of the node in the directed graph to be classified
 
-  return: users_graph -- the graph of users once 
+  return: the list of (tag, score) tuples of the node, highest score first
 
   '''
 
@@ -253,12 +373,37 @@ def categorize_node(user_graph_node):
   3. From these accounts, do the above propagation suggested, for X levels (to be determined later)
   '''
 
-  pass
+  # The propagation runs over the whole graph at once, as one sparse matrix product per level, so it is only done if it has not been already
+  if 'tag_scores' not in users_graph.graph:
+    propagate_tags(users_graph)
+  tag_scores = users_graph.graph['tag_scores']
+
+  return tag_scores.ranked_tags(tag_scores.row_of(node_id))
 
 #endregion
 
 #region Helpers
 
+def save_crawl_checkpoint(crawl_state, userinfo_objects_to_add, checkpoint_path):
+
+  '''
+  Flushes the UserInfo objects gathered since the last checkpoint to the database, then saves the crawl state.
+
+  Keyword Arguments:
+  ===
+  crawl_state -- the CrawlState of the running crawl
+  userinfo_objects_to_add -- the UserInfo objects gathered since the last checkpoint
+  checkpoint_path -- the file the crawl state is saved to
+
+  return: the number of UserInfo objects 'inserted' and 'updated' in the database
+
+  '''
+
+  # Writes are upserts, so objects flushed again after a crash and resume are not duplicated
+  written_counts = utils.add_userinfo_to_db(userinfo_objects_to_add)
+  crawl_state.save(checkpoint_path)
+  return written_counts
+
 def tags_from_friend(users_graph, friend_id):
 
   return users_graph.nodes[friend_id]['userinfo'].tags
@@ -266,10 +411,14 @@ def tags_from_friend(users_graph, friend_id):
 def get_breakdown_by_category(reference_accounts):
 
   TOP_ACCOUNTS_PER_CATEGORY = {}
+  handles_to_lookup = list(reference_accounts.keys())
+  tweepy_user_objects = dict(zip(handles_to_lookup, utils.lookup_users(handles_to_lookup)))
   for handle in reference_accounts.keys():
+    if tweepy_user_objects[handle] is None:
+      continue
     # The first tag should be the primary tag
     account_primary_tag = reference_accounts[handle]['tags'][0]
-    account_num_followers = api.get_users(handle)._json['followers_count']
+    account_num_followers = tweepy_user_objects[handle]._json['followers_count']
     if account_primary_tag not in TOP_ACCOUNTS_PER_CATEGORY:
       TOP_ACCOUNTS_PER_CATEGORY[account_primary_tag] = [(handle, account_num_followers)]
     else:
@@ -283,28 +432,55 @@ def get_breakdown_by_category(reference_accounts):
 #endregion
 
 if __name__ == '__main__':
-  # x = main()
-  # y = get_top_users_by_followers(TOP_LEVEL_CATEGORIES, TOP_ACCOUNTS_BY_CATEGORIES)
-  # print(y)
-  # v = get_users(y)
-  # print(v)
-  # m = utils.hydrate_userinfo_objects_from_db()
-  # print(m)
-  m = users_to_graph(utils.generate_sample_userinfo(5))
-  for info, node_a in m.nodes(data=True):
-    node_a['userinfo'].tags = fake.words(nb=1, ext_word_list=None)
-    print(node_a['userinfo'])
-  m = propagate_tags(m)
-  for info, node_a in m.nodes(data=True):
-    print(info, node_a['userinfo'].tags)
-  # m = assign_top_level_categories(m, TOP_100_ACCOUNTS_BY_FOLLOWERS)
-  # y = nx.get_node_attributes(m, 'userinfo')
-  # for k,v in y.items():
-  #   print(k, v)
-  # print(m.number_of_edges())
-  # print(TOP_LEVEL_CATEGORIES)
-  # n = classify_node('asd', TEST_ACCOUNTS_FOR_CLASIFICATION)
-  # print(n)
-  # user = api.get_user('barackobama')
-  # followers = utils.get_ids_by_type('followers', 'barackobama')
-  # print(followers)
\ No newline at end of file
+  import refresh
+  import snapshot
+  import frontier
+
+  parser = argparse.ArgumentParser(description='Gather Twitter users and categorize them.')
+  parser.add_argument('--resume', action='store_true', help='resume the get_users crawl saved in the checkpoint file')
+  parser.add_argument('--concurrency', type=int, default=1, help='number of accounts get_users crawls at once through the concurrent pipeline, which --resume runs; the --frontier crawl takes one account at a time')
+  parser.add_argument('--frontier', metavar='PATH', help='crawl outwards by priority from the reference accounts in PATH, a JSON file of the top users by category as get_top_users_by_followers returns them')
+  parser.add_argument('--max-depth', type=int, default=frontier.FRONTIER_MAX_DEPTH, help='deepest follower hop the frontier crawl reaches')
+  parser.add_argument('--max-api-calls', type=int, help='most Twitter calls the frontier crawl makes')
+  parser.add_argument('--max-seconds', type=float, help='most seconds the frontier crawl runs for')
+  parser.add_argument('--refresh', action='store_true', help='refresh the users in the database, downloading the id lists of the accounts that changed or are stale only')
+  parser.add_argument('--export-snapshot', metavar='PATH', help='write the users in the database as a columnar graph snapshot to PATH')
+  parser.add_argument('--snapshot-format', choices=snapshot.SNAPSHOT_FORMATS, default='arrow', help='file format of the exported snapshot')
+  args = parser.parse_args()
+  if args.resume:
+    print(get_users(resume=True, concurrency=args.concurrency))
+  elif args.frontier:
+    with open(args.frontier) as top_users_file:
+      top_users_by_category = json.load(top_users_file)
+    print(get_users(top_users_by_category, frontier_options={'max_depth': args.max_depth, 'max_api_calls': args.max_api_calls, 'max_seconds': args.max_seconds}))
+  elif args.refresh:
+    print(refresh.refresh_stored_users())
+  elif args.export_snapshot:
+    exported_graph = snapshot.export_snapshot_from_db(args.export_snapshot, args.snapshot_format)
+    print(exported_graph.number_of_nodes(), 'nodes and', exported_graph.number_of_edges(), 'edges written to', args.export_snapshot)
+  else:
+    # x = main()
+    # y = get_top_users_by_followers(TOP_LEVEL_CATEGORIES, TOP_ACCOUNTS_BY_CATEGORIES)
+    # print(y)
+    # v = get_users(y)
+    # print(v)
+    # m = utils.hydrate_userinfo_objects_from_db()
+    # print(m)
+    m = users_to_graph(utils.generate_sample_userinfo(5))
+    for info, node_a in m.nodes(data=True):
+      node_a['userinfo'].tags = utils.get_faker().words(nb=1, ext_word_list=None)
+      print(node_a['userinfo'])
+    m = propagate_tags(m)
+    for info, node_a in m.nodes(data=True):
+      print(info, node_a['userinfo'].tags)
+    # m = assign_top_level_categories(m, TOP_100_ACCOUNTS_BY_FOLLOWERS)
+    # y = nx.get_node_attributes(m, 'userinfo')
+    # for k,v in y.items():
+    #   print(k, v)
+    # print(m.number_of_edges())
+    # print(TOP_LEVEL_CATEGORIES)
+    # n = classify_node('asd', TEST_ACCOUNTS_FOR_CLASIFICATION)
+    # print(n)
+    # user = api.get_user('barackobama')
+    # followers = utils.get_ids_by_type('followers', 'barackobama')
+    # print(followers)
\ No newline at end of file
@@ -0,0 +1,193 @@
+#region Imports
+
+# System libraries
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+
+# Third party libraries (pip)
+import numpy as np # https://numpy.org/doc/stable/
+import scipy.sparse as sp # https://docs.scipy.org/doc/scipy/reference/sparse.html
+
+#endregion
+
+#region Constants
+
+# Graphs with fewer nodes than this are propagated on one core, as starting the worker processes costs more than the hops
+PARALLEL_MIN_NODES = 50000
+
+#endregion
+
+def propagate_scores_parallel(adjacency, seeds, hops, decay, tolerance, workers=None):
+
+  '''
+  Computes the same label propagation as propagation.propagate_scores, with the hops spread over a pool of worker processes.
+
+  The nodes are split into one contiguous shard of rows per worker, with about as many edges each. The adjacency, the seeds and two score matrices live in shared memory, which every worker maps once when it starts, building the sparse matrix of its shard's rows once too. The workers then run until the propagation ends, and each hop is one small message to each worker, answered with the largest score change in its shard: the worker computes its rows of the next scores from the current ones, and the hop ends once all workers are done. The scores the other workers wrote are the boundary updates, read from shared memory in the next hop. Each row is computed by one worker, in the same order as on one core, so the scores are the same whatever the number of workers.
+
+  Keyword Arguments:
+  ===
+  adjacency -- sparse node x node matrix, adjacency[u, f] = 1 when u follows f
+  seeds -- node x category matrix of the tags assigned before propagation
+  hops, decay, tolerance -- see propagation.propagate_scores
+  workers -- the number of worker processes, one per core when None
+
+  return: (scores, hops_run) -- the dense node x category score matrix, and the number of hops computed
+
+  '''
+
+  adjacency = sp.csr_matrix(adjacency)
+  seeds = np.asarray(seeds.todense() if sp.issparse(seeds) else seeds, dtype=np.float64)
+  workers = workers or os.cpu_count() or 1
+  shard_bounds = partition_rows(adjacency.indptr, workers)
+
+  with SharedArrays() as shared_arrays:
+    shared_arrays.add('indptr', adjacency.indptr)
+    shared_arrays.add('indices', adjacency.indices)
+    shared_arrays.add('data', adjacency.data)
+    shared_arrays.add('seeds', seeds)
+    # Hops alternate between the two score matrices, reading one and writing the other
+    shared_arrays.add('scores_0', seeds)
+    shared_arrays.add('scores_1', seeds)
+
+    hops_run = 0
+    with ShardWorkers(shared_arrays.specs(), shard_bounds) as shard_workers:
+      for hop in range(hops):
+        shard_changes = shard_workers.run_hop('scores_' + str(hop % 2), 'scores_' + str((hop + 1) % 2), decay)
+        hops_run += 1
+        if max(shard_changes, default=0) <= tolerance:
+          break
+
+    scores = shared_arrays.arrays['scores_' + str(hops_run % 2)].copy()
+  return scores, hops_run
+
+class SharedArrays:
+
+  '''
+  Numpy arrays in named shared memory blocks, unlinked when the context exits. The worker processes map them by name (see attach_worker_arrays).
+  '''
+
+  def __init__(self):
+    self.arrays = {}
+    self._blocks = {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.arrays = {}
+    for block in self._blocks.values():
+      block.close()
+      block.unlink()
+    self._blocks = {}
+
+  def add(self, name, array):
+    # Copies the array into a new block, and returns the shared copy
+    array = np.ascontiguousarray(array)
+    block = self._blocks[name] = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared_array = self.arrays[name] = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared_array[...] = array
+    return shared_array
+
+  def specs(self):
+    return {name: (self._blocks[name].name, array.shape, array.dtype.str) for name, array in self.arrays.items()}
+
+#region Workers
+
+class ShardWorkers:
+
+  '''
+  One worker process per shard of rows, kept running across hops and stopped when the context exits. Each worker gets one hop at a time through its pipe (see run_shard_worker).
+  '''
+
+  def __init__(self, specs, shard_bounds):
+    self._specs = specs
+    self._shard_bounds = shard_bounds
+    self._processes = []
+    self._connections = []
+
+  def __enter__(self):
+    try:
+      for row_start, row_end in zip(self._shard_bounds[:-1], self._shard_bounds[1:]):
+        connection, worker_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_shard_worker, args=(self._specs, row_start, row_end, worker_connection), daemon=True)
+        process.start()
+        worker_connection.close()
+        self._processes.append(process)
+        self._connections.append(connection)
+    except BaseException:
+      self.__exit__()
+      raise
+    return self
+
+  def __exit__(self, *exc_info):
+    for connection in self._connections:
+      try:
+        connection.send(None)
+      except (BrokenPipeError, OSError):
+        pass
+    for process in self._processes:
+      process.join(timeout=5)
+      if process.is_alive():
+        process.terminate()
+        process.join()
+    for connection in self._connections:
+      connection.close()
+    self._processes, self._connections = [], []
+
+  def run_hop(self, source, target, decay):
+    # Starts the hop in every worker before waiting for any, and returns the largest score change of each shard
+    for connection in self._connections:
+      connection.send((source, target, decay))
+    shard_changes = [connection.recv() for connection in self._connections]
+    for shard_change in shard_changes:
+      if isinstance(shard_change, BaseException):
+        raise shard_change
+    return shard_changes
+
+# The shared arrays, and the blocks backing them, mapped once by each worker process
+_worker_arrays = {}
+_worker_blocks = []
+
+def attach_worker_arrays(specs):
+  for name, (block_name, shape, dtype) in specs.items():
+    # The workers share the parent's resource tracker, which already knows the block, and the parent unlinks it
+    block = shared_memory.SharedMemory(name=block_name)
+    _worker_blocks.append(block)
+    _worker_arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+def run_shard_worker(specs, row_start, row_end, connection):
+  # Builds the matrix of the shard's rows once, then computes one hop for them per message, answering with the largest score change among them, until it gets None
+  attach_worker_arrays(specs)
+  indptr = _worker_arrays['indptr'][row_start:row_end + 1]
+  shard_adjacency = sp.csr_matrix(
+    (_worker_arrays['data'][indptr[0]:indptr[-1]], _worker_arrays['indices'][indptr[0]:indptr[-1]], indptr - indptr[0]),
+    shape=(row_end - row_start, _worker_arrays['seeds'].shape[0])
+  )
+  shard_seeds = _worker_arrays['seeds'][row_start:row_end]
+  while True:
+    hop = connection.recv()
+    if hop is None:
+      break
+    source, target, decay = hop
+    try:
+      current_scores = _worker_arrays[source]
+      next_scores = shard_seeds + decay * (shard_adjacency @ current_scores)
+      _worker_arrays[target][row_start:row_end] = next_scores
+      connection.send(float(np.abs(next_scores - current_scores[row_start:row_end]).max(initial=0)))
+    except Exception as error:
+      connection.send(error)
+  connection.close()
+
+#endregion
+
+#region Helpers
+
+def partition_rows(indptr, number_of_shards):
+  # Shard bounds splitting the rows so that each shard has about as many edges plus rows (a row costs one write of its scores)
+  number_of_rows = len(indptr) - 1
+  row_costs = indptr[1:] + np.arange(1, number_of_rows + 1)
+  shard_ends = np.searchsorted(row_costs, np.linspace(0, row_costs[-1] if number_of_rows else 0, max(1, number_of_shards) + 1)[1:-1])
+  return np.unique(np.concatenate(([0], shard_ends, [number_of_rows]))).tolist()
+
+#endregion
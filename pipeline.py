@@ -0,0 +1,206 @@
+#region Imports
+
+# System libraries
+import copy
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Custom libraries
+import utils
+
+#endregion
+
+#region Constants
+
+# Reference accounts crawled at once, and adjacency downloads run at once
+GATHERING_CONCURRENCY = 8
+
+# Users waiting between two stages at most, before the stage feeding them waits
+STAGE_QUEUE_SIZE = 100
+
+#endregion
+
+def gather_users(crawl_state, reference_user_objects, follower_sampler, checkpoint_path, concurrency=GATHERING_CONCURRENCY, queue_size=STAGE_QUEUE_SIZE):
+
+  '''
+  Runs the get_users crawl as a concurrent pipeline, for crawls that spend their time waiting on the network rather than on rate limits.
+
+  Keyword Arguments:
+  ===
+  crawl_state -- the checkpoint.CrawlState of the crawl, new or resumed
+  reference_user_objects -- dictionary of the handles of crawl_state.pending_accounts to their tweepy.User objects (None for accounts that were not found)
+  follower_sampler -- the sampling.FollowerSampler choosing the followers of each account
+  checkpoint_path -- the file the crawl state is saved to, after a database flush at most every checkpoint.CHECKPOINT_INTERVAL seconds
+  concurrency -- the number of reference accounts crawled at once, and of adjacency downloads run at once
+  queue_size -- the most users waiting between two stages
+
+  return: write_counts -- the number of UserInfo objects 'inserted' into the database, and of those already there that were 'updated'
+
+  '''
+
+  return asyncio.run(GatheringPipeline(crawl_state, reference_user_objects, follower_sampler, checkpoint_path, concurrency, queue_size).run())
+
+class GatheringPipeline:
+
+  '''
+  The get_users crawl as stages connected by bounded queues, each blocking Twitter or database call running on a thread pool:
+  - account workers walk the follower pages of reference accounts (see sampling.FollowerSampler) and screen the candidates with batched profile lookups, several accounts at a time
+  - adjacency workers download the friends and followers of the accepted followers, and the friends of the reference accounts
+  - a flush worker upserts the users to the database, as many at a time as are waiting, then saves the checkpoint when it is due (see checkpoint.CrawlState.is_save_due)
+
+  A full queue makes the stage feeding it wait, so memory stays flat, and every call still goes through the rate limit scheduler, which keeps each endpoint within its budget. A follower only counts as accepted (and seen) once it is in the database, so a checkpoint never refers to users that were not written. The crawl state is only changed from the event loop, the threads get copies of what they read.
+
+  When an account worker fails, the other workers are cancelled and the error is raised once they have all stopped.
+  '''
+
+  def __init__(self, crawl_state, reference_user_objects, follower_sampler, checkpoint_path, concurrency=GATHERING_CONCURRENCY, queue_size=STAGE_QUEUE_SIZE):
+    self.crawl_state = crawl_state
+    self.reference_user_objects = reference_user_objects
+    self.follower_sampler = follower_sampler
+    self.checkpoint_path = checkpoint_path
+    self.concurrency = concurrency
+    self.queue_size = queue_size
+    self.write_counts = {'inserted': 0, 'updated': 0}
+    # Followers on their way to the database, which other accounts must not accept again
+    self._claimed_follower_ids = set()
+
+  async def run(self):
+    self._loop = asyncio.get_running_loop()
+    # Account workers, adjacency workers and the flush worker each get their threads, so no stage starves another
+    self._executor = ThreadPoolExecutor(max_workers=2 * self.concurrency + 1)
+    self._adjacency_queue = asyncio.Queue(maxsize=self.queue_size)
+    self._flush_queue = asyncio.Queue(maxsize=self.queue_size)
+    account_queue = asyncio.Queue()
+    for handle in list(self.crawl_state.pending_accounts):
+      account_queue.put_nowait(handle)
+
+    stage_workers = [asyncio.ensure_future(self._adjacency_worker()) for _ in range(self.concurrency)]
+    stage_workers.append(asyncio.ensure_future(self._flush_worker()))
+    account_workers = [asyncio.ensure_future(self._account_worker(account_queue)) for _ in range(self.concurrency)]
+    try:
+      # Every user an account worker hands over is awaited until it is written, so the crawl is done once they all return
+      await asyncio.gather(*account_workers)
+    finally:
+      # After a failure, the other account workers are stopped too, before the stages they feed
+      for worker in account_workers + stage_workers:
+        worker.cancel()
+      await asyncio.gather(*account_workers, return_exceptions=True)
+      await asyncio.gather(*stage_workers, return_exceptions=True)
+      self._executor.shutdown(wait=True)
+    return self.write_counts
+
+  #region Stages
+
+  async def _account_worker(self, account_queue):
+    while not account_queue.empty():
+      await self._gather_account(account_queue.get_nowait())
+
+  async def _gather_account(self, handle):
+    tweepy_user_object = self.reference_user_objects.get(handle)
+    if tweepy_user_object is None:
+      print("Failed to find that user, Skipping...")
+      self.crawl_state.finish_account(handle)
+      return
+    progress = self.crawl_state.get_account_progress(handle)
+    fetch_page = lambda cursor: utils.get_ids_page('followers', handle, cursor)
+
+    while not self.follower_sampler.is_complete(progress):
+      if not progress['sampled_follower_ids']:
+        # The sampler works on copies, as the event loop keeps changing the crawl state (and may save it) while it runs
+        sampling_progress = copy.deepcopy(progress)
+        seen_follower_ids = frozenset(self.crawl_state.seen_follower_ids)
+        sampled_follower_ids = await self._run(self.follower_sampler.next_candidates, sampling_progress, fetch_page, tweepy_user_object._json['followers_count'], seen_follower_ids, handle)
+        sampling_progress['sampled_follower_ids'] = sampled_follower_ids
+        progress.update(sampling_progress)
+        if not sampled_follower_ids:
+          break
+      await self._screen_candidates(progress)
+
+    # Only the friends of a reference account are fetched, its followers are the sampled ones
+    userinfo_object = utils.tweepy_user_to_userinfo_object(tweepy_user_object)
+    userinfo_object.followers = progress['followers']
+    userinfo_object.followers_sampled = True
+    if not await (await self._submit(userinfo_object, ('friends',))):
+      print("Failed to get the friends of that user, Skipping them...")
+      userinfo_object.friends = ()
+      await (await self._submit(userinfo_object, ()))
+    self.crawl_state.finish_account(handle)
+
+  async def _screen_candidates(self, progress):
+    sampled_follower_ids = progress['sampled_follower_ids']
+    follower_user_objects = await self._run(utils.lookup_users, sampled_follower_ids)
+
+    followers_needed = self.follower_sampler.sample_size - len(progress['followers'])
+    accepted_follower_ids = []
+    accepted_futures = []
+    screened_count = 0
+    for follower_id, follower_user_object in zip(sampled_follower_ids, follower_user_objects):
+      if len(accepted_follower_ids) >= followers_needed:
+        break
+      screened_count += 1
+      if follower_id in self.crawl_state.seen_follower_ids or follower_id in self._claimed_follower_ids:
+        continue
+      if follower_user_object is None or not self.follower_sampler.qualifies(follower_user_object._json):
+        self.crawl_state.seen_follower_ids.add(follower_id)
+        continue
+      self._claimed_follower_ids.add(follower_id)
+      accepted_follower_ids.append(follower_id)
+      # Fetched here rather than on first access, so that protected accounts are skipped
+      accepted_futures.append(await self._submit(utils.tweepy_user_to_userinfo_object(follower_user_object), ('friends', 'followers')))
+
+    for follower_id, was_written in zip(accepted_follower_ids, await asyncio.gather(*accepted_futures)):
+      self._claimed_follower_ids.discard(follower_id)
+      self.crawl_state.seen_follower_ids.add(follower_id)
+      if was_written:
+        progress['followers'].append(follower_id)
+      else:
+        print("Failed to run the command on that user, Skipping...")
+    # The candidates left are screened again next time, unless the sample is full
+    progress['sampled_follower_ids'] = [] if self.follower_sampler.is_complete(progress) else sampled_follower_ids[screened_count:]
+
+  async def _adjacency_worker(self):
+    import tweepy
+
+    while True:
+      userinfo_object, id_types, written = await self._adjacency_queue.get()
+      try:
+        await self._run(userinfo_object.load_adjacency, id_types)
+      except tweepy.TweepError:
+        written.set_result(False)
+      except Exception as error:
+        written.set_exception(error)
+      else:
+        await self._flush_queue.put((userinfo_object, written))
+
+  async def _flush_worker(self):
+    while True:
+      # Whatever piled up while the previous write ran goes in the next one
+      flush_batch = [await self._flush_queue.get()]
+      while len(flush_batch) < utils.WRITE_CHUNK_SIZE and not self._flush_queue.empty():
+        flush_batch.append(self._flush_queue.get_nowait())
+      try:
+        written_counts = await self._run(utils.add_userinfo_to_db, [userinfo_object for userinfo_object, _ in flush_batch])
+        utils.add_write_counts(self.write_counts, written_counts)
+        if self.crawl_state.is_save_due():
+          self.crawl_state.save(self.checkpoint_path)
+      except Exception as error:
+        for _, written in flush_batch:
+          written.set_exception(error)
+      else:
+        for _, written in flush_batch:
+          written.set_result(True)
+
+  #endregion
+
+  #region Helpers
+
+  async def _submit(self, userinfo_object, id_types):
+    # Queues the user for its adjacency download and database write, waiting while the queue is full, and returns the future of whether it was written
+    written = self._loop.create_future()
+    await self._adjacency_queue.put((userinfo_object, id_types, written))
+    return written
+
+  def _run(self, function, *args):
+    return self._loop.run_in_executor(self._executor, function, *args)
+
+  #endregion
@@ -0,0 +1,400 @@
+#region Imports
+
+# Third party libraries (pip)
+import numpy as np # https://numpy.org/doc/stable/
+import scipy.sparse as sp # https://docs.scipy.org/doc/scipy/reference/sparse.html
+import networkx as nx # https://networkx.github.io/documentation/stable/install.html
+
+# Custom libraries
+import csrgraph
+import parallelpropagation
+
+#endregion
+
+#region Constants
+
+# Number of hops tags travel from the tagged accounts, and how much they are worth after each hop
+DEFAULT_HOPS = 2
+DEFAULT_DECAY = 0.5
+
+# Propagation stops early once no score moves by more than this between two hops
+DEFAULT_TOLERANCE = 1e-6
+
+#endregion
+
+class TagScores:
+
+  '''
+  Result of tag propagation: a node x category score matrix.
+
+  Attributes:
+  ===
+  node_ids -- int64 array of the Twitter id of each row
+  categories -- the sorted list of tags, one per column
+  seeds -- sparse node x category matrix of the tags assigned before propagation
+  scores -- dense node x category matrix of propagated scores
+  hops_run -- the number of hops computed before the scores converged or the hop limit was reached
+
+  '''
+
+  def __init__(self, node_ids, categories, seeds, scores, hops_run):
+    self.node_ids = node_ids
+    self.categories = categories
+    self.seeds = seeds
+    self.scores = scores
+    self.hops_run = hops_run
+    self._row_of_id = None
+
+  def row_of(self, node_id):
+    if self._row_of_id is None:
+      self._row_of_id = {row_node_id: row for row, row_node_id in enumerate(self.node_ids.tolist())}
+    return self._row_of_id[node_id]
+
+  def has_node(self, node_id):
+    try:
+      self.row_of(node_id)
+    except KeyError:
+      return False
+    return True
+
+  def add_nodes(self, node_ids, seed_tags):
+
+    '''
+    Adds rows for new nodes, with their seed tags as their scores, adding columns for any tag not seen before.
+
+    Keyword Arguments:
+    ===
+    node_ids -- the ids of the new nodes
+    seed_tags -- the list of seed tags of each new node
+
+    '''
+
+    self.add_categories(set(tag for tags in seed_tags for tag in tags))
+    new_seeds = seed_matrix(seed_tags, self.categories)
+    self.node_ids = np.concatenate((self.node_ids, np.asarray(node_ids, dtype=np.int64)))
+    self.seeds = sp.vstack((self.seeds, new_seeds), format='csr')
+    self.scores = np.vstack((self.scores, new_seeds.toarray()))
+    self._row_of_id = None
+
+  def add_categories(self, categories):
+    # Columns stay sorted by tag, so existing columns are moved to their new positions
+    new_categories = set(categories) - set(self.categories)
+    if new_categories:
+      categories = sorted(set(self.categories) | new_categories)
+      column_of = {category: column for column, category in enumerate(categories)}
+      old_columns = np.array([column_of[category] for category in self.categories], dtype=np.int64)
+      scores = np.zeros((len(self.node_ids), len(categories)))
+      scores[:, old_columns] = self.scores
+      seeds = sp.csr_matrix(
+        (self.seeds.data, old_columns[self.seeds.indices], self.seeds.indptr),
+        shape=(len(self.node_ids), len(categories))
+      )
+      seeds.sort_indices()
+      self.categories, self.scores, self.seeds = categories, scores, seeds
+
+  def ranked_tags(self, row):
+
+    '''
+    Ranks the tags of one node by score.
+
+    Keyword Arguments:
+    ===
+    row -- the row of the node in the score matrix
+
+    return: the list of (tag, score) tuples with a positive score, highest score first, ties broken by tag name
+
+    '''
+
+    row_scores = self.scores[row]
+    ranked_columns = sorted(np.flatnonzero(row_scores > 0), key=lambda column: (-row_scores[column], self.categories[column]))
+    return [(self.categories[column], float(row_scores[column])) for column in ranked_columns]
+
+  def ranked_tag_lists(self, rows):
+
+    '''
+    Ranks the tags of many nodes at once, in the order of ranked_tags, without their scores.
+
+    Each row's columns are sorted by score in one argsort over the score matrix (stable, and columns are sorted by tag, so ties keep the tag order), then the rows with the same number of positive scores are turned into lists together.
+
+    Keyword Arguments:
+    ===
+    rows -- the int array of the rows of the nodes in the score matrix
+
+    return: the list of the tag lists of the nodes, in the order of rows; the nodes without tags share one empty list
+
+    '''
+
+    rows_scores = self.scores[rows]
+    ranked_columns = np.argsort(-rows_scores, axis=1, kind='stable')
+    tag_counts = np.count_nonzero(rows_scores > 0, axis=1)
+    ranked_categories = np.asarray(self.categories, dtype=object)[ranked_columns]
+    tag_lists = [[]] * len(rows_scores)
+    for tag_count in np.unique(tag_counts[tag_counts > 0]).tolist():
+      positions = np.flatnonzero(tag_counts == tag_count)
+      for position, tags in zip(positions.tolist(), ranked_categories[positions, :tag_count].tolist()):
+        tag_lists[position] = tags
+    return tag_lists
+
+def propagate_scores(adjacency, seeds, hops=DEFAULT_HOPS, decay=DEFAULT_DECAY, tolerance=DEFAULT_TOLERANCE, workers=1):
+
+  '''
+  Label propagation over a friends adjacency matrix, each hop computed as one sparse matrix product:
+
+    scores(k + 1) = seeds + decay * adjacency @ scores(k)
+
+  so a node collects the tags of the accounts it follows, of the accounts they follow, and so on, each hop worth decay times the previous one. The result does not depend on node order.
+
+  Keyword Arguments:
+  ===
+  adjacency -- sparse node x node matrix, adjacency[u, f] = 1 when u follows f
+  seeds -- node x category matrix of the tags assigned before propagation
+  hops -- the maximum number of hops tags travel
+  decay -- the weight of a tag coming from one hop further away
+  tolerance -- stop early once no score changes by more than this between two hops
+  workers -- the number of processes the hops are spread over (see parallelpropagation.propagate_scores_parallel), None for one per core; graphs smaller than parallelpropagation.PARALLEL_MIN_NODES always run on one core
+
+  return: (scores, hops_run) -- the dense node x category score matrix, and the number of hops computed
+
+  '''
+
+  if workers != 1 and adjacency.shape[0] >= parallelpropagation.PARALLEL_MIN_NODES:
+    return parallelpropagation.propagate_scores_parallel(adjacency, seeds, hops, decay, tolerance, workers)
+
+  seeds = np.asarray(seeds.todense() if sp.issparse(seeds) else seeds, dtype=np.float64)
+  scores = seeds.copy()
+  hops_run = 0
+  for _ in range(hops):
+    next_scores = seeds + decay * (adjacency @ scores)
+    hops_run += 1
+    converged = np.abs(next_scores - scores).max(initial=0) <= tolerance
+    scores = next_scores
+    if converged:
+      break
+  return scores, hops_run
+
+def propagate_graph(users_graph, hops=DEFAULT_HOPS, decay=DEFAULT_DECAY, tolerance=DEFAULT_TOLERANCE, workers=1, seed_tags=None):
+
+  '''
+  Propagates tags over a users graph, seeding from the tags assigned before propagation.
+
+  When the graph already holds the TagScores of an earlier propagation, the seeds stored there are reused for the nodes it covers (their tags have since been overwritten with propagated ones), so propagating twice gives the same result.
+
+  Keyword Arguments:
+  ===
+  users_graph -- a networkx.DiGraph from main.users_to_graph, or a csrgraph.CSRGraph
+  hops, decay, tolerance, workers -- see propagate_scores
+  seed_tags -- optional dictionary of node id to seed tags, replacing the ones the nodes would otherwise be seeded with
+
+  return: the TagScores
+
+  '''
+
+  node_ids, adjacency = graph_adjacency(users_graph)
+  node_seed_tags = graph_seed_tags(users_graph, node_ids, seed_tags)
+  categories = sorted(set(tag for tags in node_seed_tags for tag in tags))
+  seeds = seed_matrix(node_seed_tags, categories)
+  scores, hops_run = propagate_scores(adjacency, seeds, hops, decay, tolerance, workers)
+  return TagScores(node_ids, categories, seeds, scores, hops_run)
+
+def propagate_graph_delta(users_graph, changed_node_ids, hops=DEFAULT_HOPS, decay=DEFAULT_DECAY, tolerance=DEFAULT_TOLERANCE, seed_tags=None):
+
+  '''
+  Updates the TagScores stored on a graph after nodes or edges were added or changed, recomputing only the affected frontier: the changed nodes and the nodes that follow them, up to hops levels away.
+
+  The affected rows are recomputed from the seeds of the nodes they reach by following their friends up to hops levels, so the cost is proportional to the size of that neighbourhood, not of the graph, and the result is the same as a full propagation with the same hop limit.
+
+  Keyword Arguments:
+  ===
+  users_graph -- a networkx.DiGraph or csrgraph.CSRGraph holding the TagScores of an earlier propagation in users_graph.graph['tag_scores'] (copy it over when rebuilding a CSRGraph)
+  changed_node_ids -- the ids of the nodes that were added or changed, including the followers of any added or removed edge
+  hops, decay, tolerance -- see propagate_scores
+  seed_tags -- optional dictionary of node id to new seed tags, e.g. for a newly tagged reference account. Nodes added to the graph are otherwise seeded from their current tags
+
+  return: (tag_scores, affected_node_ids) -- the updated TagScores, and the ids of the nodes whose scores were recomputed
+
+  '''
+
+  tag_scores = users_graph.graph['tag_scores']
+  seed_tags = seed_tags or {}
+  # Scores reloaded from a memory-mapped snapshot are read-only views of the file
+  if not tag_scores.scores.flags.writeable:
+    tag_scores.scores = tag_scores.scores.copy()
+  changed_node_ids = list(dict.fromkeys(int(node_id) for node_id in changed_node_ids))
+
+  # Nodes are affected when one of the accounts they follow, up to hops levels away, changed
+  affected_node_ids = list(changed_node_ids)
+  seen_node_ids = set(changed_node_ids)
+  level = changed_node_ids
+  for _ in range(hops):
+    next_level = []
+    for node_id in level:
+      for follower_id in graph_follower_ids(users_graph, node_id):
+        if follower_id not in seen_node_ids:
+          seen_node_ids.add(follower_id)
+          next_level.append(follower_id)
+    affected_node_ids.extend(next_level)
+    level = next_level
+
+  # Scores are hop limited, so rather than iterating the affected rows against the stored scores (which lets tags travel further than hops), they are recomputed from the seeds of the nodes they reach within hops levels
+  reached_node_ids = list(affected_node_ids)
+  reached_set = set(affected_node_ids)
+  friend_ids_by_node = {}
+  level = affected_node_ids
+  for _ in range(hops):
+    next_level = []
+    for node_id in level:
+      friend_ids_by_node[node_id] = graph_friend_ids(users_graph, node_id)
+      for friend_id in friend_ids_by_node[node_id]:
+        if friend_id not in reached_set:
+          reached_set.add(friend_id)
+          next_level.append(friend_id)
+    reached_node_ids.extend(next_level)
+    level = next_level
+
+  # Give rows to the nodes the stored scores do not cover yet
+  new_node_ids = [node_id for node_id in reached_node_ids if not tag_scores.has_node(node_id)]
+  if new_node_ids:
+    tag_scores.add_nodes(new_node_ids, [seed_tags.get(node_id, graph_node_tags(users_graph, node_id)) for node_id in new_node_ids])
+  reseeded_node_ids = [node_id for node_id in seed_tags if tag_scores.has_node(node_id) and node_id not in new_node_ids]
+  if reseeded_node_ids:
+    replace_seeds(tag_scores, reseeded_node_ids, [seed_tags[node_id] for node_id in reseeded_node_ids])
+
+  # The nodes reached last keep only their seeds, as their friends are further than hops levels from the affected nodes
+  local_row_of = {node_id: local_row for local_row, node_id in enumerate(reached_node_ids)}
+  friend_rows = [[local_row_of[friend_id] for friend_id in friend_ids_by_node.get(node_id, [])] for node_id in reached_node_ids]
+  reached_adjacency = sp.csr_matrix(
+    (
+      np.ones(sum(len(rows) for rows in friend_rows)),
+      np.array([row for rows in friend_rows for row in rows], dtype=np.int64),
+      np.concatenate(([0], np.cumsum([len(rows) for rows in friend_rows]))).astype(np.int64)
+    ),
+    shape=(len(reached_node_ids), len(reached_node_ids))
+  )
+  reached_rows = np.array([tag_scores.row_of(node_id) for node_id in reached_node_ids], dtype=np.int64)
+  reached_scores, _ = propagate_scores(reached_adjacency, tag_scores.seeds[reached_rows], hops, decay, tolerance)
+  tag_scores.scores[reached_rows[:len(affected_node_ids)]] = reached_scores[:len(affected_node_ids)]
+
+  return tag_scores, affected_node_ids
+
+def apply_tag_scores(users_graph, tag_scores, node_ids=None):
+
+  '''
+  Stores propagated tags on the graph: each node's tags become its ranked tags, and the TagScores are kept as users_graph.graph['tag_scores'].
+
+  Keyword Arguments:
+  ===
+  users_graph -- a networkx.DiGraph from main.users_to_graph, or a csrgraph.CSRGraph
+  tag_scores -- the TagScores to apply
+  node_ids -- optionally, only the ids of the nodes to update
+
+  '''
+
+  if node_ids is None:
+    node_ids, rows = tag_scores.node_ids, np.arange(len(tag_scores.node_ids))
+  else:
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    rows = np.array([tag_scores.row_of(node_id) for node_id in node_ids.tolist()], dtype=np.int64)
+  tag_lists = tag_scores.ranked_tag_lists(rows)
+  if isinstance(users_graph, csrgraph.CSRGraph):
+    tags_column = users_graph.columns['tags']
+    node_indexes = np.arange(len(node_ids)) if node_ids is users_graph.node_ids else users_graph.node_indexes(node_ids)
+    for node_index, ranked_tags in zip(node_indexes.tolist(), tag_lists):
+      # Rows without tags share one empty list, so each node gets its own
+      tags_column[node_index] = ranked_tags or []
+  else:
+    for node_id, ranked_tags in zip(node_ids.tolist(), tag_lists):
+      if node_id in users_graph:
+        users_graph.nodes[node_id]['userinfo'].tags = ranked_tags or []
+  users_graph.graph['tag_scores'] = tag_scores
+
+#region Helpers
+
+def graph_adjacency(users_graph):
+  # The friends adjacency matrix, rows and columns in the graph's node order
+  if isinstance(users_graph, csrgraph.CSRGraph):
+    number_of_nodes = users_graph.number_of_nodes()
+    adjacency = sp.csr_matrix(
+      (np.ones(len(users_graph.friends_indices)), users_graph.friends_indices, users_graph.friends_indptr),
+      shape=(number_of_nodes, number_of_nodes)
+    )
+    return users_graph.node_ids, adjacency
+  node_ids = np.fromiter(users_graph.nodes, dtype=np.int64, count=users_graph.number_of_nodes())
+  adjacency = sp.csr_matrix(nx.to_scipy_sparse_array(users_graph, nodelist=list(users_graph.nodes), weight=None, format='csr'), dtype=np.float64)
+  return node_ids, adjacency
+
+def graph_friend_ids(users_graph, node_id):
+  if isinstance(users_graph, csrgraph.CSRGraph):
+    return users_graph.successors(node_id).tolist()
+  return list(users_graph.successors(node_id))
+
+def graph_follower_ids(users_graph, node_id):
+  if isinstance(users_graph, csrgraph.CSRGraph):
+    return users_graph.predecessors(node_id).tolist()
+  return list(users_graph.predecessors(node_id))
+
+def graph_node_tags(users_graph, node_id):
+  if isinstance(users_graph, csrgraph.CSRGraph):
+    return list(users_graph.columns['tags'][users_graph.node_indexes(node_id)] or [])
+  return list(users_graph.nodes[node_id]['userinfo'].tags or [])
+
+def replace_seeds(tag_scores, node_ids, seed_tags):
+  tag_scores.add_categories(set(tag for tags in seed_tags for tag in tags))
+  # Only the tagged accounts have seeds, so the seed matrix is small enough to edit as a list of lists
+  seeds = tag_scores.seeds.tolil()
+  for node_id, tags in zip(node_ids, seed_tags):
+    row = tag_scores.row_of(node_id)
+    seeds.rows[row] = []
+    seeds.data[row] = []
+    for tag in sorted(set(tags)):
+      seeds[row, tag_scores.categories.index(tag)] = 1.0
+  tag_scores.seeds = seeds.tocsr()
+
+def graph_seed_tags(users_graph, node_ids, seed_tags=None):
+  # The seeds of the earlier propagation for the nodes it covers, the current tags for the others, unless seed_tags gives them. Untagged nodes share an empty tuple, and only the few tagged nodes are visited one by one
+  seed_tags = seed_tags or {}
+  previous_tag_scores = users_graph.graph.get('tag_scores')
+  if isinstance(users_graph, csrgraph.CSRGraph):
+    current_tags = users_graph.columns.get('tags') or [None] * len(node_ids)
+  else:
+    current_tags = [users_graph.nodes[node_id]['userinfo'].tags for node_id in node_ids.tolist()]
+
+  if previous_tag_scores is None:
+    node_seed_tags = [list(tags) if tags else () for tags in current_tags]
+  else:
+    previous_rows = np.arange(len(node_ids)) if previous_tag_scores.node_ids is node_ids else positions_of(previous_tag_scores.node_ids, node_ids)
+    node_seed_tags = [()] * len(node_ids)
+    for position in np.flatnonzero(previous_rows < 0).tolist():
+      if current_tags[position]:
+        node_seed_tags[position] = list(current_tags[position])
+    previous_seeds = previous_tag_scores.seeds
+    has_previous_seeds = (previous_rows >= 0) & (np.diff(previous_seeds.indptr)[np.maximum(previous_rows, 0)] > 0)
+    for position in np.flatnonzero(has_previous_seeds).tolist():
+      previous_row = previous_rows[position]
+      seed_columns = previous_seeds.indices[previous_seeds.indptr[previous_row]:previous_seeds.indptr[previous_row + 1]]
+      node_seed_tags[position] = [previous_tag_scores.categories[column] for column in seed_columns]
+
+  if seed_tags:
+    seeded_ids = list(seed_tags)
+    for node_id, position in zip(seeded_ids, positions_of(node_ids, np.asarray(seeded_ids, dtype=np.int64)).tolist()):
+      if position >= 0:
+        node_seed_tags[position] = list(seed_tags[node_id])
+  return node_seed_tags
+
+def positions_of(node_ids, lookup_ids):
+  # The position of each lookup id in node_ids, -1 for the ids not in it, with one sort instead of a dictionary of every id
+  lookup_ids = np.asarray(lookup_ids, dtype=np.int64)
+  if not len(node_ids):
+    return np.full(len(lookup_ids), -1, dtype=np.int64)
+  order = np.argsort(node_ids, kind='stable')
+  sorted_ids = node_ids[order]
+  positions = np.minimum(np.searchsorted(sorted_ids, lookup_ids), len(sorted_ids) - 1)
+  return np.where(sorted_ids[positions] == lookup_ids, order[positions], -1)
+
+def seed_matrix(seed_tags, categories):
+  column_of = {category: column for column, category in enumerate(categories)}
+  entries = [(row, column_of[tag]) for row, tags in enumerate(seed_tags) if tags for tag in set(tags)]
+  rows = [row for row, _ in entries]
+  columns = [column for _, column in entries]
+  return sp.csr_matrix((np.ones(len(entries)), (rows, columns)), shape=(len(seed_tags), len(categories)))
+
+#endregion
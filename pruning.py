@@ -0,0 +1,215 @@
+#region Imports
+
+# Third party libraries (pip)
+import numpy as np # https://numpy.org/doc/stable/
+import scipy.sparse as sp # https://docs.scipy.org/doc/scipy/reference/sparse.html
+import networkx as nx # https://networkx.github.io/documentation/stable/install.html
+
+# Custom libraries
+import csrgraph
+import propagation
+
+#endregion
+
+#region Constants
+
+# Nodes are peeled until every node left has at least this many edges (in and out) among the nodes left; 2 removes the stubs with a single edge
+PRUNING_K_CORE = 2
+
+# Nodes followed by fewer accounts, or following fewer accounts, than these are removed; 0 keeps them all
+PRUNING_MIN_IN_DEGREE = 0
+PRUNING_MIN_OUT_DEGREE = 0
+
+# Order the rules are applied in, which is also the order of the report
+PRUNING_RULES = ('hubs', 'degree', 'k_core')
+
+#endregion
+
+class GraphPruner:
+
+  '''
+  Removes the nodes of a users graph that contribute little to categorization, so propagation runs on the informative core:
+  - 'hubs' removes the given accounts, e.g. celebrities followed across every category, whose tags say little about their followers
+  - 'degree' removes the nodes with fewer followers than min_in_degree, or fewer friends than min_out_degree, in the graph
+  - 'k_core' peels the nodes with fewer than k edges among the nodes left, again and again until none is left (the k-core of the graph, counting edges in both directions)
+
+  Tagged nodes are the source of every score, so the degree and k-core rules never remove them unless protect_tagged is False. The k-core rule also keeps the nodes with a path to a tagged node then, as they get a share of its tags and pass it on, so it only peels nodes whose scores are 0. Hubs are removed even when tagged.
+
+  Keyword Arguments:
+  ===
+  k -- the k of the k-core, 0 or 1 to skip the rule
+  min_in_degree, min_out_degree -- the degree thresholds
+  hub_ids -- the Twitter ids of the hub accounts to remove
+  protect_tagged -- keep the nodes with seed tags whatever their degree, and the nodes that can reach them whatever their k-core
+
+  '''
+
+  def __init__(self, k=PRUNING_K_CORE, min_in_degree=PRUNING_MIN_IN_DEGREE, min_out_degree=PRUNING_MIN_OUT_DEGREE, hub_ids=(), protect_tagged=True):
+    self.k = k
+    self.min_in_degree = min_in_degree
+    self.min_out_degree = min_out_degree
+    self.hub_ids = np.asarray(list(hub_ids), dtype=np.int64)
+    self.protect_tagged = protect_tagged
+
+  def core_mask(self, node_ids, adjacency, seeds):
+
+    '''
+    Applies the rules to a graph given as its friends adjacency matrix.
+
+    Keyword Arguments:
+    ===
+    node_ids -- int64 array of the Twitter id of each row
+    adjacency -- sparse node x node matrix, adjacency[u, f] = 1 when u follows f
+    seeds -- node x category matrix of the tags assigned before propagation
+
+    return: (kept, pruning_report) -- the boolean array of the nodes in the core, and the report: the graph's 'nodes' and 'edges', the 'nodes' and 'edges' each rule 'removed', the 'core' left, and the number of tagged nodes 'protected' from the degree and k-core rules
+
+    '''
+
+    adjacency = sp.csr_matrix(adjacency, dtype=np.float64)
+    # Duplicate or weighted edges count once
+    adjacency.data[:] = 1
+    number_of_nodes = len(node_ids)
+    kept = np.ones(number_of_nodes, dtype=bool)
+    protected = np.zeros(number_of_nodes, dtype=bool)
+    if self.protect_tagged:
+      protected = np.asarray((abs(seeds) if sp.issparse(seeds) else np.abs(np.asarray(seeds))).sum(axis=1)).ravel() > 0
+    pruning_report = {
+      'nodes': number_of_nodes,
+      'edges': int(adjacency.nnz),
+      'removed': {rule: {'nodes': 0, 'edges': 0} for rule in PRUNING_RULES},
+      'protected': int(protected.sum())
+    }
+
+    def remove(rule, removed):
+      # Edges of the removed nodes to nodes still kept, counting the edges among removed nodes once
+      removed = removed & kept
+      removed_vector = removed.astype(np.float64)
+      kept_vector = kept.astype(np.float64)
+      removed_edges = removed_vector @ (adjacency @ kept_vector) + (kept_vector - removed_vector) @ (adjacency @ removed_vector)
+      kept[removed] = False
+      pruning_report['removed'][rule]['nodes'] += int(removed.sum())
+      pruning_report['removed'][rule]['edges'] += int(round(removed_edges))
+
+    if len(self.hub_ids):
+      remove('hubs', np.isin(node_ids, self.hub_ids))
+
+    if self.min_in_degree > 0 or self.min_out_degree > 0:
+      kept_vector = kept.astype(np.float64)
+      in_degrees = adjacency.T @ kept_vector
+      out_degrees = adjacency @ kept_vector
+      remove('degree', ((in_degrees < self.min_in_degree) | (out_degrees < self.min_out_degree)) & ~protected)
+
+    if self.k > 1:
+      # Nodes with a path to a tagged node get a share of its tags, and pass it on to their followers, so peeling them would change the scores
+      reaches_tag = protected | nodes_reaching(adjacency, kept, protected) if self.protect_tagged else protected
+      adjacency_by_column = adjacency.tocsc()
+      kept_vector = kept.astype(np.float64)
+      degrees = adjacency @ kept_vector + adjacency_by_column.T @ kept_vector
+      while True:
+        peeled = kept & ~reaches_tag & (degrees < self.k)
+        if not peeled.any():
+          break
+        remove('k_core', peeled)
+        # Only the neighbours of the peeled nodes lose edges
+        peeled_vector = peeled.astype(np.float64)
+        degrees -= adjacency @ peeled_vector + adjacency_by_column.T @ peeled_vector
+
+    kept_vector = kept.astype(np.float64)
+    pruning_report['core'] = {'nodes': int(kept.sum()), 'edges': int(round(kept_vector @ (adjacency @ kept_vector)))}
+    return kept, pruning_report
+
+  def prune(self, users_graph):
+
+    '''
+    Builds the core of a users graph, e.g. to keep only it in memory.
+
+    Keyword Arguments:
+    ===
+    users_graph -- a networkx.DiGraph from main.users_to_graph, or a csrgraph.CSRGraph
+
+    return: (core_graph, pruning_report) -- the core as a graph of the same kind (sharing the networkx graph's UserInfo objects), and the report, see core_mask
+
+    '''
+
+    node_ids, adjacency = propagation.graph_adjacency(users_graph)
+    _, seeds = graph_seeds(users_graph, node_ids)
+    kept, pruning_report = self.core_mask(node_ids, adjacency, seeds)
+    return subgraph(users_graph, node_ids, adjacency, kept), pruning_report
+
+def propagate_pruned(users_graph, graph_pruner, hops=propagation.DEFAULT_HOPS, decay=propagation.DEFAULT_DECAY, tolerance=propagation.DEFAULT_TOLERANCE, workers=1, seed_tags=None):
+
+  '''
+  Propagates tags over the core of a users graph, then gives the pruned nodes their scores in one final pass, against the core's scores.
+
+  The final pass runs only over the rows of the pruned nodes (at most hops times, so chains of pruned nodes get their scores too). With protect_tagged, the k-core rule only peels nodes that cannot reach a tagged node, so whatever k, every node gets the same scores as in a full propagation. The hub and degree rules can change the scores, as they may cut the paths tags travel along, and chains of the nodes they remove only get the scores of a propagation without them once the scores converge.
+
+  Keyword Arguments:
+  ===
+  users_graph -- a networkx.DiGraph from main.users_to_graph, or a csrgraph.CSRGraph
+  graph_pruner -- the GraphPruner choosing the core
+  hops, decay, tolerance, workers -- see propagation.propagate_scores
+  seed_tags -- see propagation.propagate_graph
+
+  return: (tag_scores, pruning_report) -- the TagScores of every node of the graph, and the report, see GraphPruner.core_mask
+
+  '''
+
+  node_ids, adjacency = propagation.graph_adjacency(users_graph)
+  categories, seeds = graph_seeds(users_graph, node_ids, seed_tags)
+  kept, pruning_report = graph_pruner.core_mask(node_ids, adjacency, seeds)
+
+  core_rows = np.flatnonzero(kept)
+  core_adjacency = adjacency[core_rows][:, core_rows]
+  core_seeds = seeds[core_rows].toarray()
+  # The core's last hop is computed after the final pass, so that pruned nodes read the core's scores of the hop before, as they would in a full propagation
+  core_scores, hops_run = propagation.propagate_scores(core_adjacency, core_seeds, max(hops - 1, 0), decay, tolerance, workers)
+  scores = seeds.toarray()
+  scores[core_rows] = core_scores
+
+  pruned_rows = np.flatnonzero(~kept)
+  pruned_adjacency = adjacency[pruned_rows]
+  pruned_seeds = scores[pruned_rows]
+  for _ in range(hops if len(pruned_rows) else 0):
+    next_scores = pruned_seeds + decay * (pruned_adjacency @ scores)
+    converged = np.abs(next_scores - scores[pruned_rows]).max(initial=0) <= tolerance
+    scores[pruned_rows] = next_scores
+    if converged:
+      break
+
+  # Unless the core converged before
+  if hops > 0 and hops_run == hops - 1:
+    scores[core_rows] = core_seeds + decay * (core_adjacency @ core_scores)
+    hops_run += 1
+
+  return propagation.TagScores(node_ids, categories, seeds, scores, hops_run), pruning_report
+
+#region Helpers
+
+def nodes_reaching(adjacency, kept, targets):
+  # The kept nodes with a path to one of the targets through kept nodes, found by walking the edges backwards from them
+  reached = kept & targets
+  kept_adjacency = adjacency.multiply(kept.astype(np.float64)[:, None]).tocsr()
+  while True:
+    newly_reached = (kept_adjacency @ reached.astype(np.float64) > 0) & ~reached
+    if not newly_reached.any():
+      return reached
+    reached |= newly_reached
+
+def graph_seeds(users_graph, node_ids, seed_tags=None):
+  node_seed_tags = propagation.graph_seed_tags(users_graph, node_ids, seed_tags)
+  categories = sorted(set(tag for tags in node_seed_tags for tag in tags))
+  return categories, propagation.seed_matrix(node_seed_tags, categories)
+
+def subgraph(users_graph, node_ids, adjacency, kept):
+  # The graph's TagScores go along, so the seeds of a propagated graph are still found (see propagation.graph_seed_tags)
+  if not isinstance(users_graph, csrgraph.CSRGraph):
+    return nx.DiGraph(users_graph.subgraph(node_ids[kept].tolist()))
+  core_rows = np.flatnonzero(kept)
+  core_adjacency = adjacency[core_rows][:, core_rows].tocoo()
+  columns = {column: [values[row] for row in core_rows.tolist()] for column, values in users_graph.columns.items()}
+  core_graph = csrgraph.CSRGraph.from_edge_arrays(node_ids[core_rows], core_adjacency.row, core_adjacency.col, columns)
+  core_graph.graph.update(users_graph.graph)
+  return core_graph
+
+#endregion
@@ -0,0 +1,124 @@
+#region Imports
+
+# System libraries
+import datetime
+import contextlib
+
+# Custom libraries
+import utils
+import clients
+
+#endregion
+
+#region Constants
+
+# An account's id lists are downloaded again when its friends or followers count moved by more than this share of the count they were fetched at...
+REFRESH_CHANGE_THRESHOLD = 0.05
+
+# ...and by at least this many accounts, so that small accounts are not refetched for every follow
+REFRESH_MIN_COUNT_CHANGE = 5
+
+# Id lists older than this are downloaded again whatever the counts say, as follows and unfollows can cancel out
+REFRESH_STALENESS_LIMIT = datetime.timedelta(days=30)
+
+# Fields read from the stored users to decide what to refresh; tags are kept as they are
+REFRESH_FIELDS = ['userid', 'handle', 'tags', 'friends_count', 'followers_count', 'fetched_at', 'fetched_friends_count', 'fetched_followers_count', 'followers_sampled']
+
+#endregion
+
+def refresh_stored_users(userids=None, tags=None, change_threshold=REFRESH_CHANGE_THRESHOLD, min_count_change=REFRESH_MIN_COUNT_CHANGE, staleness_limit=REFRESH_STALENESS_LIMIT, now=None):
+
+  '''
+  Refreshes the users stored in the database for a fraction of the API calls of a new crawl.
+
+  The current profiles are looked up 100 at a time, and only the accounts whose counts changed beyond the thresholds, or whose id lists are older than the staleness limit (or of unknown age), get their friends and followers downloaded again. The other accounts only get their profile and counts updated. Reference accounts only get their friends downloaded again, keeping their sampled followers.
+
+  Every call bypasses the response cache, which could otherwise answer with profiles and id pages as old as its TTLs. Lists downloaded again replace the stored ones, including the stored edges in 'edges' storage mode (see utils.remove_stale_edges_from_db).
+
+  Keyword Arguments:
+  ===
+  userids -- only refresh the users with these ids; all the stored users when None
+  tags -- only refresh the users with any of these tags
+  change_threshold -- the share of the count the id lists were fetched at by which the current count has to move for the id lists to be downloaded again
+  min_count_change -- the number of accounts by which a count has to move at least for the id lists to be downloaded again
+  staleness_limit -- the age, as a datetime.timedelta, past which id lists are downloaded again anyway
+  now -- the current time, as an aware datetime (for testing); the current UTC time when None
+
+  return: refresh_counts -- the number of users 'checked', 'refetched', 'unchanged', 'missing' (no longer on Twitter) and 'failed' (e.g. protected since)
+
+  '''
+
+  import cache
+
+  now = now or datetime.datetime.now(datetime.timezone.utc)
+  refresh_counts = {'checked': 0, 'refetched': 0, 'unchanged': 0, 'missing': 0, 'failed': 0}
+
+  twitter_api = clients.get_api()
+  with twitter_api.bypassing_cache() if isinstance(twitter_api, cache.CachedAPI) else contextlib.nullcontext():
+    for stored_users in utils.iter_userinfo_objects_from_db(fields=REFRESH_FIELDS, userids=userids, tags=tags, chunk_size=utils.LOOKUP_BATCH_SIZE):
+      refresh_stored_users_chunk(stored_users, refresh_counts, change_threshold, min_count_change, staleness_limit, now)
+
+  return refresh_counts
+
+def refresh_stored_users_chunk(stored_users, refresh_counts, change_threshold, min_count_change, staleness_limit, now):
+  # Refreshes up to one lookup batch of stored users, adding to refresh_counts
+  import tweepy
+
+  refetched_users = []
+  unchanged_users = []
+  for stored_user, tweepy_user in zip(stored_users, utils.lookup_users([stored_user.id for stored_user in stored_users])):
+    refresh_counts['checked'] += 1
+    if tweepy_user is None:
+      refresh_counts['missing'] += 1
+      continue
+    current_user = utils.tweepy_user_to_userinfo_object(tweepy_user)
+    current_user.tags = stored_user.tags
+    current_user.followers_sampled = stored_user.followers_sampled
+    if not needs_refetch(stored_user, current_user, change_threshold, min_count_change, staleness_limit, now):
+      unchanged_users.append(current_user)
+      continue
+    try:
+      # The followers of a reference account are left unloaded, so the stored sample is not written over
+      refetched_users.append(current_user.load_adjacency(('friends',) if stored_user.followers_sampled else ('friends', 'followers')))
+    except tweepy.TweepError:
+      print("Failed to refetch that user, Skipping...")
+      refresh_counts['failed'] += 1
+
+  utils.add_userinfo_to_db(refetched_users)
+  utils.update_userinfo_profiles_in_db(unchanged_users)
+  refresh_counts['refetched'] += len(refetched_users)
+  refresh_counts['unchanged'] += len(unchanged_users)
+
+def needs_refetch(stored_user, current_user, change_threshold=REFRESH_CHANGE_THRESHOLD, min_count_change=REFRESH_MIN_COUNT_CHANGE, staleness_limit=REFRESH_STALENESS_LIMIT, now=None):
+
+  '''
+  Decides whether the friends and followers of a stored user have to be downloaded again.
+
+  Keyword Arguments:
+  ===
+  stored_user -- the UserInfo object as stored, with fetched_at and the counts its lists were fetched at (its last checked counts for users stored before those were kept)
+  current_user -- the UserInfo object of the current profile, with its counts
+  change_threshold, min_count_change, staleness_limit, now -- see refresh_stored_users
+
+  return: True when the id lists are stale or the counts changed enough since the lists were fetched, so that changes too small to count on each check still add up; the followers count of a reference account is left out, as its sampled followers are kept
+
+  '''
+
+  now = now or datetime.datetime.now(datetime.timezone.utc)
+  if stored_user.fetched_at is None or now - as_utc(stored_user.fetched_at) > staleness_limit:
+    return True
+  for count_field in ('friends_count',) if stored_user.followers_sampled else ('friends_count', 'followers_count'):
+    stored_count = getattr(stored_user, 'fetched_' + count_field)
+    if stored_count is None:
+      stored_count = getattr(stored_user, count_field)
+    current_count = getattr(current_user, count_field)
+    if stored_count is None or current_count is None:
+      return True
+    count_change = abs(current_count - stored_count)
+    if count_change >= min_count_change and count_change > change_threshold * stored_count:
+      return True
+  return False
+
+def as_utc(timestamp):
+  # pymongo returns naive datetimes unless the client is timezone aware, and they are always in UTC
+  return timestamp if timestamp.tzinfo is not None else timestamp.replace(tzinfo=datetime.timezone.utc)
@@ -0,0 +1,162 @@
+#region Imports
+
+# System libraries
+import math
+import random
+
+#endregion
+
+#region Constants
+
+# Followers kept per reference account
+FOLLOWER_SAMPLE_SIZE = 10
+
+# Pages of up to 5000 follower ids walked per reference account at most
+FOLLOWER_PAGE_BUDGET = 5
+FOLLOWER_PAGE_SIZE = 5000
+
+# Candidates drawn per follower wanted, since some of them fail the thresholds
+OVERSAMPLING = 3
+
+# A follower qualifies when it follows at least MIN_FRIENDS accounts and has at least MIN_FOLLOWERS followers
+MIN_FRIENDS = 10
+MIN_FOLLOWERS = 5
+
+SAMPLING_MODES = ('stratified', 'reservoir')
+
+#endregion
+
+class FollowerSampler:
+
+  '''
+  Samples the followers of an account from its follower id stream, page by page, in constant memory, without downloading the whole follower list of mega-accounts.
+
+  Two modes are available:
+  - 'stratified' draws the same share of ids from each page, sized so that the page budget yields sample_size * oversampling candidates, and hands them out page by page, so the crawl can stop as soon as sample_size candidates qualify
+  - 'reservoir' walks the whole page budget keeping a uniform reservoir of sample_size * oversampling ids, then hands them out in random order
+
+  Twitter returns followers newest first and pages can only be walked in order, so both are uniform over the followers within the page budget, which is the whole list for accounts with fewer than page_budget * 5000 followers.
+
+  The sampling state lives in the account's progress dictionary of the crawl checkpoint (see checkpoint.CrawlState), including the state of the account's own random generator, so a resumed crawl draws the same sample as an uninterrupted one.
+
+  Keyword Arguments:
+  ===
+  sample_size -- the number of qualifying followers wanted
+  mode -- 'stratified' or 'reservoir'
+  page_budget -- the most follower pages walked
+  oversampling -- the number of candidates drawn per follower wanted
+  min_friends, min_followers -- the thresholds a follower has to pass to qualify
+  seed -- the random seed, None for a random one; with a seed, each account's sample only depends on the seed and the account (see next_candidates)
+
+  '''
+
+  def __init__(self, sample_size=FOLLOWER_SAMPLE_SIZE, mode='stratified', page_budget=FOLLOWER_PAGE_BUDGET, oversampling=OVERSAMPLING, min_friends=MIN_FRIENDS, min_followers=MIN_FOLLOWERS, seed=None):
+    if mode not in SAMPLING_MODES:
+      raise ValueError('Unknown sampling mode: ' + str(mode))
+    self.sample_size = sample_size
+    self.mode = mode
+    self.page_budget = page_budget
+    self.oversampling = oversampling
+    self.min_friends = min_friends
+    self.min_followers = min_followers
+    self.seed = seed
+    self.random = random.Random(seed)
+
+  def qualifies(self, user_json):
+    return user_json['friends_count'] >= self.min_friends and user_json['followers_count'] >= self.min_followers
+
+  def is_complete(self, progress):
+    return len(progress['followers']) >= self.sample_size
+
+  def next_candidates(self, progress, fetch_page, followers_count, excluded_ids=(), account_id=None):
+
+    '''
+    Walks the follower id stream for the next candidates to screen.
+
+    Keyword Arguments:
+    ===
+    progress -- the account's progress dictionary, holding its follower cursor, pages done and random generator state, updated as pages are fetched
+    fetch_page -- function taking a cursor and returning the page of follower ids at that cursor, and the next cursor (0 after the last page)
+    followers_count -- the account's number of followers, to spread the sample over the pages
+    excluded_ids -- ids that are never candidates, e.g. the followers already processed
+    account_id -- the account's handle or id, which seeds its random generator along with the sampler's seed, so the sample does not depend on the order accounts are crawled in
+
+    return: the list of candidate follower ids, in random order, empty once the page budget or the follower list is exhausted
+
+    '''
+
+    account_random = self._account_random(progress, account_id)
+
+    if self.mode == 'stratified':
+      while self._has_pages_left(progress):
+        page = self._fetch_page(progress, fetch_page)
+        eligible_ids = [follower_id for follower_id in page if follower_id not in excluded_ids]
+        candidates = account_random.sample(eligible_ids, min(len(eligible_ids), self._stratum_size(len(page), followers_count, account_random)))
+        progress['random_state'] = encode_random_state(account_random)
+        if candidates:
+          return candidates
+      return []
+
+    # The reservoir is only handed out once, after the whole page budget has been walked
+    if progress.setdefault('reservoir_done', False):
+      return []
+    reservoir = progress.setdefault('reservoir', [])
+    while self._has_pages_left(progress):
+      for follower_id in self._fetch_page(progress, fetch_page):
+        if follower_id in excluded_ids:
+          continue
+        # Algorithm R: the n-th id replaces a random reservoir entry with probability size / n
+        progress['ids_seen'] = progress.get('ids_seen', 0) + 1
+        if len(reservoir) < self.sample_size * self.oversampling:
+          reservoir.append(follower_id)
+        else:
+          replaced_index = account_random.randrange(progress['ids_seen'])
+          if replaced_index < len(reservoir):
+            reservoir[replaced_index] = follower_id
+      progress['random_state'] = encode_random_state(account_random)
+    candidates = list(reservoir)
+    account_random.shuffle(candidates)
+    progress['reservoir'] = []
+    progress['reservoir_done'] = True
+    progress['random_state'] = encode_random_state(account_random)
+    return candidates
+
+  def _account_random(self, progress, account_id):
+    # The account's generator, restored from its progress once it has drawn anything
+    account_random = random.Random()
+    if 'random_state' in progress:
+      account_random.setstate(decode_random_state(progress['random_state']))
+    elif self.seed is not None and account_id is not None:
+      account_random.seed(str(self.seed) + ':' + str(account_id))
+    else:
+      account_random.seed(self.random.getrandbits(64))
+    return account_random
+
+  def _has_pages_left(self, progress):
+    # A cursor of 0 means the last page of followers has been reached
+    return progress['pages_done'] < self.page_budget and progress['cursor'] != 0
+
+  def _fetch_page(self, progress, fetch_page):
+    page, next_cursor = fetch_page(progress['cursor'])
+    progress['pages_done'] += 1
+    progress['cursor'] = next_cursor
+    return page
+
+  def _stratum_size(self, page_length, followers_count, account_random):
+    # Every id of the walked pages has the same chance of being drawn, the fractional part of a stratum is drawn at random
+    expected_ids = max(1, min(followers_count, self.page_budget * FOLLOWER_PAGE_SIZE))
+    expected_stratum_size = page_length * min(1.0, self.sample_size * self.oversampling / expected_ids)
+    return int(math.floor(expected_stratum_size)) + (account_random.random() < expected_stratum_size % 1)
+
+#region Helpers
+
+def encode_random_state(generator):
+  # random.Random's state as JSON-friendly lists, for the crawl checkpoint
+  version, internal_state, gauss_next = generator.getstate()
+  return [version, list(internal_state), gauss_next]
+
+def decode_random_state(encoded_state):
+  version, internal_state, gauss_next = encoded_state
+  return (version, tuple(internal_state), gauss_next)
+
+#endregion
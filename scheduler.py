@@ -0,0 +1,192 @@
+#region Imports
+
+# System libraries
+import time
+import threading
+
+# Third party libraries (pip)
+import tweepy # https://tweepy.readthedocs.io/en/latest/index.html
+
+#endregion
+
+#region Constants
+
+# Length of a Twitter rate limit window, in seconds
+RATE_LIMIT_WINDOW = 15 * 60
+
+# Calls allowed per window for the endpoints we use, until Twitter reports the real budget in its headers
+DEFAULT_ENDPOINT_LIMITS = {
+  'get_user': 900,
+  'lookup_users': 900,
+  'followers_ids': 15,
+  'friends_ids': 15
+}
+FALLBACK_ENDPOINT_LIMIT = 15
+
+#endregion
+
+class EndpointBudget:
+
+  '''
+  Token bucket tracking how many calls one credential set has left on one endpoint for the current window.
+  '''
+
+  def __init__(self, limit):
+    self.limit = limit
+    self.remaining = limit
+    self.reset_at = 0
+
+  def available_at(self, now):
+    # A bucket is refilled as soon as its window resets
+    if self.remaining > 0 or now >= self.reset_at:
+      return now
+    return self.reset_at
+
+  def consume(self, now):
+    if now >= self.reset_at:
+      self.remaining = self.limit
+      self.reset_at = now + RATE_LIMIT_WINDOW
+    self.remaining -= 1
+
+  def update_from_headers(self, headers):
+    if headers.get('x-rate-limit-limit') is not None:
+      self.limit = int(headers['x-rate-limit-limit'])
+    if headers.get('x-rate-limit-remaining') is not None:
+      self.remaining = int(headers['x-rate-limit-remaining'])
+    if headers.get('x-rate-limit-reset') is not None:
+      self.reset_at = int(headers['x-rate-limit-reset'])
+
+  def exhaust(self, headers, now):
+    self.update_from_headers(headers)
+    self.remaining = 0
+    if self.reset_at <= now:
+      self.reset_at = now + RATE_LIMIT_WINDOW
+
+class RateLimitScheduler:
+
+  '''
+  Routes Twitter API calls across a pool of credential sets, sending each call to whichever key can serve it soonest.
+
+  The scheduler is a drop-in stand-in for tweepy.API: any API method accessed on it (e.g. scheduler.followers_ids) is routed through the pool, and keeps its pagination mode so it can be used with tweepy.Cursor.
+  '''
+
+  def __init__(self, apis):
+    self.apis = list(apis)
+    self.budgets = [{} for _ in self.apis]
+    self.calls_made = 0
+    # Calls started and still running on each key, to tell which responses last_response belongs to when calls overlap
+    self._calls_started = [0] * len(self.apis)
+    self._calls_in_flight = [0] * len(self.apis)
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_credentials(cls, credentials):
+    return cls([create_api(credential_set) for credential_set in get_credential_sets(credentials)])
+
+  def __getattr__(self, endpoint):
+    if endpoint.startswith('_') or 'apis' not in self.__dict__:
+      raise AttributeError(endpoint)
+    api_method = getattr(self.apis[0], endpoint)
+    if not callable(api_method):
+      return api_method
+
+    def routed_call(*args, **kwargs):
+      return self.call(endpoint, *args, **kwargs)
+
+    if hasattr(api_method, 'pagination_mode'):
+      routed_call.pagination_mode = api_method.pagination_mode
+    return routed_call
+
+  def call(self, endpoint, *args, **kwargs):
+
+    '''
+    Calls an API method on the credential set that can serve it soonest, waiting for a window to reset if every set is exhausted.
+
+    Keyword Arguments:
+    ===
+    endpoint -- the name of the tweepy.API method to call (e.g. 'followers_ids')
+    args, kwargs -- the arguments passed through to the tweepy.API method
+
+    return: the result of the tweepy.API method
+
+    '''
+
+    while True:
+      with self._lock:
+        now = time.time()
+        key_index, budget = self._soonest_key(endpoint, now)
+        wait_time = budget.available_at(now) - now
+        if wait_time <= 0:
+          budget.consume(now)
+          self.calls_made += 1
+          was_idle = self._calls_in_flight[key_index] == 0
+          self._calls_started[key_index] += 1
+          self._calls_in_flight[key_index] += 1
+          call_number = self._calls_started[key_index]
+      if wait_time > 0:
+        print("Rate limit reached on every key for {0}. Sleeping for: {1:.0f}s".format(endpoint, wait_time))
+        time.sleep(wait_time)
+        continue
+
+      api = self.apis[key_index]
+      try:
+        result = getattr(api, endpoint)(*args, **kwargs)
+      except tweepy.TweepError as error:
+        if not is_rate_limit_error(error):
+          raise
+        # Our budget was out of date, so mark the key as exhausted and try the next best one
+        with self._lock:
+          budget.exhaust(error.response.headers if error.response is not None else {}, time.time())
+        continue
+      finally:
+        with self._lock:
+          self._calls_in_flight[key_index] -= 1
+          # A call that overlapped another one on the same key (e.g. from the gathering pipeline's threads) cannot tell whose headers last_response holds, so its budget is only counted down
+          headers_are_own = was_idle and self._calls_started[key_index] == call_number
+
+      last_response = getattr(api, 'last_response', None)
+      if last_response is not None and headers_are_own:
+        with self._lock:
+          budget.update_from_headers(last_response.headers)
+      return result
+
+  def _soonest_key(self, endpoint, now):
+    candidates = []
+    for key_index, key_budgets in enumerate(self.budgets):
+      if endpoint not in key_budgets:
+        key_budgets[endpoint] = EndpointBudget(DEFAULT_ENDPOINT_LIMITS.get(endpoint, FALLBACK_ENDPOINT_LIMIT))
+      budget = key_budgets[endpoint]
+      # Prefer the key available soonest, then the one with the most calls left
+      candidates.append((budget.available_at(now), -budget.remaining, key_index))
+    _, _, key_index = min(candidates)
+    return key_index, self.budgets[key_index][endpoint]
+
+#region Helpers
+
+def get_credential_sets(credentials):
+
+  '''
+  Gets the Twitter credential sets from the loaded credentials.json.
+
+  Keyword Arguments:
+  ===
+  credentials -- the loaded credentials, either holding one set of keys at the top level, or a list of sets under 'twitter_keys'
+
+  return: the list of credential sets, each with consumer_key, consumer_secret, access_token and access_token_secret
+
+  '''
+
+  return credentials.get('twitter_keys', [credentials])
+
+def create_api(credential_set):
+  auth = tweepy.OAuthHandler(credential_set['consumer_key'], credential_set['consumer_secret'])
+  auth.set_access_token(credential_set['access_token'], credential_set['access_token_secret'])
+  # Waiting on rate limits is done by the scheduler, across all keys
+  return tweepy.API(auth, compression=True)
+
+def is_rate_limit_error(error):
+  if isinstance(error, tweepy.RateLimitError):
+    return True
+  return error.response is not None and error.response.status_code in (420, 429)
+
+#endregion
@@ -0,0 +1,242 @@
+#region Imports
+
+# System libraries
+import os
+import json
+
+# Third party libraries (pip)
+import numpy as np # https://numpy.org/doc/stable/
+
+# Custom libraries
+import utils
+import csrgraph
+import propagation
+
+#endregion
+
+#region Constants
+
+SNAPSHOT_PATH = 'graph_snapshot'
+
+# 'arrow' files (Arrow IPC, uncompressed) are memory-mapped back without copies, 'parquet' files are smaller but decoded on load
+SNAPSHOT_FORMATS = ('arrow', 'parquet')
+
+# Tables making up a snapshot directory, each in a file named after it
+NODES_TABLE = 'nodes'
+EDGES_TABLE = 'edges'
+FOLLOWERS_TABLE = 'followers'
+
+SNAPSHOT_VERSION = 1
+
+#endregion
+
+# A snapshot is a directory of columnar tables, readable by any Arrow or Parquet tool:
+# - nodes: one row per node, in node index order, with its id, its csrgraph.NODE_COLUMNS, and friends_end/followers_end,
+#   the end of its rows in the two edge tables. When the graph holds propagated TagScores, each row also has its scores
+#   (a fixed size list with one score per category, so the whole column is the row-major score matrix) and its seed tags
+# - edges: one row per edge, source (follower) and destination (followed account) as node indexes, sorted by source
+# - followers: the source of every edge, with the edges sorted by destination
+# The edge tables are the CSRGraph arrays themselves, so loading them from memory-mapped Arrow files copies nothing.
+
+def save_snapshot(users_graph, path=SNAPSHOT_PATH, format='arrow'):
+
+  '''
+  Writes a users graph, and the tag scores propagated over it, as a columnar snapshot.
+
+  Keyword Arguments:
+  ===
+  users_graph -- a csrgraph.CSRGraph, or a networkx.DiGraph from main.users_to_graph (converted to a CSRGraph first)
+  path -- the directory to write the snapshot to, created if needed, its tables are replaced
+  format -- one of SNAPSHOT_FORMATS
+
+  return: the CSRGraph that was written
+
+  '''
+
+  import pyarrow as pa
+
+  if format not in SNAPSHOT_FORMATS:
+    raise ValueError('Unknown snapshot format: ' + str(format))
+  if not isinstance(users_graph, csrgraph.CSRGraph):
+    tag_scores = users_graph.graph.get('tag_scores')
+    users_graph = csrgraph.CSRGraph.from_networkx(users_graph)
+    if tag_scores is not None:
+      users_graph.graph['tag_scores'] = tag_scores
+
+  number_of_nodes = users_graph.number_of_nodes()
+  node_columns = {'id': pa.array(users_graph.node_ids, type=pa.int64())}
+  for column in csrgraph.NODE_COLUMNS:
+    if column in users_graph.columns:
+      node_columns[column] = pa.array(users_graph.columns[column], type=node_column_type(column))
+  node_columns['friends_end'] = pa.array(users_graph.friends_indptr[1:], type=pa.int64())
+  node_columns['followers_end'] = pa.array(users_graph.followers_indptr[1:], type=pa.int64())
+
+  metadata = {'howla.snapshot_version': str(SNAPSHOT_VERSION)}
+  tag_scores = users_graph.graph.get('tag_scores')
+  if tag_scores is not None:
+    scores, seed_tags = tag_scores_by_node(tag_scores, users_graph.node_ids)
+    number_of_categories = len(tag_scores.categories)
+    node_columns['scores'] = pa.FixedSizeListArray.from_arrays(pa.array(scores.ravel(), type=pa.float64()), number_of_categories)
+    node_columns['seed_tags'] = pa.array(seed_tags, type=pa.list_(pa.string()))
+    metadata['howla.categories'] = json.dumps(tag_scores.categories)
+    metadata['howla.hops_run'] = str(tag_scores.hops_run)
+
+  by_source = np.repeat(np.arange(number_of_nodes, dtype=np.int32), np.diff(users_graph.friends_indptr))
+  tables = {
+    NODES_TABLE: pa.table(node_columns).replace_schema_metadata(metadata),
+    EDGES_TABLE: pa.table({
+      'source': pa.array(by_source, type=pa.int32()),
+      'destination': pa.array(users_graph.friends_indices, type=pa.int32())
+    }),
+    FOLLOWERS_TABLE: pa.table({'source': pa.array(users_graph.followers_indices, type=pa.int32())})
+  }
+
+  os.makedirs(path, exist_ok=True)
+  for table_name, table in tables.items():
+    # Stale tables of the other format would be picked up on load
+    for other_format in SNAPSHOT_FORMATS:
+      if other_format != format and os.path.exists(table_path(path, table_name, other_format)):
+        os.remove(table_path(path, table_name, other_format))
+    write_table(table, table_path(path, table_name, format), format)
+
+  return users_graph
+
+def load_snapshot(path=SNAPSHOT_PATH):
+
+  '''
+  Reloads a snapshot written by save_snapshot as a CSRGraph, ready for propagation or queries.
+
+  Arrow snapshots are memory-mapped: the edge arrays and the score matrix are read-only views of the files, paged in by the OS as they are used. Parquet snapshots are decoded into memory.
+
+  Keyword Arguments:
+  ===
+  path -- the snapshot directory
+
+  return: the CSRGraph, with the snapshot's TagScores as graph['tag_scores'] when it has scores
+
+  '''
+
+  format = snapshot_format(path)
+  nodes = read_table(table_path(path, NODES_TABLE, format), format)
+  edges = read_table(table_path(path, EDGES_TABLE, format), format)
+  followers = read_table(table_path(path, FOLLOWERS_TABLE, format), format)
+  metadata = {key.decode(): value.decode() for key, value in (nodes.schema.metadata or {}).items()}
+
+  node_ids = column_to_numpy(nodes, 'id')
+  # The strings and tags are Python objects in a CSRGraph, and tags are updated in place by propagation, so those columns are converted
+  columns = {column: nodes.column(column).to_pylist() for column in csrgraph.NODE_COLUMNS if column in nodes.column_names}
+  users_graph = csrgraph.CSRGraph(
+    node_ids,
+    indptr_from_ends(column_to_numpy(nodes, 'friends_end')),
+    column_to_numpy(edges, 'destination'),
+    indptr_from_ends(column_to_numpy(nodes, 'followers_end')),
+    column_to_numpy(followers, 'source'),
+    columns
+  )
+
+  if 'howla.categories' in metadata:
+    categories = json.loads(metadata['howla.categories'])
+    scores_column = nodes.column('scores').combine_chunks()
+    scores = scores_column.values.to_numpy(zero_copy_only=len(scores_column.values) > 0).reshape(len(node_ids), len(categories))
+    users_graph.graph['tag_scores'] = propagation.TagScores(
+      node_ids,
+      categories,
+      propagation.seed_matrix(nodes.column('seed_tags').to_pylist(), categories),
+      scores,
+      int(metadata['howla.hops_run'])
+    )
+
+  return users_graph
+
+def export_snapshot_from_db(path=SNAPSHOT_PATH, format='arrow', **query_options):
+
+  '''
+  Streams the userinfo documents out of the database once and writes the graph they form as a snapshot, so later analysis starts from the snapshot instead of a database scan.
+
+  Keyword Arguments:
+  ===
+  path -- the directory to write the snapshot to
+  format -- one of SNAPSHOT_FORMATS
+  query_options -- filters passed to utils.iter_userinfo_objects_from_db (e.g. tags, updated_since)
+
+  return: the CSRGraph that was written
+
+  '''
+
+  # Friends and followers outside the database are kept as stub nodes, without looking them up
+  users_graph = csrgraph.CSRGraph.from_userinfo(utils.iter_userinfo_objects_from_db(**query_options))
+  return save_snapshot(users_graph, path, format)
+
+#region Helpers
+
+def node_column_type(column):
+  import pyarrow as pa
+
+  if column == 'tags':
+    return pa.list_(pa.string())
+  if column.endswith('_count'):
+    return pa.int64()
+  return pa.string()
+
+def tag_scores_by_node(tag_scores, node_ids):
+  # The score rows and seed tags of the given nodes, zeros and no seeds for nodes the scores do not cover
+  if np.array_equal(tag_scores.node_ids, node_ids):
+    rows = np.arange(len(node_ids))
+  else:
+    order = np.argsort(tag_scores.node_ids, kind='stable')
+    sorted_ids = tag_scores.node_ids[order]
+    positions = np.searchsorted(sorted_ids, node_ids)
+    found = positions < len(sorted_ids)
+    found[found] = sorted_ids[positions[found]] == node_ids[found]
+    rows = np.full(len(node_ids), -1, dtype=np.int64)
+    rows[found] = order[positions[found]]
+  covered = rows >= 0
+  scores = np.zeros((len(node_ids), len(tag_scores.categories)))
+  scores[covered] = tag_scores.scores[rows[covered]]
+  seeds = tag_scores.seeds
+  seed_tags = [
+    [tag_scores.categories[column] for column in seeds.indices[seeds.indptr[row]:seeds.indptr[row + 1]]] if row >= 0 else []
+    for row in rows.tolist()
+  ]
+  return scores, seed_tags
+
+def indptr_from_ends(row_ends):
+  return np.concatenate((np.zeros(1, dtype=np.int64), row_ends))
+
+def column_to_numpy(table, column):
+  # A single chunk maps to a numpy view of its buffer, several chunks (or none) have to be concatenated
+  chunked_array = table.column(column)
+  if chunked_array.num_chunks == 1 and chunked_array.null_count == 0:
+    return chunked_array.chunk(0).to_numpy(zero_copy_only=True)
+  return chunked_array.to_numpy()
+
+def table_path(path, table_name, format):
+  return os.path.join(path, table_name + '.' + format)
+
+def snapshot_format(path):
+  for format in SNAPSHOT_FORMATS:
+    if os.path.exists(table_path(path, NODES_TABLE, format)):
+      return format
+  raise FileNotFoundError('No snapshot in ' + str(path))
+
+def write_table(table, file_path, format):
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+
+  if format == 'parquet':
+    pq.write_table(table, file_path)
+    return
+  # Each table is written as a single record batch, so that every column is one contiguous buffer in the file
+  with pa.OSFile(file_path, 'wb') as sink:
+    with pa.ipc.new_file(sink, table.schema) as writer:
+      writer.write_table(table.combine_chunks(), max_chunksize=max(table.num_rows, 1))
+
+def read_table(file_path, format):
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+
+  if format == 'parquet':
+    return pq.read_table(file_path, memory_map=True)
+  return pa.ipc.open_file(pa.memory_map(file_path, 'r')).read_all()
+
+#endregion
@@ -0,0 +1,349 @@
+#region Imports
+
+# Third party libraries (pip)
+import numpy as np # https://numpy.org/doc/stable/
+
+# Custom libraries
+import utils
+import clients
+
+#endregion
+
+#region Constants
+
+# Users ranked by top_users when k is not given
+DEFAULT_TOP_K = 10
+
+# Scores at or below this are left out of the posting lists, so accounts the tags barely reached do not fill them
+MIN_INDEXED_SCORE = 0.0
+
+# Number of postings written per bulk write
+POSTING_WRITE_CHUNK_SIZE = 5000
+
+# How the scores of a user in several tags are combined when intersecting them
+COMBINE_MODES = ('sum', 'min')
+
+#endregion
+
+class TagIndex:
+
+  '''
+  Inverted index of propagated tags: for each tag, the posting list of the users with a score in it, highest score first (ties by user id), so the top users of a tag are a slice and never a scan of the graph.
+
+  Build it from the TagScores of a propagation with from_tag_scores (or index_graph), keep it current with update after a delta propagation, and persist it with save_to_db.
+
+  Attributes:
+  ===
+  postings -- dictionary of tag to its (user_ids, scores) numpy arrays, sorted by descending score, then ascending user id
+  min_score -- scores at or below this are not indexed
+
+  '''
+
+  def __init__(self, postings=None, min_score=MIN_INDEXED_SCORE):
+    self.postings = postings or {}
+    self.min_score = min_score
+    # Per tag, the order sorting its posting list by user id, built on first lookup by id
+    self._id_orders = {}
+
+  @classmethod
+  def from_tag_scores(cls, tag_scores, min_score=MIN_INDEXED_SCORE):
+
+    '''
+    Builds the index of every tag of a TagScores, one column at a time.
+
+    Keyword Arguments:
+    ===
+    tag_scores -- the propagation.TagScores to index
+    min_score -- scores at or below this are not indexed
+
+    return: the TagIndex
+
+    '''
+
+    tag_index = cls(min_score=min_score)
+    for column, tag in enumerate(tag_scores.categories):
+      column_scores = tag_scores.scores[:, column]
+      rows = np.flatnonzero(column_scores > min_score)
+      tag_index.postings[tag] = sort_postings(tag_scores.node_ids[rows], column_scores[rows])
+    return tag_index
+
+  def tags(self):
+    return sorted(tag for tag, (user_ids, _) in self.postings.items() if len(user_ids))
+
+  def __len__(self):
+    return sum(len(user_ids) for user_ids, _ in self.postings.values())
+
+  def top_users(self, tag, k=DEFAULT_TOP_K, offset=0):
+
+    '''
+    Ranks the users of one tag.
+
+    Keyword Arguments:
+    ===
+    tag -- the tag
+    k -- the number of users returned, all of them when None
+    offset -- the number of top users skipped, to page through the ranking
+
+    return: the list of (user_id, score) tuples, highest score first, empty for an unknown tag
+
+    '''
+
+    user_ids, scores = self.postings.get(tag, (np.zeros(0, dtype=np.int64), np.zeros(0)))
+    end = len(user_ids) if k is None else offset + k
+    return list(zip(user_ids[offset:end].tolist(), scores[offset:end].tolist()))
+
+  def intersect(self, tags, k=DEFAULT_TOP_K, combine='sum'):
+
+    '''
+    Ranks the users indexed under every one of several tags.
+
+    Keyword Arguments:
+    ===
+    tags -- the tags the users must all have
+    k -- the number of users returned, all of them when None
+    combine -- how a user's scores in the tags are ranked: 'sum' of them, or 'min' for the users strongest in all of them
+
+    return: the list of (user_id, scores) tuples, scores being the list of the user's score in each of the tags, best combined score first (ties by user id)
+
+    '''
+
+    if combine not in COMBINE_MODES:
+      raise ValueError('Unknown combine mode: ' + str(combine))
+    tags = list(dict.fromkeys(tags))
+    if not tags or any(tag not in self.postings for tag in tags):
+      return []
+    # Start from the shortest posting list, the intersection can only shrink
+    tags_by_length = sorted(tags, key=lambda tag: len(self.postings[tag][0]))
+    user_ids = np.sort(self.postings[tags_by_length[0]][0])
+    for tag in tags_by_length[1:]:
+      user_ids = np.intersect1d(user_ids, self.postings[tag][0], assume_unique=True)
+    scores = np.column_stack([self.scores(tag, user_ids) for tag in tags]) if len(user_ids) else np.zeros((0, len(tags)))
+    combined_scores = scores.sum(axis=1) if combine == 'sum' else scores.min(axis=1)
+    order = np.lexsort((user_ids, -combined_scores))[:k]
+    return list(zip(user_ids[order].tolist(), scores[order].tolist()))
+
+  def scores(self, tag, user_ids):
+
+    '''
+    Looks up the scores of users in one tag, e.g. as features of a prediction model.
+
+    Keyword Arguments:
+    ===
+    tag -- the tag
+    user_ids -- the ids of the users
+
+    return: float numpy array of the score of each user, 0 for the users not indexed under the tag
+
+    '''
+
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    tag_user_ids, tag_scores = self.postings.get(tag, (np.zeros(0, dtype=np.int64), np.zeros(0)))
+    if tag not in self._id_orders:
+      self._id_orders[tag] = np.argsort(tag_user_ids, kind='stable')
+    id_order = self._id_orders[tag]
+    positions = np.searchsorted(tag_user_ids[id_order], user_ids)
+    found = positions < len(tag_user_ids)
+    found[found] = tag_user_ids[id_order[positions[found]]] == user_ids[found]
+    user_scores = np.zeros(len(user_ids))
+    user_scores[found] = tag_scores[id_order[positions[found]]]
+    return user_scores
+
+  def update(self, tag_scores, user_ids):
+
+    '''
+    Replaces the postings of some users with their scores in a TagScores, e.g. the affected nodes of a delta propagation. Each posting list is edited rather than sorted again: the users' old postings are removed and their new ones inserted at their ranks.
+
+    Keyword Arguments:
+    ===
+    tag_scores -- the propagation.TagScores holding the users' new scores
+    user_ids -- the ids of the users to update; users missing from tag_scores are removed from the index
+
+    '''
+
+    user_ids = np.array(list(dict.fromkeys(int(user_id) for user_id in user_ids)), dtype=np.int64)
+    covered = np.array([tag_scores.has_node(user_id) for user_id in user_ids.tolist()], dtype=bool)
+    rows = np.array([tag_scores.row_of(user_id) for user_id in user_ids[covered].tolist()], dtype=np.int64)
+    for column, tag in enumerate(tag_scores.categories):
+      new_scores = tag_scores.scores[rows, column]
+      indexed = new_scores > self.min_score
+      self._replace_postings(tag, user_ids, user_ids[covered][indexed], new_scores[indexed])
+    # Tags the scores no longer have lose the users' postings too
+    for tag in set(self.postings) - set(tag_scores.categories):
+      self._replace_postings(tag, user_ids, np.zeros(0, dtype=np.int64), np.zeros(0))
+
+  def remove_users(self, user_ids):
+    # Removes every posting of these users, e.g. accounts deleted from the database
+    user_ids = np.asarray(list(user_ids), dtype=np.int64)
+    for tag in list(self.postings):
+      self._replace_postings(tag, user_ids, np.zeros(0, dtype=np.int64), np.zeros(0))
+
+  def save_to_db(self, user_ids=None, chunk_size=POSTING_WRITE_CHUNK_SIZE):
+
+    '''
+    Writes the postings to the tag_postings collection, one {tag, userid, score} document per posting, indexed for top-k queries per tag (see top_users_from_db) and lookups per user.
+
+    Keyword Arguments:
+    ===
+    user_ids -- only rewrite the postings of these users, e.g. the ones passed to update; the whole collection is replaced when None
+    chunk_size -- the number of postings sent per bulk write
+
+    return: the number of postings written
+
+    '''
+
+    import pymongo
+
+    db_postings = clients.get_db().tag_postings
+    clients.run_setup_once('tag_posting_indexes', ensure_tag_posting_indexes)
+
+    if user_ids is None:
+      db_postings.delete_many({})
+      user_id_filter = None
+    else:
+      user_id_filter = np.asarray(list(user_ids), dtype=np.int64)
+      db_postings.delete_many({'userid': {'$in': user_id_filter.tolist()}})
+
+    def iter_postings():
+      for tag, (tag_user_ids, tag_scores) in self.postings.items():
+        if user_id_filter is not None:
+          written = np.isin(tag_user_ids, user_id_filter)
+          tag_user_ids, tag_scores = tag_user_ids[written], tag_scores[written]
+        for user_id, score in zip(tag_user_ids.tolist(), tag_scores.tolist()):
+          yield {'tag': tag, 'userid': user_id, 'score': score}
+
+    postings_written = 0
+    for posting_chunk in utils.chunked(iter_postings(), chunk_size):
+      db_postings.bulk_write([pymongo.InsertOne(posting) for posting in posting_chunk], ordered=False)
+      postings_written += len(posting_chunk)
+    return postings_written
+
+  @classmethod
+  def load_from_db(cls, tags=None, min_score=MIN_INDEXED_SCORE):
+
+    '''
+    Reads the postings written by save_to_db back into a TagIndex.
+
+    Keyword Arguments:
+    ===
+    tags -- only load the posting lists of these tags; all of them when None
+    min_score -- the min_score of the loaded index, for later updates
+
+    return: the TagIndex
+
+    '''
+
+    query = {} if tags is None else {'tag': {'$in': list(tags)}}
+    postings_by_tag = {}
+    for posting in clients.get_db().tag_postings.find(query, {'_id': False}).batch_size(POSTING_WRITE_CHUNK_SIZE):
+      postings_by_tag.setdefault(posting['tag'], ([], []))
+      postings_by_tag[posting['tag']][0].append(posting['userid'])
+      postings_by_tag[posting['tag']][1].append(posting['score'])
+    return cls({
+      tag: sort_postings(np.array(user_ids, dtype=np.int64), np.array(scores, dtype=np.float64))
+      for tag, (user_ids, scores) in postings_by_tag.items()
+    }, min_score)
+
+  def _replace_postings(self, tag, removed_user_ids, user_ids, scores):
+    tag_user_ids, tag_scores = self.postings.get(tag, (np.zeros(0, dtype=np.int64), np.zeros(0)))
+    kept = ~np.isin(tag_user_ids, removed_user_ids)
+    tag_user_ids, tag_scores = tag_user_ids[kept], tag_scores[kept]
+    user_ids, scores = sort_postings(user_ids, scores)
+    # Rank among the kept postings: past the higher scores, then past the equal scores with lower ids
+    positions = np.searchsorted(-tag_scores, -scores, side='left')
+    tie_ends = np.searchsorted(-tag_scores, -scores, side='right')
+    for index in np.flatnonzero(tie_ends > positions).tolist():
+      positions[index] += np.searchsorted(tag_user_ids[positions[index]:tie_ends[index]], user_ids[index])
+    self.postings[tag] = (np.insert(tag_user_ids, positions, user_ids), np.insert(tag_scores, positions, scores))
+    self._id_orders.pop(tag, None)
+
+def index_graph(users_graph, min_score=MIN_INDEXED_SCORE):
+
+  '''
+  Builds the tag index of a propagated graph and keeps it as users_graph.graph['tag_index'], where main.propagate_tags keeps it current.
+
+  Keyword Arguments:
+  ===
+  users_graph -- a networkx.DiGraph or csrgraph.CSRGraph propagated by main.propagate_tags
+  min_score -- scores at or below this are not indexed
+
+  return: the TagIndex
+
+  '''
+
+  tag_index = users_graph.graph['tag_index'] = TagIndex.from_tag_scores(users_graph.graph['tag_scores'], min_score)
+  return tag_index
+
+#region Database queries
+
+def top_users_from_db(tag, k=DEFAULT_TOP_K, offset=0):
+
+  '''
+  Ranks the users of one tag straight from the tag_postings collection, served by its (tag, score, userid) index without loading the index.
+
+  Keyword Arguments:
+  ===
+  tag -- the tag
+  k -- the number of users returned, all of them when None
+  offset -- the number of top users skipped
+
+  return: the list of (user_id, score) tuples, highest score first
+
+  '''
+
+  import pymongo
+
+  postings = clients.get_db().tag_postings.find({'tag': tag}, {'_id': False, 'userid': True, 'score': True})
+  # A limit of 0 is no limit
+  postings = postings.sort([('score', pymongo.DESCENDING), ('userid', pymongo.ASCENDING)]).skip(offset).limit(k or 0)
+  return [(posting['userid'], posting['score']) for posting in postings]
+
+def intersect_from_db(tags, k=DEFAULT_TOP_K, combine='sum'):
+
+  '''
+  Ranks the users indexed under every one of several tags straight from the tag_postings collection, grouping their postings in the database.
+
+  Keyword Arguments:
+  ===
+  tags, k, combine -- see TagIndex.intersect
+
+  return: the list of (user_id, scores) tuples, scores being the list of the user's score in each of the tags
+
+  '''
+
+  if combine not in COMBINE_MODES:
+    raise ValueError('Unknown combine mode: ' + str(combine))
+  tags = list(dict.fromkeys(tags))
+  if not tags:
+    return []
+  pipeline = [
+    {'$match': {'tag': {'$in': tags}}},
+    {'$group': {'_id': '$userid', 'postings': {'$push': {'tag': '$tag', 'score': '$score'}}, 'combined_score': {'$' + combine: '$score'}}},
+    {'$match': {'postings': {'$size': len(tags)}}},
+    {'$sort': {'combined_score': -1, '_id': 1}}
+  ]
+  if k is not None:
+    pipeline.append({'$limit': k})
+  matches = clients.get_db().tag_postings.aggregate(pipeline, allowDiskUse=True)
+  results = []
+  for match in matches:
+    score_by_tag = {posting['tag']: posting['score'] for posting in match['postings']}
+    results.append((match['_id'], [score_by_tag[tag] for tag in tags]))
+  return results
+
+def ensure_tag_posting_indexes():
+  import pymongo
+
+  db_postings = clients.get_db().tag_postings
+  db_postings.create_index([('tag', pymongo.ASCENDING), ('score', pymongo.DESCENDING), ('userid', pymongo.ASCENDING)])
+  db_postings.create_index([('userid', pymongo.ASCENDING), ('tag', pymongo.ASCENDING)], unique=True)
+
+#endregion
+
+#region Helpers
+
+def sort_postings(user_ids, scores):
+  # Highest score first, ties by user id, so rankings do not depend on node order
+  order = np.lexsort((user_ids, -scores))
+  return user_ids[order], scores[order]
+
+#endregion
@@ -1,12 +1,40 @@
 import unittest
-import json
-import pymongo
 import networkx as nx
+import numpy as np
 import random
+import os
+import sys
+import subprocess
+import json
+import tempfile
+import datetime
+import tweepy
+import unittest.mock
+
+try:
+  import mongomock
+except ImportError:
+  mongomock = None
 
 import main
 import utils
+import clients
+import scheduler
+import cache
+import checkpoint
+import classes
+import idcodec
+import faketwitter
+import sampling
+import snapshot
+import refresh
+import frontier
+import propagation
+import parallelpropagation
+import tagindex
+import pruning
 
+@unittest.skipUnless(os.path.exists(clients.config['credentials_path']), 'needs the Twitter and MongoDB credentials')
 class TestDataGatheringMethods(unittest.TestCase):
 
   '''
@@ -37,10 +65,7 @@ class TestDataGatheringMethods(unittest.TestCase):
   @classmethod
   def setUpClass(cls):
 
-    with open('credentials.json') as credentials_file:
-      credentials = json.load(credentials_file)
-
-    client = pymongo.MongoClient('mongodb+srv://' + credentials['mongodbuser'] + ':' + credentials['mongodbpassword'] + '@howla-sandbox-fdsr1.mongodb.net/test?retryWrites=true&w=majority')
+    client = clients.get_mongo_client()
     db = client.data_gathering_test
     test_collection = db.test_collection
     cls._client = client
@@ -130,6 +155,153 @@ class TestDataGatheringMethods(unittest.TestCase):
 
   #endregion
 
+  @unittest.skip("demonstrating skipping")
+  def test_check_delete_db(self):
+    pass
+
+  @classmethod
+  def tearDownClass(cls):
+    clients.close()
+
+@unittest.skipIf(mongomock is None, 'needs mongomock')
+class DatabaseTestCase(unittest.TestCase):
+
+  '''
+  Runs its tests against an in-memory mongomock database, set up fresh for each test. mongomock 4.3 only supports the bulk writes of pymongo < 4.9.
+  '''
+
+  def setUp(self):
+    self._previous_config = {'mongo_client': clients.config['mongo_client'], 'database_name': clients.config['database_name']}
+    clients.configure(mongo_client=mongomock.MongoClient(), database_name='howla_test')
+    self._db = clients.get_db()
+
+  def tearDown(self):
+    clients.configure(**self._previous_config)
+
+class TestUserInfoStore(DatabaseTestCase):
+
+  def test_restoring_users_adds_no_duplicates(self):
+    TEST_USERS = [classes.UserInfo(id=user_id, handle='user' + str(user_id), friends=[user_id + 1], tags=['sports']) for user_id in range(1, 6)]
+    self.assertEqual({'inserted': 5, 'updated': 0}, utils.add_userinfo_to_db(TEST_USERS, storage_mode='embedded'))
+    TEST_USERS[0].tags = ['food']
+    self.assertEqual({'inserted': 0, 'updated': 5}, utils.add_userinfo_to_db(TEST_USERS, storage_mode='embedded'))
+    self.assertEqual(5, self._db.userinfo.count_documents({}))
+    self.assertEqual(['food'], self._db.userinfo.find_one({'userid': 1})['tags'])
+
+  def test_writes_are_chunked(self):
+    TEST_USERS = (classes.UserInfo(id=user_id) for user_id in range(utils.WRITE_CHUNK_SIZE * 2 + 1))
+    with unittest.mock.patch.object(mongomock.collection.Collection, 'bulk_write', autospec=True, side_effect=mongomock.collection.Collection.bulk_write) as bulk_write:
+      RESULT_WRITE_COUNTS = utils.add_userinfo_to_db(TEST_USERS, storage_mode='embedded')
+    self.assertEqual([utils.WRITE_CHUNK_SIZE, utils.WRITE_CHUNK_SIZE, 1], [len(call.args[1]) for call in bulk_write.call_args_list])
+    self.assertEqual({'inserted': utils.WRITE_CHUNK_SIZE * 2 + 1, 'updated': 0}, RESULT_WRITE_COUNTS)
+
+  def test_existing_duplicates_are_removed(self):
+    self._db.userinfo.insert_many([{'userid': 1, 'handle': 'old'}, {'userid': 1, 'handle': 'new'}, {'userid': 2, 'handle': 'only'}])
+    utils.add_userinfo_to_db([classes.UserInfo(id=3)], storage_mode='embedded')
+    self.assertEqual(['new'], [document['handle'] for document in self._db.userinfo.find({'userid': 1})])
+    self.assertEqual(3, self._db.userinfo.count_documents({}))
+    self.assertIn('userid_1', self._db.userinfo.index_information())
+
+  def test_unloaded_adjacency_is_not_fetched_or_overwritten(self):
+    utils.add_userinfo_to_db([classes.UserInfo(id=1, friends=[2, 3], followers=[4])], storage_mode='embedded')
+    def TEST_ADJACENCY_LOADER(id_type):
+      raise AssertionError('adjacency fetched during a write')
+    utils.add_userinfo_to_db([classes.UserInfo(id=1, handle='renamed', adjacency_loader=TEST_ADJACENCY_LOADER)], storage_mode='embedded')
+    RESULT_USER = utils.hydrate_userinfo_objects_from_db(storage_mode='embedded')[0]
+    self.assertEqual('renamed', RESULT_USER.handle)
+    self.assertEqual([2, 3], RESULT_USER.friends.tolist())
+    self.assertEqual([4], RESULT_USER.followers.tolist())
+
+class TestUserInfoQueries(DatabaseTestCase):
+
+  def setUp(self):
+    super().setUp()
+    utils.add_userinfo_to_db([
+      classes.UserInfo(id=1, handle='one', friends=[2, 3], followers=[4], tags=['sports']),
+      classes.UserInfo(id=2, handle='two', friends=[3], tags=['food']),
+      classes.UserInfo(id=3, handle='three', followers=[1, 2]),
+      classes.UserInfo(id=4, handle='four', friends=[1], tags=['sports', 'food'])
+    ], storage_mode='embedded')
+    self._db.userinfo.update_many({'userid': {'$in': [3, 4]}}, {'$set': {'updated_at': datetime.datetime(2021, 6, 1)}})
+    self._db.userinfo.update_many({'userid': {'$in': [1, 2]}}, {'$set': {'updated_at': datetime.datetime(2021, 5, 1)}})
+
+  def query_ids(self, **query_options):
+    return sorted(userinfo.id for userinfo in utils.iter_userinfo_objects_from_db(storage_mode='embedded', **query_options))
+
+  def test_filters(self):
+    self.assertEqual([1, 2, 3, 4], self.query_ids())
+    self.assertEqual([1, 4], self.query_ids(tags=['sports']))
+    self.assertEqual([2, 3], self.query_ids(userids=[2, 3, 5]))
+    self.assertEqual([3, 4], self.query_ids(updated_since=datetime.datetime(2021, 5, 15)))
+    self.assertEqual([4], self.query_ids(tags=['food'], updated_since=datetime.datetime(2021, 5, 15)))
+
+  def test_fields_leave_out_adjacency(self):
+    RESULT_USERS = list(utils.iter_userinfo_objects_from_db(fields=['handle'], userids=[1], storage_mode='embedded'))
+    self.assertEqual(['one'], [userinfo.handle for userinfo in RESULT_USERS])
+    self.assertEqual([], RESULT_USERS[0].friends.tolist())
+    self.assertEqual([], RESULT_USERS[0].tags)
+
+  def test_batches_and_chunks(self):
+    RESULT_CHUNKS = list(utils.iter_userinfo_objects_from_db(batch_size=1, chunk_size=3, storage_mode='embedded'))
+    self.assertEqual([3, 1], [len(chunk) for chunk in RESULT_CHUNKS])
+    self.assertEqual([1, 2, 3, 4], sorted(userinfo.id for chunk in RESULT_CHUNKS for userinfo in chunk))
+
+  def test_packed_adjacency(self):
+    RESULT_USER = next(utils.iter_userinfo_objects_from_db(userids=[1], storage_mode='embedded', packed_adjacency=True))
+    self.assertIsInstance(RESULT_USER.friends, idcodec.PackedIds)
+    self.assertEqual([2, 3], list(RESULT_USER.friends))
+    RESULT_USER = next(utils.iter_userinfo_objects_from_db(userids=[1], storage_mode='embedded'))
+    self.assertEqual([2, 3], RESULT_USER.friends.tolist())
+    self.assertEqual([4], RESULT_USER.followers.tolist())
+
+class TestEdgeStore(DatabaseTestCase):
+
+  def stored_edges(self):
+    return sorted(utils.iter_edges_from_db())
+
+  def test_round_trip(self):
+    TEST_USERS = [classes.UserInfo(id=1, friends=[2, 3], followers=[4]), classes.UserInfo(id=2, friends=[3], followers=[1])]
+    utils.add_userinfo_to_db(TEST_USERS, storage_mode='edges')
+    self.assertEqual([(1, 2), (1, 3), (2, 3), (4, 1)], self.stored_edges())
+    self.assertNotIn('friends', self._db.userinfo.find_one({'userid': 1}))
+    self.assertEqual([2, 3], sorted(utils.get_friend_ids_from_db(1)))
+    self.assertEqual([1, 2], sorted(utils.get_follower_ids_from_db(3)))
+    self.assertEqual([(1, 2), (2, 3)], sorted(utils.iter_edges_from_db(userids=[2])))
+    RESULT_USERS = {userinfo.id: userinfo for userinfo in utils.iter_userinfo_objects_from_db(storage_mode='edges')}
+    self.assertEqual([2, 3], sorted(RESULT_USERS[1].friends.tolist()))
+    self.assertEqual([4], RESULT_USERS[1].followers.tolist())
+    self.assertEqual([1], RESULT_USERS[2].followers.tolist())
+
+  def test_fill_adjacency_from_edge_store(self):
+    utils.add_edges_to_db([[(1, 2), (1, 3), (2, 3), (4, 1)]])
+    RESULT_USERS = list(utils.fill_adjacency_from_edge_store([classes.UserInfo(id=user_id) for user_id in (1, 2, 3)], chunk_size=2, with_followers=False))
+    self.assertEqual([[2, 3], [3], []], [sorted(userinfo.friends.tolist()) for userinfo in RESULT_USERS])
+    self.assertEqual([[], [], []], [userinfo.followers.tolist() for userinfo in RESULT_USERS])
+
+  def test_unfollow_removes_edges(self):
+    utils.add_userinfo_to_db([classes.UserInfo(id=1, friends=[2, 3], followers=[4, 5])], storage_mode='edges')
+    utils.add_userinfo_to_db([classes.UserInfo(id=1, friends=[3, 6], followers=[5])], storage_mode='edges')
+    self.assertEqual([(1, 3), (1, 6), (5, 1)], self.stored_edges())
+    # Lists that are not loaded, or shorter than the profile's count, keep their edges
+    def TEST_ADJACENCY_LOADER(id_type):
+      raise AssertionError('adjacency fetched during a write')
+    utils.add_userinfo_to_db([classes.UserInfo(id=1, friends=[7], friends_count=3, adjacency_loader=TEST_ADJACENCY_LOADER)], storage_mode='edges')
+    self.assertEqual([(1, 3), (1, 6), (1, 7), (5, 1)], self.stored_edges())
+
+  def test_migration_from_embedded(self):
+    utils.add_userinfo_to_db([classes.UserInfo(id=1, friends=[2, 3], followers=[4]), classes.UserInfo(id=2, friends=[3]), classes.UserInfo(id=3)], storage_mode='embedded')
+    self.assertEqual(3, utils.migrate_userinfo_to_edge_store(batch_size=1))
+    self.assertEqual([(1, 2), (1, 3), (2, 3), (4, 1)], self.stored_edges())
+    self.assertEqual(0, self._db.userinfo.count_documents({'$or': [{'friends': {'$exists': True}}, {'followers': {'$exists': True}}]}))
+    # Running it again finds nothing left to migrate
+    self.assertEqual(0, utils.migrate_userinfo_to_edge_store())
+
+class TestUsersToGraph(unittest.TestCase):
+
+  '''
+  Offline tests of the graph building, which need neither credentials nor a database.
+  '''
+
   #region main.users_to_graph
 
   def test_users_to_graph_empty(self):
@@ -161,15 +333,705 @@ class TestDataGatheringMethods(unittest.TestCase):
       for friend_id in userinfo.friends:
         self.assertTrue(TEST_USERS_GRAPH.has_edge(userinfo.id, friend_id))
 
+  def test_users_to_graph_csr_backend_same_edges(self):
+    TEST_USERINFO_LIST = utils.generate_sample_userinfo(20)
+    TEST_USERS_GRAPH = main.users_to_graph(TEST_USERINFO_LIST)
+    TEST_CSR_GRAPH = main.users_to_graph(TEST_USERINFO_LIST, backend='csr')
+    self.assertEqual(TEST_USERS_GRAPH.number_of_nodes(), TEST_CSR_GRAPH.number_of_nodes())
+    self.assertEqual(set(TEST_USERS_GRAPH.edges), set(TEST_CSR_GRAPH.edges()))
+    self.assertEqual(set(TEST_USERS_GRAPH.edges), set(TEST_CSR_GRAPH.to_networkx().edges))
+
+  def test_power_law_userinfo_is_consistent(self):
+    TEST_USERINFO_LIST = utils.generate_power_law_userinfo(500, mean_friends=10, seed=3)
+    TEST_USERS_GRAPH = main.users_to_graph(TEST_USERINFO_LIST, fetch_unknown_users=False)
+    self.assertEqual(500, TEST_USERS_GRAPH.number_of_nodes())
+    self.assertEqual(sum(len(userinfo.friends) for userinfo in TEST_USERINFO_LIST), TEST_USERS_GRAPH.number_of_edges())
+    self.assertEqual(sum(len(userinfo.followers) for userinfo in TEST_USERINFO_LIST), TEST_USERS_GRAPH.number_of_edges())
+    self.assertEqual(0, nx.number_of_selfloops(TEST_USERS_GRAPH))
+
+  def test_users_to_graph_unknown_users_as_stubs(self):
+    TEST_USERINFO_LIST = utils.generate_sample_userinfo(5)
+    TEST_USERINFO_LIST[0].friends = list(TEST_USERINFO_LIST[0].friends) + [1]
+    TEST_USERS_GRAPH = main.users_to_graph(TEST_USERINFO_LIST, fetch_unknown_users=False)
+    self.assertTrue(TEST_USERS_GRAPH.has_edge(TEST_USERINFO_LIST[0].id, 1))
+    self.assertEqual(1, TEST_USERS_GRAPH.nodes[1]['userinfo'].id)
+    self.assertEqual(0, len(TEST_USERS_GRAPH.nodes[1]['userinfo'].friends))
+
   #endregion
 
-  @unittest.skip("demonstrating skipping")
-  def test_check_delete_db(self):
-    pass
+class FakeResponse:
 
-  @classmethod
-  def tearDownClass(cls):
-    cls._client.close()
+  def __init__(self, headers):
+    self.headers = headers
+    self.status_code = 200
+
+class FakeKeyAPI:
+
+  '''
+  Stands in for one tweepy.API credential set, reporting a fixed number of remaining calls for get_user.
+  '''
+
+  def __init__(self, name, remaining):
+    self.name = name
+    self.remaining = remaining
+    self.last_response = None
+
+  def get_user(self, user_id):
+    self.remaining -= 1
+    self.last_response = FakeResponse({
+      'x-rate-limit-limit': '900',
+      'x-rate-limit-remaining': str(self.remaining),
+      'x-rate-limit-reset': '9999999999'
+    })
+    return (self.name, user_id)
+
+class TestUserInfo(unittest.TestCase):
+
+  def test_default_adjacency_is_not_shared(self):
+    TEST_USERINFO_A = classes.UserInfo(id=1)
+    TEST_USERINFO_B = classes.UserInfo(id=2)
+    TEST_USERINFO_A.tags.append('sports')
+    self.assertEqual([], TEST_USERINFO_B.tags)
+    self.assertIsNot(TEST_USERINFO_A.friends, TEST_USERINFO_B.friends)
+
+  def test_adjacency_is_packed(self):
+    TEST_USERINFO = classes.UserInfo(id=1, friends=[2 ** 62, 3], followers=[4])
+    self.assertEqual('q', TEST_USERINFO.friends.typecode)
+    self.assertEqual([2 ** 62, 3], TEST_USERINFO.friends.tolist())
+    TEST_USERINFO.followers = [5, 6]
+    self.assertEqual('q', TEST_USERINFO.followers.typecode)
+    self.assertFalse(hasattr(TEST_USERINFO, '__dict__'))
+
+class TestTagPropagation(unittest.TestCase):
+
+  @staticmethod
+  def sample_users():
+    # 1 follows 2 follows 3 (sports), 4 follows 3 and 5 (food)
+    return [
+      classes.UserInfo(id=1, friends=[2]),
+      classes.UserInfo(id=2, friends=[3]),
+      classes.UserInfo(id=3, tags=['sports']),
+      classes.UserInfo(id=4, friends=[3, 5]),
+      classes.UserInfo(id=5, tags=['food'])
+    ]
+
+  def test_tags_travel_multiple_hops(self):
+    TEST_USERS_GRAPH = main.propagate_tags(main.users_to_graph(self.sample_users(), fetch_unknown_users=False), hops=2, decay=0.5)
+    self.assertEqual(['sports'], TEST_USERS_GRAPH.nodes[1]['userinfo'].tags)
+    self.assertEqual([('food', 0.5), ('sports', 0.5)], main.categorize_node(TEST_USERS_GRAPH, 4))
+    self.assertEqual([('sports', 0.25)], main.categorize_node(TEST_USERS_GRAPH, 1))
+
+  def test_result_does_not_depend_on_node_order(self):
+    TEST_USERS_GRAPH = main.propagate_tags(main.users_to_graph(self.sample_users(), fetch_unknown_users=False))
+    TEST_REVERSED_GRAPH = main.propagate_tags(main.users_to_graph(list(reversed(self.sample_users())), fetch_unknown_users=False, backend='csr'))
+    for node_id, node_tags in zip(TEST_REVERSED_GRAPH.node_ids.tolist(), TEST_REVERSED_GRAPH.columns['tags']):
+      self.assertEqual(TEST_USERS_GRAPH.nodes[node_id]['userinfo'].tags, node_tags)
+
+  def test_propagating_twice_gives_the_same_tags(self):
+    TEST_USERS_GRAPH = main.propagate_tags(main.users_to_graph(self.sample_users(), fetch_unknown_users=False))
+    RESULT_TAGS = {node_id: list(userinfo.tags) for node_id, userinfo in TEST_USERS_GRAPH.nodes(data='userinfo')}
+    main.propagate_tags(TEST_USERS_GRAPH)
+    self.assertEqual(RESULT_TAGS, {node_id: userinfo.tags for node_id, userinfo in TEST_USERS_GRAPH.nodes(data='userinfo')})
+
+  def test_delta_update_matches_full_propagation(self):
+    TEST_USERS_GRAPH = main.propagate_tags(main.users_to_graph(self.sample_users(), fetch_unknown_users=False), hops=5)
+    # A new tagged account 6 appears, and 1 starts following it
+    TEST_USERS_GRAPH.add_node(6, userinfo=classes.UserInfo(id=6, tags=['music']))
+    TEST_USERS_GRAPH.add_edge(1, 6)
+    main.propagate_tags(TEST_USERS_GRAPH, hops=5, changed_node_ids=[6, 1])
+
+    TEST_FULL_USERS = self.sample_users() + [classes.UserInfo(id=6, tags=['music'])]
+    TEST_FULL_USERS[0].friends = [2, 6]
+    TEST_FULL_GRAPH = main.propagate_tags(main.users_to_graph(TEST_FULL_USERS, fetch_unknown_users=False), hops=5)
+    for node_id in TEST_FULL_GRAPH.nodes:
+      self.assertEqual(main.categorize_node(TEST_FULL_GRAPH, node_id), main.categorize_node(TEST_USERS_GRAPH, node_id))
+
+  def test_delta_update_keeps_hop_limit(self):
+    # 1 follows 2 follows 3 (sports), then 0 starts following 1: sports is three hops away from 0
+    TEST_USERS_GRAPH = main.propagate_tags(main.users_to_graph(self.sample_users(), fetch_unknown_users=False))
+    TEST_USERS_GRAPH.add_node(0, userinfo=classes.UserInfo(id=0))
+    TEST_USERS_GRAPH.add_edge(0, 1)
+    main.propagate_tags(TEST_USERS_GRAPH, changed_node_ids=[0])
+    self.assertEqual([], main.categorize_node(TEST_USERS_GRAPH, 0))
+
+    TEST_FULL_USERS = self.sample_users() + [classes.UserInfo(id=0, friends=[1])]
+    TEST_FULL_GRAPH = main.propagate_tags(main.users_to_graph(TEST_FULL_USERS, fetch_unknown_users=False))
+    for node_id in TEST_FULL_GRAPH.nodes:
+      self.assertEqual(main.categorize_node(TEST_FULL_GRAPH, node_id), main.categorize_node(TEST_USERS_GRAPH, node_id))
+
+  def test_seed_tags_reseed_delta_and_full_propagation(self):
+    # 2 becomes a music reference account
+    TEST_USERS_GRAPH = main.propagate_tags(main.users_to_graph(self.sample_users(), fetch_unknown_users=False))
+    main.propagate_tags(TEST_USERS_GRAPH, changed_node_ids=[2], seed_tags={2: ['music']})
+    TEST_FULL_GRAPH = main.propagate_tags(main.users_to_graph(self.sample_users(), fetch_unknown_users=False), seed_tags={2: ['music']})
+    self.assertEqual([('music', 1.0), ('sports', 0.5)], main.categorize_node(TEST_FULL_GRAPH, 2))
+    for node_id in TEST_FULL_GRAPH.nodes:
+      self.assertEqual(main.categorize_node(TEST_FULL_GRAPH, node_id), main.categorize_node(TEST_USERS_GRAPH, node_id))
+
+  def test_parallel_propagation_matches_one_core(self):
+    TEST_USERS = utils.generate_power_law_userinfo(2000, 10)
+    for TEST_USER in TEST_USERS[:50]:
+      TEST_USER.tags = [random.choice(['sports', 'food', 'music'])]
+    TEST_USERS_GRAPH = main.users_to_graph(TEST_USERS, fetch_unknown_users=False, backend='csr')
+    TEST_NODE_IDS, TEST_ADJACENCY = propagation.graph_adjacency(TEST_USERS_GRAPH)
+    TEST_SEEDS = propagation.seed_matrix(propagation.graph_seed_tags(TEST_USERS_GRAPH, TEST_NODE_IDS), ['food', 'music', 'sports'])
+    RESULT_SCORES, RESULT_HOPS = propagation.propagate_scores(TEST_ADJACENCY, TEST_SEEDS, 4, 0.5, 0)
+    PARALLEL_SCORES, PARALLEL_HOPS = parallelpropagation.propagate_scores_parallel(TEST_ADJACENCY, TEST_SEEDS, 4, 0.5, 0, workers=2)
+    self.assertEqual(RESULT_HOPS, PARALLEL_HOPS)
+    self.assertTrue((RESULT_SCORES == PARALLEL_SCORES).all())
+
+  def test_tag_index_ranks_and_follows_delta_updates(self):
+    TEST_USERS_GRAPH = main.propagate_tags(main.users_to_graph(self.sample_users(), fetch_unknown_users=False), hops=5)
+    TEST_TAG_INDEX = tagindex.index_graph(TEST_USERS_GRAPH)
+    self.assertEqual([(3, 1.0), (2, 0.5), (4, 0.5), (1, 0.25)], TEST_TAG_INDEX.top_users('sports', k=None))
+    self.assertEqual([(4, [0.5, 0.5])], TEST_TAG_INDEX.intersect(['sports', 'food']))
+    # 1 starts following 5, and gets food postings without rebuilding the index
+    TEST_USERS_GRAPH.add_edge(1, 5)
+    main.propagate_tags(TEST_USERS_GRAPH, hops=5, changed_node_ids=[1])
+    self.assertEqual([(5, 1.0), (1, 0.5), (4, 0.5)], TEST_USERS_GRAPH.graph['tag_index'].top_users('food'))
+    self.assertEqual([0.5, 0.0], TEST_USERS_GRAPH.graph['tag_index'].scores('food', [1, 2]).tolist())
+
+  def test_ranked_tag_lists_match_ranked_tags(self):
+    TEST_RANDOM = random.Random(3)
+    # Scores drawn from a few values, so that ties are broken by tag
+    TEST_SCORES = np.array([[TEST_RANDOM.choice([0, 0, 0.25, 0.5, 1]) for _ in range(4)] for _ in range(200)])
+    TEST_TAG_SCORES = propagation.TagScores(np.arange(200, dtype=np.int64), ['food', 'media', 'music', 'sports'], None, TEST_SCORES, 2)
+    RESULT_TAG_LISTS = TEST_TAG_SCORES.ranked_tag_lists(np.arange(200))
+    self.assertEqual([[tag for tag, _ in TEST_TAG_SCORES.ranked_tags(row)] for row in range(200)], RESULT_TAG_LISTS)
+
+  def test_pruned_propagation_matches_full_propagation(self):
+    # 6 follows 3, 9 follows 7, which follows 8, and none of 7, 8 or 9 can reach a tag
+    def TEST_USERS():
+      return self.sample_users() + [classes.UserInfo(id=6, friends=[3]), classes.UserInfo(id=7, friends=[8]), classes.UserInfo(id=8), classes.UserInfo(id=9, friends=[7])]
+    # Propagation overwrites the tags of the UserInfo objects, so each graph gets its own
+    TEST_FULL_GRAPH = main.propagate_tags(main.users_to_graph(TEST_USERS(), fetch_unknown_users=False))
+    TEST_PRUNED_GRAPH = main.propagate_tags(main.users_to_graph(TEST_USERS(), fetch_unknown_users=False), graph_pruner=pruning.GraphPruner(k=2))
+    # 8 and 9 have a single edge, and 7 has none left once they are peeled; 1 and 6 have a single edge too, but reach the tagged 3
+    self.assertEqual({'nodes': 3, 'edges': 2}, TEST_PRUNED_GRAPH.graph['pruning_report']['removed']['k_core'])
+    self.assertEqual({'nodes': 6, 'edges': 5}, TEST_PRUNED_GRAPH.graph['pruning_report']['core'])
+    for node_id in TEST_FULL_GRAPH.nodes:
+      self.assertEqual(main.categorize_node(TEST_FULL_GRAPH, node_id), main.categorize_node(TEST_PRUNED_GRAPH, node_id))
+
+  def test_pruned_propagation_keeps_the_paths_the_core_follows(self):
+    # 0, 1, 2 and 3 (sports) follow each other, 0 also follows 4, which follows 3, and 5 only follows 6, which follows no one
+    def TEST_USERS():
+      return [
+        classes.UserInfo(id=0, friends=[1, 2, 3, 4]),
+        classes.UserInfo(id=1, friends=[0, 2, 3]),
+        classes.UserInfo(id=2, friends=[0, 1, 3]),
+        classes.UserInfo(id=3, friends=[0, 1, 2], tags=['sports']),
+        classes.UserInfo(id=4, friends=[3]),
+        classes.UserInfo(id=5, friends=[6]),
+        classes.UserInfo(id=6)
+      ]
+    TEST_FULL_GRAPH = main.propagate_tags(main.users_to_graph(TEST_USERS(), fetch_unknown_users=False), hops=2, decay=0.5)
+    TEST_PRUNED_GRAPH = main.propagate_tags(main.users_to_graph(TEST_USERS(), fetch_unknown_users=False), hops=2, decay=0.5, graph_pruner=pruning.GraphPruner(k=3))
+    # 4 has two edges, but passes the tags of 3 on to 0, so only 5 and 6 are peeled
+    self.assertEqual({'nodes': 2, 'edges': 1}, TEST_PRUNED_GRAPH.graph['pruning_report']['removed']['k_core'])
+    self.assertEqual([('sports', 1.25)], main.categorize_node(TEST_PRUNED_GRAPH, 0))
+    for node_id in TEST_FULL_GRAPH.nodes:
+      self.assertEqual(main.categorize_node(TEST_FULL_GRAPH, node_id), main.categorize_node(TEST_PRUNED_GRAPH, node_id))
+
+  def test_k_core_mask_matches_networkx(self):
+    TEST_USERS_GRAPH = main.users_to_graph(utils.generate_power_law_userinfo(2000, 10, seed=1), fetch_unknown_users=False)
+    TEST_NODE_IDS, TEST_ADJACENCY = propagation.graph_adjacency(TEST_USERS_GRAPH)
+    for k in (2, 5, 10):
+      RESULT_KEPT, _ = pruning.GraphPruner(k=k).core_mask(TEST_NODE_IDS, TEST_ADJACENCY, np.zeros((len(TEST_NODE_IDS), 1)))
+      self.assertEqual(set(nx.k_core(TEST_USERS_GRAPH, k).nodes), set(TEST_NODE_IDS[RESULT_KEPT].tolist()))
+
+  def test_pruning_leaves_propagated_tags_unchanged(self):
+    def TEST_USERS():
+      users = utils.generate_power_law_userinfo(2000, 5, seed=2)
+      for user_index, user in enumerate(sorted(users, key=lambda user: len(user.followers), reverse=True)[:20]):
+        user.tags = [['sports', 'food', 'media'][user_index % 3]]
+      return users
+    TEST_FULL_GRAPH = main.propagate_tags(main.users_to_graph(TEST_USERS(), fetch_unknown_users=False))
+    for k in (2, 5, 10):
+      TEST_PRUNED_GRAPH = main.propagate_tags(main.users_to_graph(TEST_USERS(), fetch_unknown_users=False), graph_pruner=pruning.GraphPruner(k=k))
+      self.assertGreater(TEST_PRUNED_GRAPH.graph['pruning_report']['removed']['k_core']['nodes'], 0)
+      for node_id in TEST_FULL_GRAPH.nodes:
+        self.assertEqual(main.categorize_node(TEST_FULL_GRAPH, node_id), main.categorize_node(TEST_PRUNED_GRAPH, node_id))
+
+class TestTagPostingStore(DatabaseTestCase):
+
+  def test_queries_match_the_index(self):
+    TEST_USERS_GRAPH = main.propagate_tags(main.users_to_graph(TestTagPropagation.sample_users(), fetch_unknown_users=False), hops=5)
+    TEST_TAG_INDEX = tagindex.index_graph(TEST_USERS_GRAPH)
+    TEST_TAG_INDEX.save_to_db()
+    self.assertEqual(TEST_TAG_INDEX.top_users('sports', k=None), tagindex.top_users_from_db('sports', k=None))
+    self.assertEqual(TEST_TAG_INDEX.top_users('sports', k=2, offset=1), tagindex.top_users_from_db('sports', k=2, offset=1))
+    self.assertEqual(TEST_TAG_INDEX.intersect(['sports', 'food'], k=None), tagindex.intersect_from_db(['sports', 'food'], k=None))
+    self.assertEqual([(4, [0.5, 0.5])], tagindex.intersect_from_db(['sports', 'food'], k=1))
+
+class TestRateLimitScheduler(unittest.TestCase):
+
+  def test_calls_spread_to_key_with_budget_left(self):
+    TEST_SCHEDULER = scheduler.RateLimitScheduler([FakeKeyAPI('a', 1), FakeKeyAPI('b', 3)])
+    RESULT_KEYS = [TEST_SCHEDULER.get_user(user_id)[0] for user_id in range(4)]
+    # Once key a reports its budget is spent, the remaining calls go to key b
+    self.assertEqual(['a', 'b', 'b', 'b'], RESULT_KEYS)
+    self.assertEqual(4, TEST_SCHEDULER.calls_made)
+
+  def test_pagination_mode_is_kept(self):
+    def followers_ids(cursor=-1):
+      return [], (0, 0)
+    followers_ids.pagination_mode = 'cursor'
+    TEST_API = FakeKeyAPI('a', 10)
+    TEST_API.followers_ids = followers_ids
+    TEST_SCHEDULER = scheduler.RateLimitScheduler([TEST_API])
+    self.assertEqual('cursor', TEST_SCHEDULER.followers_ids.pagination_mode)
+
+class TestResponseCache(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.TemporaryDirectory()
+    self._path = os.path.join(self._directory.name, 'test_cache.sqlite')
+
+  def tearDown(self):
+    self._directory.cleanup()
+
+  def test_ids_page_is_served_from_cache(self):
+    TEST_CALLS = []
+    class FakeIdsAPI:
+      def followers_ids(self, screen_name, cursor=-1):
+        TEST_CALLS.append(cursor)
+        return [1, 2, 3], (0, 0)
+    TEST_CACHE = cache.ResponseCache(self._path)
+    TEST_API = cache.CachedAPI(FakeIdsAPI(), TEST_CACHE)
+    self.assertEqual(([1, 2, 3], (0, 0)), TEST_API.followers_ids(screen_name='nasa', cursor=-1))
+    self.assertEqual(([1, 2, 3], (0, 0)), TEST_API.followers_ids(screen_name='nasa', cursor=-1))
+    self.assertEqual(1, len(TEST_CALLS))
+    self.assertEqual({'followers_ids': 1}, TEST_CACHE.stats()['hits'])
+    self.assertEqual({'followers_ids': 1}, TEST_CACHE.stats()['misses'])
+    TEST_CACHE.close()
+
+  def test_expired_entries_are_misses(self):
+    TEST_CACHE = cache.ResponseCache(self._path, ttls={'get_user': -1})
+    TEST_CACHE.put('get_user', 'user_id=1', {'id': 1})
+    self.assertIsNone(TEST_CACHE.get('get_user', 'user_id=1'))
+    TEST_CACHE.close()
+
+  def test_least_recently_used_entries_are_evicted(self):
+    TEST_CACHE = cache.ResponseCache(self._path, max_bytes=70)
+    TEST_CACHE.put('followers_ids', 'old', list(range(10)))
+    TEST_CACHE.put('followers_ids', 'new', list(range(10)))
+    TEST_CACHE.get('followers_ids', 'old')
+    TEST_CACHE.put('followers_ids', 'newest', list(range(10)))
+    self.assertIsNotNone(TEST_CACHE.get('followers_ids', 'old'))
+    self.assertIsNone(TEST_CACHE.get('followers_ids', 'new'))
+    self.assertLessEqual(TEST_CACHE.stats()['bytes'], 70)
+    TEST_CACHE.close()
+
+class TestCrawlState(unittest.TestCase):
+
+  def test_save_and_load_round_trip(self):
+    TEST_TOP_USERS = {'sports': [['NBA', 100], ['NFL', 50]], 'food': [['McDonalds', 75]]}
+    TEST_CRAWL_STATE = checkpoint.CrawlState(TEST_TOP_USERS)
+    TEST_PROGRESS = TEST_CRAWL_STATE.get_account_progress('NBA')
+    TEST_PROGRESS['cursor'] = 1234567890
+    TEST_PROGRESS['followers'].append(2 ** 62)
+    TEST_CRAWL_STATE.seen_follower_ids.update([2 ** 62, 1, 42])
+    TEST_CRAWL_STATE.finish_account('NFL')
+    with tempfile.TemporaryDirectory() as directory:
+      TEST_PATH = os.path.join(directory, 'checkpoint.json')
+      TEST_CRAWL_STATE.save(TEST_PATH)
+      RESULT_CRAWL_STATE = checkpoint.CrawlState.load(TEST_PATH)
+    self.assertEqual(TEST_TOP_USERS, RESULT_CRAWL_STATE.top_users_by_category)
+    self.assertEqual(['NBA', 'McDonalds'], RESULT_CRAWL_STATE.pending_accounts)
+    self.assertEqual(TEST_CRAWL_STATE.account_progress, RESULT_CRAWL_STATE.account_progress)
+    self.assertEqual({2 ** 62, 1, 42}, RESULT_CRAWL_STATE.seen_follower_ids)
+
+class TestIdCodec(unittest.TestCase):
+
+  def test_round_trip_sorts_and_keeps_duplicates(self):
+    TEST_IDS = [2 ** 63 - 1, 0, 127, 128, 1234567890, 128]
+    TEST_ENCODED_IDS = idcodec.encode_ids(TEST_IDS)
+    self.assertEqual(sorted(TEST_IDS), idcodec.decode_ids(TEST_ENCODED_IDS).tolist())
+    self.assertEqual(sorted(TEST_IDS), list(idcodec.iter_ids(TEST_ENCODED_IDS, block_size=4)))
+    self.assertEqual(b'', idcodec.encode_ids([]))
+
+  def test_packed_ids_as_userinfo_adjacency(self):
+    TEST_PACKED_IDS = idcodec.PackedIds.from_ids([3, 2 ** 62, 1])
+    TEST_USERINFO = classes.UserInfo(id=1, friends=TEST_PACKED_IDS, followers=idcodec.encode_ids([5, 4]))
+    self.assertIs(TEST_PACKED_IDS, TEST_USERINFO.friends)
+    self.assertEqual(3, len(TEST_USERINFO.friends))
+    self.assertEqual([1, 3, 2 ** 62], list(TEST_USERINFO.friends))
+    self.assertEqual([4, 5], TEST_USERINFO.followers.tolist())
+
+class TestSnapshot(unittest.TestCase):
+
+  def test_round_trip_with_tag_scores(self):
+    TEST_USERS = utils.generate_power_law_userinfo(200, seed=2)
+    for TEST_USER in TEST_USERS[::20]:
+      TEST_USER.tags = ['sports']
+    TEST_GRAPH = main.propagate_tags(main.users_to_graph(TEST_USERS, fetch_unknown_users=False, backend='csr'))
+    for TEST_FORMAT in snapshot.SNAPSHOT_FORMATS:
+      with tempfile.TemporaryDirectory() as TEST_SNAPSHOT_PATH:
+        snapshot.save_snapshot(TEST_GRAPH, TEST_SNAPSHOT_PATH, TEST_FORMAT)
+        RESULT_GRAPH = snapshot.load_snapshot(TEST_SNAPSHOT_PATH)
+        self.assertEqual(list(TEST_GRAPH.edges()), list(RESULT_GRAPH.edges()))
+        self.assertEqual(TEST_GRAPH.followers_indices.tolist(), RESULT_GRAPH.followers_indices.tolist())
+        self.assertEqual(TEST_GRAPH.columns, RESULT_GRAPH.columns)
+        self.assertEqual(TEST_GRAPH.graph['tag_scores'].scores.tolist(), RESULT_GRAPH.graph['tag_scores'].scores.tolist())
+        self.assertEqual(main.categorize_node(TEST_GRAPH, TEST_USERS[1].id), main.categorize_node(RESULT_GRAPH, TEST_USERS[1].id))
+
+class TestRefresh(unittest.TestCase):
+
+  def test_needs_refetch(self):
+    TEST_NOW = datetime.datetime(2021, 6, 1, tzinfo=datetime.timezone.utc)
+    TEST_STORED_USER = classes.UserInfo(id=1, friends_count=100, followers_count=1000, fetched_at=datetime.datetime(2021, 5, 30))
+    self.assertFalse(refresh.needs_refetch(TEST_STORED_USER, classes.UserInfo(id=1, friends_count=104, followers_count=1040), now=TEST_NOW))
+    self.assertTrue(refresh.needs_refetch(TEST_STORED_USER, classes.UserInfo(id=1, friends_count=100, followers_count=1051), now=TEST_NOW))
+    self.assertTrue(refresh.needs_refetch(TEST_STORED_USER, classes.UserInfo(id=1, friends_count=100, followers_count=1000), now=TEST_NOW + refresh.REFRESH_STALENESS_LIMIT))
+    self.assertTrue(refresh.needs_refetch(classes.UserInfo(id=1, friends_count=100, followers_count=1000), classes.UserInfo(id=1, friends_count=100, followers_count=1000), now=TEST_NOW))
+
+class TestRefreshStoredUsers(DatabaseTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._directory = tempfile.TemporaryDirectory()
+    self._dataset = faketwitter.TwitterDataset(friends={1: [], 2: [1, 3], 3: [1], 4: [1]}, followers={1: [2, 3, 4], 2: [], 3: [2], 4: []})
+    for user_id in range(1, 5):
+      self._dataset.add_user({'id': user_id, 'screen_name': 'user' + str(user_id), 'description': '', 'friends_count': len(self._dataset.friends[user_id]), 'followers_count': len(self._dataset.followers[user_id])})
+    self._response_cache = cache.ResponseCache(os.path.join(self._directory.name, 'test_cache.sqlite'))
+    clients.configure(twitter_api=cache.CachedAPI(faketwitter.FakeTwitterAPI(self._dataset), self._response_cache))
+
+  def tearDown(self):
+    self._response_cache.close()
+    self._directory.cleanup()
+    clients.configure(twitter_api=None)
+    super().tearDown()
+
+  def test_refetch_bypasses_cache_and_keeps_sampled_followers(self):
+    with unittest.mock.patch.object(utils, 'EDGE_STORAGE_MODE', 'edges'):
+      TEST_USERS = [utils.tweepy_user_to_userinfo_object(tweepy_user, adjacency='eager') for tweepy_user in utils.lookup_users([2, 3])]
+      # A reference account, stored with a sample of its followers
+      TEST_REFERENCE_USER = utils.tweepy_user_to_userinfo_object(utils.lookup_users([1])[0])
+      TEST_REFERENCE_USER.followers = [2]
+      TEST_REFERENCE_USER.followers_sampled = True
+      utils.add_userinfo_to_db(TEST_USERS + [TEST_REFERENCE_USER])
+      # user2 unfollows user3, while the cached id pages of user2 are still fresh
+      self._dataset.friends[2] = [1]
+      self._dataset.followers[3] = []
+      self._dataset.users[2]['friends_count'] = 1
+      self._dataset.users[3]['followers_count'] = 0
+      RESULT_REFRESH_COUNTS = refresh.refresh_stored_users(now=datetime.datetime.now(datetime.timezone.utc) + refresh.REFRESH_STALENESS_LIMIT * 2)
+      self.assertEqual(3, RESULT_REFRESH_COUNTS['refetched'])
+      self.assertEqual([(2, 1), (3, 1)], sorted(utils.iter_edges_from_db()))
+      self.assertTrue(self._db.userinfo.find_one({'userid': 1})['followers_sampled'])
+
+  def test_small_count_changes_add_up(self):
+    self._dataset.users[2]['followers_count'] = 100
+    utils.add_userinfo_to_db([utils.tweepy_user_to_userinfo_object(utils.lookup_users([2])[0], adjacency='eager')])
+    # Three new followers at each check, fewer than REFRESH_MIN_COUNT_CHANGE, but six since the lists were fetched at the second check
+    self._dataset.users[2]['followers_count'] = 103
+    self.assertEqual(1, refresh.refresh_stored_users(userids=[2])['unchanged'])
+    self.assertEqual(103, self._db.userinfo.find_one({'userid': 2})['followers_count'])
+    self._dataset.users[2]['followers_count'] = 106
+    self.assertEqual(1, refresh.refresh_stored_users(userids=[2])['refetched'])
+    self.assertEqual(106, self._db.userinfo.find_one({'userid': 2})['fetched_followers_count'])
+
+class TestCrawlFrontier(unittest.TestCase):
+
+  def test_priority_order_and_depth_limit(self):
+    TEST_FRONTIER = frontier.CrawlFrontier(max_depth=1)
+    TEST_FRONTIER.add_seed({'id': 1, 'followers_count': 10}, ['sports'])
+    TEST_FRONTIER.add_seed({'id': 2, 'followers_count': 20}, ['food'])
+    TEST_SEED_NODE_1 = TEST_FRONTIER.pop()
+    TEST_SEED_NODE_2 = TEST_FRONTIER.pop()
+    self.assertEqual([1, 2], [TEST_SEED_NODE_1.user_id, TEST_SEED_NODE_2.user_id])
+    TEST_FRONTIER.add_followers(TEST_SEED_NODE_1, [3, 4])
+    TEST_FRONTIER.add_followers(TEST_SEED_NODE_2, [4, 5])
+    # Followers of depth 1 accounts are past the depth limit
+    TEST_FRONTIER.add_followers(frontier.FrontierNode(3, 1, 0), [6])
+    RESULT_UNSCREENED_NODES = TEST_FRONTIER.pop_unscreened(2)
+    self.assertEqual([4, 3], [node.user_id for node in RESULT_UNSCREENED_NODES])
+    self.assertEqual({'sports': 1, 'food': 1}, RESULT_UNSCREENED_NODES[0].tags)
+    for node in RESULT_UNSCREENED_NODES:
+      TEST_FRONTIER.set_profile(node, {'id': node.user_id})
+    # Screened nodes keep their place ahead of the nodes discovered after them
+    self.assertEqual([4, 3, 5, None], [getattr(TEST_FRONTIER.pop(), 'user_id', None) for _ in range(4)])
+
+  def test_requeue_and_compaction(self):
+    TEST_FRONTIER = frontier.CrawlFrontier(max_depth=1)
+    TEST_FRONTIER.add_seed({'id': 1, 'followers_count': 10}, ['sports'])
+    TEST_FRONTIER.add_followers(TEST_FRONTIER.pop(), [2, 3])
+    # A failed lookup puts the nodes back in their place
+    TEST_FRONTIER.requeue(TEST_FRONTIER.pop_unscreened(2))
+    self.assertEqual([2, 3], [node.user_id for node in TEST_FRONTIER.pop_unscreened(2)])
+    # Queuing the same nodes again and again leaves outdated entries, which are dropped once they outnumber the pending nodes
+    for _ in range(frontier.FRONTIER_COMPACTION_MIN_ENTRIES):
+      TEST_FRONTIER.add_followers(frontier.FrontierNode(4, 0, 0), [2, 3])
+    self.assertLessEqual(len(TEST_FRONTIER._heap), max(frontier.FRONTIER_COMPACTION_MIN_ENTRIES, 2 * len(TEST_FRONTIER) + 1))
+    self.assertEqual([2, 3], [node.user_id for node in TEST_FRONTIER.pop_unscreened(10)])
+
+class TestFrontierCrawl(DatabaseTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._dataset = faketwitter.TwitterDataset.synthetic(300, seed=1)
+    self._top_user_ids = sorted(self._dataset.users, key=lambda user_id: len(self._dataset.followers[user_id]), reverse=True)[:2]
+    self._top_users_by_category = {'sports': [(self._dataset.users[user_id]['screen_name'], len(self._dataset.followers[user_id])) for user_id in self._top_user_ids]}
+    self._sampler = sampling.FollowerSampler(min_friends=1, min_followers=0)
+
+  def tearDown(self):
+    clients.configure(twitter_api=None)
+    super().tearDown()
+
+  def test_api_call_budget(self):
+    TEST_SCHEDULER = scheduler.RateLimitScheduler(faketwitter.fake_api_pool(self._dataset))
+    clients.configure(twitter_api=TEST_SCHEDULER)
+    RESULT_REPORT = frontier.crawl_frontier(self._top_users_by_category, max_depth=1, max_api_calls=10, follower_sampler=self._sampler)
+    self.assertEqual('api_budget', RESULT_REPORT['stopped'])
+    # Budgets are checked before each account, which costs a friends and a followers page here
+    self.assertTrue(10 <= RESULT_REPORT['api_calls'] <= 12)
+    self.assertEqual(RESULT_REPORT['api_calls'], TEST_SCHEDULER.calls_made)
+    self.assertEqual(RESULT_REPORT['crawled'], self._db.userinfo.count_documents({}))
+    self.assertGreater(RESULT_REPORT['pending'], 0)
+
+  def test_time_budget(self):
+    clients.configure(twitter_api=scheduler.RateLimitScheduler([faketwitter.FakeTwitterAPI(self._dataset, latency=0.01)]))
+    RESULT_REPORT = frontier.crawl_frontier(self._top_users_by_category, max_depth=1, max_seconds=0.1, follower_sampler=self._sampler)
+    self.assertEqual('time_budget', RESULT_REPORT['stopped'])
+    self.assertGreater(RESULT_REPORT['crawled'], 0)
+    self.assertGreater(RESULT_REPORT['pending'], 0)
+    self.assertEqual(RESULT_REPORT['crawled'], self._db.userinfo.count_documents({}))
+
+  def test_failed_lookup_keeps_crawled_accounts(self):
+    # The reference accounts are looked up and crawled, then the lookup of their followers fails
+    clients.configure(twitter_api=InterruptedTwitterAPI(self._dataset, 5, tweepy.TweepError('Failed to send request')))
+    RESULT_REPORT = frontier.crawl_frontier(self._top_users_by_category, max_depth=1, follower_sampler=self._sampler)
+    self.assertEqual('lookup_failed', RESULT_REPORT['stopped'])
+    self.assertEqual(RESULT_REPORT['crawled'], self._db.userinfo.count_documents({}))
+    self.assertEqual(2, RESULT_REPORT['crawled'])
+    self.assertEqual(len(set(self._dataset.followers[self._top_user_ids[0]] + self._dataset.followers[self._top_user_ids[1]]) - set(self._top_user_ids)), RESULT_REPORT['pending'])
+
+  def test_accounts_at_max_depth_only_fetch_friends(self):
+    TEST_API = faketwitter.FakeTwitterAPI(self._dataset, endpoint_limits={'followers_ids': 1000, 'friends_ids': 1000})
+    clients.configure(twitter_api=TEST_API)
+    RESULT_REPORT = frontier.crawl_frontier(self._top_users_by_category, max_depth=1, follower_sampler=self._sampler)
+    self.assertGreater(RESULT_REPORT['crawled'], 2)
+    # Only the two reference accounts are expanded
+    self.assertEqual(2, TEST_API.calls['followers_ids'])
+    self.assertEqual(RESULT_REPORT['crawled'], TEST_API.calls['friends_ids'])
+    self.assertEqual(2, self._db.userinfo.count_documents({'followers': {'$exists': True}}))
+
+  def test_get_users_runs_frontier_crawl(self):
+    clients.configure(twitter_api=faketwitter.FakeTwitterAPI(self._dataset))
+    RESULT_WRITE_COUNTS = main.get_users(self._top_users_by_category, follower_sampler=self._sampler, frontier_options={'max_depth': 0})
+    self.assertEqual({'inserted': 2, 'updated': 0}, RESULT_WRITE_COUNTS)
+    self.assertEqual(sorted(self._top_user_ids), sorted(document['userid'] for document in self._db.userinfo.find()))
+
+class TestFollowerSampler(unittest.TestCase):
+
+  def setUp(self):
+    self._progress = {'cursor': -1, 'pages_done': 0, 'sampled_follower_ids': [], 'followers': []}
+    self._fetched_cursors = []
+
+  def fetch_page(self, cursor):
+    # Three pages of 100 ids
+    self._fetched_cursors.append(cursor)
+    start = 0 if cursor == -1 else cursor
+    return list(range(start, start + 100)), (start + 100 if start + 100 < 300 else 0)
+
+  def test_short_page_is_sampled_whole(self):
+    TEST_SAMPLER = sampling.FollowerSampler(sample_size=10, seed=1)
+    RESULT_CANDIDATES = TEST_SAMPLER.next_candidates(self._progress, lambda cursor: ([1, 2, 3], 0), 3)
+    self.assertEqual([1, 2, 3], sorted(RESULT_CANDIDATES))
+    self.assertEqual([], TEST_SAMPLER.next_candidates(self._progress, lambda cursor: ([1, 2, 3], 0), 3))
+
+  def test_stratified_sample_stays_within_page_budget(self):
+    TEST_SAMPLER = sampling.FollowerSampler(sample_size=5, page_budget=2, oversampling=2, seed=1)
+    RESULT_CANDIDATES = []
+    while True:
+      candidates = TEST_SAMPLER.next_candidates(self._progress, self.fetch_page, 300, excluded_ids={0, 1})
+      if not candidates:
+        break
+      RESULT_CANDIDATES.extend(candidates)
+    self.assertEqual([-1, 100], self._fetched_cursors)
+    self.assertTrue(all(2 <= candidate < 200 for candidate in RESULT_CANDIDATES))
+    self.assertEqual(len(RESULT_CANDIDATES), len(set(RESULT_CANDIDATES)))
+
+  def test_reservoir_walks_whole_list_once(self):
+    TEST_SAMPLER = sampling.FollowerSampler(sample_size=4, mode='reservoir', oversampling=2, seed=1)
+    RESULT_CANDIDATES = TEST_SAMPLER.next_candidates(self._progress, self.fetch_page, 300)
+    self.assertEqual(8, len(set(RESULT_CANDIDATES)))
+    self.assertEqual(300, self._progress['ids_seen'])
+    self.assertEqual(0, self._progress['cursor'])
+    self.assertEqual([], TEST_SAMPLER.next_candidates(self._progress, self.fetch_page, 300))
+
+  def sample_all(self, progress, fetch_page, mode):
+    # The candidate batches of a sampler walking the follower list until it is done, or until fetch_page raises
+    TEST_SAMPLER = sampling.FollowerSampler(sample_size=4, mode=mode, oversampling=2, seed=1)
+    candidate_batches = []
+    try:
+      while True:
+        candidates = TEST_SAMPLER.next_candidates(progress, fetch_page, 300, account_id='a')
+        if not candidates:
+          return candidate_batches
+        candidate_batches.append(candidates)
+    except RuntimeError:
+      return candidate_batches
+
+  def test_resumed_sample_matches_uninterrupted_sample(self):
+    def TEST_FAILING_FETCH_PAGE(cursor):
+      if cursor == 200:
+        raise RuntimeError('crawl stopped')
+      return self.fetch_page(cursor)
+    for TEST_MODE in sampling.SAMPLING_MODES:
+      RESULT_BATCHES = self.sample_all({'cursor': -1, 'pages_done': 0, 'sampled_follower_ids': [], 'followers': []}, self.fetch_page, TEST_MODE)
+      # The crawl stops while fetching the third page, and resumes with a new sampler from the progress saved in the checkpoint
+      TEST_PROGRESS = {'cursor': -1, 'pages_done': 0, 'sampled_follower_ids': [], 'followers': []}
+      RESUMED_BATCHES = self.sample_all(TEST_PROGRESS, TEST_FAILING_FETCH_PAGE, TEST_MODE)
+      RESUMED_BATCHES += self.sample_all(json.loads(json.dumps(TEST_PROGRESS)), self.fetch_page, TEST_MODE)
+      self.assertEqual(RESULT_BATCHES, RESUMED_BATCHES)
+
+class InterruptedTwitterAPI(faketwitter.FakeTwitterAPI):
+
+  '''
+  FakeTwitterAPI that raises error on every call past the first calls_allowed, like a crawl killed mid-way.
+  '''
+
+  def __init__(self, dataset, calls_allowed, error=None):
+    super().__init__(dataset)
+    self.calls_allowed = calls_allowed
+    self.error = error or RuntimeError('crawl interrupted')
+
+  def _begin_call(self, endpoint):
+    if sum(self.calls.values()) >= self.calls_allowed:
+      raise self.error
+    super()._begin_call(endpoint)
+
+class TestGatheringPipeline(DatabaseTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._directory = tempfile.TemporaryDirectory()
+    self._checkpoint_path = os.path.join(self._directory.name, 'crawl_checkpoint.json')
+    # Three reference accounts with 20 followers each; every follower follows its reference account and the next follower, except every fifth one, which follows too few accounts to qualify
+    self._dataset = faketwitter.TwitterDataset()
+    follows = []
+    for reference_id in (1, 2, 3):
+      follower_ids = list(range(reference_id * 100, reference_id * 100 + 20))
+      for follower_id in follower_ids:
+        follows.append((follower_id, reference_id))
+        if follower_id % 5:
+          follows.append((follower_id, follower_ids[(follower_ids.index(follower_id) + 1) % 20]))
+    user_ids = sorted(set(user_id for follow in follows for user_id in follow))
+    for user_id in user_ids:
+      self._dataset.friends[user_id] = [followed_id for follower_id, followed_id in follows if follower_id == user_id]
+      self._dataset.followers[user_id] = [follower_id for follower_id, followed_id in follows if followed_id == user_id]
+      self._dataset.add_user({'id': user_id, 'screen_name': 'user' + str(user_id), 'description': '', 'protected': False, 'friends_count': len(self._dataset.friends[user_id]), 'followers_count': len(self._dataset.followers[user_id])})
+    self._top_users_by_category = {'sports': [('user1', 20), ('user2', 20)], 'food': [('user3', 20)]}
+
+  def tearDown(self):
+    self._directory.cleanup()
+    clients.configure(twitter_api=None)
+    super().tearDown()
+
+  def gather(self, twitter_api, concurrency, resume=False):
+    # Runs get_users against the fake API, keeping the database, and returns the users stored so far
+    clients.configure(twitter_api=twitter_api)
+    TEST_SAMPLER = sampling.FollowerSampler(sample_size=4, min_friends=2, min_followers=0, seed=1)
+    try:
+      main.get_users(self._top_users_by_category, resume=resume, checkpoint_path=self._checkpoint_path, follower_sampler=TEST_SAMPLER, concurrency=concurrency)
+    finally:
+      stored_users = {
+        userinfo.id: (sorted(userinfo.friends.tolist()), sorted(userinfo.followers.tolist()), userinfo.followers_sampled)
+        for userinfo in utils.iter_userinfo_objects_from_db()
+      }
+    return stored_users
+
+  def test_concurrent_crawl_matches_serial_crawl(self):
+    RESULT_USERS = self.gather(faketwitter.FakeTwitterAPI(self._dataset), concurrency=1)
+    self._db.userinfo.delete_many({})
+    self.assertEqual(RESULT_USERS, self.gather(faketwitter.FakeTwitterAPI(self._dataset), concurrency=3))
+    # Each reference account keeps a sample of 4 qualifying followers
+    self.assertEqual([4, 4, 4], [len(RESULT_USERS[reference_id][1]) for reference_id in (1, 2, 3)])
+    self.assertEqual(15, len(RESULT_USERS))
+
+  def test_interrupted_crawl_resumes(self):
+    TEST_API = faketwitter.FakeTwitterAPI(self._dataset)
+    RESULT_USERS = self.gather(TEST_API, concurrency=1)
+    calls_needed = sum(TEST_API.calls.values())
+    for TEST_CONCURRENCY in (1, 3):
+      self._db.userinfo.delete_many({})
+      with unittest.mock.patch.object(checkpoint, 'CHECKPOINT_INTERVAL', 0):
+        with self.assertRaises(RuntimeError):
+          self.gather(InterruptedTwitterAPI(self._dataset, calls_needed // 2), TEST_CONCURRENCY)
+        self.assertTrue(os.path.exists(self._checkpoint_path))
+        self.assertEqual(RESULT_USERS, self.gather(faketwitter.FakeTwitterAPI(self._dataset), TEST_CONCURRENCY, resume=True))
+      self.assertFalse(os.path.exists(self._checkpoint_path))
+
+class TestFakeTwitter(unittest.TestCase):
+
+  def setUp(self):
+    self._dataset = faketwitter.TwitterDataset.synthetic(300, seed=1)
+    self._top_user_id = max(self._dataset.users, key=lambda user_id: len(self._dataset.followers[user_id]))
+    self._top_handle = self._dataset.users[self._top_user_id]['screen_name']
+
+  def tearDown(self):
+    clients.configure(twitter_api=None)
+
+  def test_follower_pages_through_scheduler(self):
+    TEST_SCHEDULER = scheduler.RateLimitScheduler(faketwitter.fake_api_pool(self._dataset, 2, ids_page_size=50))
+    RESULT_IDS = [
+      follower_id
+      for page in tweepy.Cursor(TEST_SCHEDULER.followers_ids, screen_name=self._top_handle).pages()
+      for follower_id in page
+    ]
+    self.assertEqual(self._dataset.followers[self._top_user_id], RESULT_IDS)
+    self.assertEqual(15, TEST_SCHEDULER.budgets[0]['followers_ids'].limit)
+
+  def test_rate_limited_key_is_skipped(self):
+    TEST_LIMITED_API = faketwitter.FakeTwitterAPI(self._dataset, spurious_rate_limit_rate=1.0)
+    TEST_API = faketwitter.FakeTwitterAPI(self._dataset)
+    TEST_SCHEDULER = scheduler.RateLimitScheduler([TEST_LIMITED_API, TEST_API])
+    for _ in range(3):
+      TEST_SCHEDULER.get_user(user_id=self._top_user_id)
+    self.assertEqual(1, TEST_LIMITED_API.rate_limited_calls['get_user'])
+    self.assertEqual(3, TEST_API.calls['get_user'])
+    self.assertEqual(429, TEST_LIMITED_API.last_response.status_code)
+
+  def test_get_top_users_by_followers_offline(self):
+    clients.configure(twitter_api=scheduler.RateLimitScheduler(faketwitter.fake_api_pool(self._dataset)))
+    RESULT_OUTPUT = main.get_top_users_by_followers(['sports'], {'sports': ['nobody', self._top_handle], 'food': [self._top_handle]})
+    self.assertEqual({'sports': [(self._top_handle, len(self._dataset.followers[self._top_user_id]))]}, RESULT_OUTPUT)
+
+  def test_lookup_users_keeps_order_across_batches(self):
+    TEST_API = faketwitter.FakeTwitterAPI(self._dataset)
+    clients.configure(twitter_api=TEST_API)
+    TEST_USER_IDS = sorted(self._dataset.users)
+    TEST_MISSING_IDS = [-user_id for user_id in range(1, 101)]
+    # The second batch of 100 ids only has missing accounts, which Twitter answers with error 17
+    TEST_IDENTIFIERS = TEST_USER_IDS[:100] + TEST_MISSING_IDS + TEST_USER_IDS[100:150][::-1] + [TEST_USER_IDS[0], self._top_handle.upper(), 'nobody']
+    RESULT_USERS = utils.lookup_users(TEST_IDENTIFIERS)
+    EXPECTED_IDS = TEST_USER_IDS[:100] + [None] * 100 + TEST_USER_IDS[100:150][::-1] + [TEST_USER_IDS[0], self._top_user_id, None]
+    self.assertEqual(EXPECTED_IDS, [tweepy_user._json['id'] if tweepy_user is not None else None for tweepy_user in RESULT_USERS])
+    self.assertEqual(4, TEST_API.calls['lookup_users'])
+
+  def test_adjacency_is_fetched_lazily_and_capped(self):
+    TEST_API = faketwitter.FakeTwitterAPI(self._dataset, ids_page_size=10)
+    clients.configure(twitter_api=TEST_API)
+    TEST_TWEEPY_USER = TEST_API.get_user(user_id=self._top_user_id)
+    TEST_COUNTS_USERINFO = utils.tweepy_user_to_userinfo_object(TEST_TWEEPY_USER, adjacency='counts')
+    TEST_LAZY_USERINFO = utils.tweepy_user_to_userinfo_object(TEST_TWEEPY_USER, page_limits={'followers': 1})
+    self.assertEqual(0, TEST_API.calls['followers_ids'] + TEST_API.calls['friends_ids'])
+    self.assertEqual((0, len(self._dataset.followers[self._top_user_id])), (len(TEST_COUNTS_USERINFO.followers), TEST_COUNTS_USERINFO.followers_count))
+    self.assertFalse(TEST_LAZY_USERINFO.is_loaded('followers'))
+    self.assertEqual(self._dataset.followers[self._top_user_id][:10], list(TEST_LAZY_USERINFO.followers))
+    self.assertEqual((1, 0), (TEST_API.calls['followers_ids'], TEST_API.calls['friends_ids']))
+
+class TestImportTime(unittest.TestCase):
+
+  def test_main_imports_no_graph_libraries(self):
+    # networkx, numpy and scipy take most of the time an import takes, so importing main for the CLI or the crawl leaves them to the functions that need them
+    TEST_HEAVY_MODULES = ['networkx', 'numpy', 'scipy', 'propagation', 'pruning', 'tagindex', 'snapshot', 'pipeline', 'frontier', 'refresh']
+    RESULT_OUTPUT = subprocess.run(
+      [sys.executable, '-c', 'import sys, json, main; print(json.dumps(sorted(name for name in ' + json.dumps(TEST_HEAVY_MODULES) + ' if name in sys.modules)))'],
+      cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    ).stdout
+    self.assertEqual([], json.loads(RESULT_OUTPUT))
 
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
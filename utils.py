@@ -1,40 +1,63 @@
 #region Imports & Init API variables
 
 # System libraries
-import json
-import time
-import csv
 import random
-
-# Third party libraries (pip)
-import tweepy
-import pymongo
-import dns
-from faker import Faker # https://faker.readthedocs.io/en/stable/
-from faker.providers import lorem
+import datetime
+import functools
+from array import array
 
 # Custom libraries
 import classes
+import clients
+
+# tweepy, pymongo, faker, numpy, idcodec and csrgraph are imported where they are used, and the Twitter and MongoDB clients are created on first use (see clients), so importing utils for offline graph work stays fast and needs no credentials
+
+# Where friends and followers are stored: 'embedded' as arrays in each userinfo document, or 'edges' as one document per follow edge in the edges collection, for accounts too big for MongoDB's 16 MB document limit
+EDGE_STORAGE_MODE = 'embedded'
+
+# How embedded friends and followers are encoded: 'varint' as delta-varint binary (see idcodec), or 'array' as BSON arrays of ids. Documents in either form can be read back
+ADJACENCY_ENCODING = 'varint'
+
+# Pages of up to 5000 ids fetched at most for each direction of an account's adjacency
+ADJACENCY_PAGE_LIMITS = {
+  'friends': 2,
+  'followers': 2
+}
+
+# How tweepy_user_to_userinfo_object fills friends and followers: 'eager' fetches them right away, 'lazy' on first access (or load_adjacency), 'counts' keeps only the profile's counts
+ADJACENCY_MODES = ('eager', 'lazy', 'counts')
 
-# Open credentials.json and load the information to create the tweepy API object for queries
-with open('credentials.json') as credentials_file:
-  credentials = json.load(credentials_file)
+# The users/lookup endpoint accepts at most 100 ids or screen names per request
+LOOKUP_BATCH_SIZE = 100
 
-auth = tweepy.OAuthHandler(credentials['consumer_key'], credentials['consumer_secret'])
-auth.set_access_token(credentials['access_token'], credentials['access_token_secret'])
-api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True, compression=True)
+# Number of userinfo documents fetched per database round trip when streaming them
+HYDRATION_BATCH_SIZE = 1000
 
-# Init faker module and add relevent providers to generate fake data
-fake = Faker()
-fake.add_provider(lorem)
+# UserInfo attribute stored in each field of a userinfo document
+USERINFO_DOCUMENT_FIELDS = {
+  'userid': 'id',
+  'description': 'description',
+  'handle': 'handle',
+  'followers': 'followers',
+  'friends': 'friends',
+  'tags': 'tags',
+  'friends_count': 'friends_count',
+  'followers_count': 'followers_count',
+  'fetched_at': 'fetched_at',
+  'fetched_friends_count': 'fetched_friends_count',
+  'fetched_followers_count': 'fetched_followers_count',
+  'followers_sampled': 'followers_sampled'
+}
 
-# Init MonogoDB connection
-MONGO_CLIENT = pymongo.MongoClient('mongodb+srv://' + credentials['mongodbuser'] + ':' + credentials['mongodbpassword'] + '@howla-sandbox-fdsr1.mongodb.net/test?retryWrites=true&w=majority')
-TWITTER_USER_DATA_DB = MONGO_CLIENT.twitter_user_data
+# Number of userinfo documents upserted per bulk write
+WRITE_CHUNK_SIZE = 500
+
+# Number of follow edges upserted per bulk write
+EDGE_WRITE_CHUNK_SIZE = 5000
 
 #endregion
 
-def get_ids_by_type(id_type, screen_name="ohitsdoh"): 
+def get_ids_by_type(id_type, screen_name="ohitsdoh", max_pages=None): 
 
   '''
   Get a list of user ids from a Twitter account by the type specified.
@@ -43,105 +66,530 @@ def get_ids_by_type(id_type, screen_name="ohitsdoh"):
   ===
   id_type -- the type of id to get (either friends or followers)
   screen_name -- the twitter account's screen name to get the ids from
+  max_pages -- the most pages of 5000 ids fetched, ADJACENCY_PAGE_LIMITS[id_type] when None
 
-  return: ids -- the list of ids represented as integers
+  return: ids -- the ids as a packed array('q') of 64-bit integers
 
   '''
 
+  import tweepy
+
   # Specify method by id_type to use
   if id_type == "followers":
-    method_to_use = api.followers_ids
+    method_to_use = clients.get_api().followers_ids
   else:
-    method_to_use = api.friends_ids
-
-  # Get the list of ids, paginated by 5000 at a time.
-  ids = []
-  # Arbitarily set to get 100k followers right now, until decision on how to handle more data in memory
-  for page in limit_handled(tweepy.Cursor(method_to_use, screen_name=screen_name).pages(2)):
-    if len(page) == 5000:
-      ids.extend(page)
-      time.sleep(10)
-    else:
-      ids.extend(page)
+    method_to_use = clients.get_api().friends_ids
+
+  # Get the list of ids, paginated by 5000 at a time, straight into a packed 64-bit id buffer
+  ids = array('q')
+  if max_pages is None:
+    max_pages = ADJACENCY_PAGE_LIMITS[id_type]
+  for page in limit_handled(tweepy.Cursor(method_to_use, screen_name=screen_name).pages(max_pages)):
+    ids.extend(page)
 
   return ids
 
-def tweepy_user_to_userinfo_object(tweepy_user):
+def get_ids_page(id_type, screen_name, cursor=-1):
+
+  '''
+  Gets a single page of up to 5000 user ids from a Twitter account by the type specified.
+
+  Keyword arguments:
+  ===
+  id_type -- the type of id to get (either friends or followers)
+  screen_name -- the twitter account's screen name to get the ids from
+  cursor -- the cursor of the page, -1 for the first one
+
+  return: ids, next_cursor -- the page of ids, and the cursor of the next page (0 after the last one)
+
+  '''
+
+  import tweepy
+
+  method_to_use = clients.get_api().followers_ids if id_type == "followers" else clients.get_api().friends_ids
+  pages = tweepy.Cursor(method_to_use, screen_name=screen_name, cursor=cursor).pages(1)
+  page = next(pages, None)
+  if page is None:
+    return [], 0
+  return page, pages.next_cursor
+
+def tweepy_user_to_userinfo_object(tweepy_user, adjacency='lazy', page_limits=None):
 
   '''
   Converts a tweepy.User object into a UserInfo object.
 
+  The profile alone costs no API call, friends and followers cost one call per page of 5000 ids each, so by default they are only fetched when first read.
+
   Keyword Arguments:
   ===
   tweepy_user -- the tweepy.User object to convert into a UserInfo object
+  adjacency -- one of ADJACENCY_MODES: 'eager', 'lazy' or 'counts'
+  page_limits -- the most pages fetched for 'friends' and 'followers', ADJACENCY_PAGE_LIMITS for the directions left out
 
   return: userinfo_object -- the converted tweepy.User object as a UserInfo object
 
   '''
 
+  if adjacency not in ADJACENCY_MODES:
+    raise ValueError('Unknown adjacency mode: ' + str(adjacency))
+  page_limits = dict(ADJACENCY_PAGE_LIMITS, **(page_limits or {}))
+  screen_name = tweepy_user._json['screen_name']
+
   userinfo_object = classes.UserInfo(
         id = tweepy_user._json['id'],
         description = tweepy_user._json['description'],
-        handle = tweepy_user._json['screen_name'],
-        followers = get_ids_by_type('followers', tweepy_user._json['screen_name']),
-        friends = get_ids_by_type('friends', tweepy_user._json['screen_name']),
-        tags = []
+        handle = screen_name,
+        # Without a loader, lists that are never given stay empty
+        followers = () if adjacency == 'counts' else None,
+        friends = () if adjacency == 'counts' else None,
+        tags = [],
+        friends_count = tweepy_user._json.get('friends_count'),
+        followers_count = tweepy_user._json.get('followers_count'),
+        adjacency_loader = None if adjacency == 'counts' else lambda id_type: get_ids_by_type(id_type, screen_name, page_limits[id_type])
   )
+  if adjacency == 'eager':
+    userinfo_object.load_adjacency()
 
   return userinfo_object
-      
-def add_userinfo_to_db(userinfo_collection):
-  
+
+def lookup_users(identifiers):
+
+  '''
+  Resolves Twitter user ids and/or screen names into tweepy.User objects, batched 100 at a time through the users/lookup endpoint.
+
+  Keyword Arguments:
+  ===
+  identifiers -- the list of user ids (integers) and/or screen names (strings) to resolve
+
+  return: users -- the list of tweepy.User objects in the same order as identifiers, with None for accounts that could not be found
+
+  '''
+
+  # Collect the pending ids and handles, dropping duplicates while keeping their order
+  pending_ids = list(dict.fromkeys(int(identifier) for identifier in identifiers if not isinstance(identifier, str)))
+  pending_handles = list(dict.fromkeys(identifier.lower() for identifier in identifiers if isinstance(identifier, str)))
+
+  users_by_id = {}
+  for batch_start in range(0, len(pending_ids), LOOKUP_BATCH_SIZE):
+    for tweepy_user in lookup_users_batch(user_ids=pending_ids[batch_start:batch_start + LOOKUP_BATCH_SIZE]):
+      users_by_id[tweepy_user._json['id']] = tweepy_user
+
+  users_by_handle = {}
+  for batch_start in range(0, len(pending_handles), LOOKUP_BATCH_SIZE):
+    for tweepy_user in lookup_users_batch(screen_names=pending_handles[batch_start:batch_start + LOOKUP_BATCH_SIZE]):
+      users_by_handle[tweepy_user._json['screen_name'].lower()] = tweepy_user
+
+  return [
+    users_by_handle.get(identifier.lower()) if isinstance(identifier, str) else users_by_id.get(int(identifier))
+    for identifier in identifiers
+  ]
+
+def lookup_users_batch(user_ids=None, screen_names=None):
+
+  '''
+  Runs a single users/lookup request for up to 100 user ids or screen names.
+
+  Keyword Arguments:
+  ===
+  user_ids -- the list of user ids to look up
+  screen_names -- the list of screen names to look up
+
+  return: the list of tweepy.User objects found, in no particular order (suspended or deleted accounts are left out)
+
+  '''
+
+  import tweepy
+
+  try:
+    return clients.get_api().lookup_users(user_ids=user_ids, screen_names=screen_names)
+  except tweepy.TweepError as error:
+    # Twitter answers with error 17 when none of the requested accounts exist
+    if error.api_code == 17:
+      return []
+    raise
+
+def lookup_userinfo_objects(identifiers, adjacency='lazy'):
+
+  '''
+  Resolves Twitter user ids and/or screen names into UserInfo objects using batched profile lookups.
+
+  Keyword Arguments:
+  ===
+  identifiers -- the list of user ids (integers) and/or screen names (strings) to resolve
+  adjacency -- how friends and followers are filled, one of ADJACENCY_MODES (see tweepy_user_to_userinfo_object)
+
+  return: the list of UserInfo objects in the same order as identifiers, with None for accounts that could not be found
+
+  '''
+
+  return [
+    tweepy_user_to_userinfo_object(tweepy_user, adjacency) if tweepy_user is not None else None
+    for tweepy_user in lookup_users(identifiers)
+  ]
+
+def add_userinfo_to_db(userinfo_collection, chunk_size=WRITE_CHUNK_SIZE, storage_mode=None):
+
   '''
   Add json-serialized UserInfo object(s) to the MongoDB database collection specified.
 
+  Documents are upserted on userid in unordered bulk writes of chunk_size documents, so writing the same users again (e.g. a retried or resumed crawl) updates them instead of adding duplicates.
+
   Keyword arguments:
   ===
-  userinfo_collection -- The collection of UserInfo objects to be added to the database
+  userinfo_collection -- The collection of UserInfo objects to be added to the database, any iterable (e.g. a generator fed by the crawler), consumed one chunk at a time
+  chunk_size -- the number of documents sent per bulk write
+  storage_mode -- 'embedded' to store friends and followers as arrays in each userinfo document, or 'edges' to store them as (src, dst) documents in the edges collection, where each user's complete lists replace the edges stored for them, so unfollows are removed (see remove_stale_edges_from_db); EDGE_STORAGE_MODE when None
 
-  return: the list of ObjectIds of the inserted UserInfo objects
+  return: write_counts -- the number of documents 'inserted' and 'updated'
 
   '''
 
+  import pymongo
+
+  storage_mode = storage_mode or EDGE_STORAGE_MODE
+
   # Connect to the MongoDB database and collection
-  db_userinfo = TWITTER_USER_DATA_DB.userinfo
+  db_userinfo = clients.get_db().userinfo
+  clients.run_setup_once('userinfo_indexes', ensure_userinfo_indexes)
+
+  write_counts = {'inserted': 0, 'updated': 0}
+  for userinfo_chunk in chunked(userinfo_collection, chunk_size):
+    result = db_userinfo.bulk_write([
+      pymongo.UpdateOne({'userid': userinfo.id}, {'$set': userinfo_to_document(userinfo, storage_mode)}, upsert=True)
+      for userinfo in userinfo_chunk
+    ], ordered=False)
+    write_counts['inserted'] += result.upserted_count
+    write_counts['updated'] += result.matched_count
+    if storage_mode == 'edges':
+      add_edges_to_db(userinfo_edges(userinfo) for userinfo in userinfo_chunk)
+      remove_stale_edges_from_db(userinfo_chunk)
+
+  return write_counts
+
+def update_userinfo_profiles_in_db(userinfo_collection, chunk_size=WRITE_CHUNK_SIZE):
+
+  '''
+  Updates the profile fields (description, handle and counts) of users already in the database, leaving their friends, followers, tags and the counts their lists were fetched at as they are, and records when they were checked.
+
+  Keyword arguments:
+  ===
+  userinfo_collection -- any iterable of UserInfo objects, the users missing from the database are skipped
+  chunk_size -- the number of documents sent per bulk write
+
+  return: the number of documents updated
+
+  '''
 
-  userinfo_to_be_inserted = [{ 
+  import pymongo
+
+  db_userinfo = clients.get_db().userinfo
+  checked_at = datetime.datetime.now(datetime.timezone.utc)
+  updated_count = 0
+  for userinfo_chunk in chunked(userinfo_collection, chunk_size):
+    result = db_userinfo.bulk_write([
+      pymongo.UpdateOne({'userid': userinfo.id}, {'$set': {
+        'description': userinfo.description,
+        'handle': userinfo.handle,
+        'friends_count': userinfo.friends_count,
+        'followers_count': userinfo.followers_count,
+        'checked_at': checked_at
+      }})
+      for userinfo in userinfo_chunk
+    ], ordered=False)
+    updated_count += result.matched_count
+  return updated_count
+
+def userinfo_to_document(userinfo, storage_mode='embedded'):
+  document = {
     'userid': userinfo.id,
     'description': userinfo.description,
     'handle': userinfo.handle,
-    'followers': userinfo.followers,
-    'friends': userinfo.friends,
-    'tags': userinfo.tags
-  } for userinfo in userinfo_collection]
-
-  result = db_userinfo.insert_many(userinfo_to_be_inserted)
-  return result.inserted_ids
-
-def hydrate_userinfo_objects_from_db():
-
-  db_userinfo = TWITTER_USER_DATA_DB.userinfo
-  hydrated_userinfoes = []
-
-  for userinfo in db_userinfo.find():
-    userinfo_object = classes.UserInfo(
-        id = userinfo['userid'],
-        description = userinfo['description'],
-        handle = userinfo['handle'],
-        followers = userinfo['followers'],
-        friends = userinfo['friends'],
-        tags = userinfo['tags']
-    )
-    hydrated_userinfoes.append(userinfo_object)
-  
-  return hydrated_userinfoes
+    'tags': userinfo.tags,
+    'updated_at': datetime.datetime.now(datetime.timezone.utc)
+  }
+  if storage_mode == 'embedded':
+    # Lists that were never loaded are left as stored, rather than fetched from Twitter in the middle of a write
+    if userinfo.is_loaded('followers'):
+      document['followers'] = encode_adjacency(userinfo.followers)
+    if userinfo.is_loaded('friends'):
+      document['friends'] = encode_adjacency(userinfo.friends)
+  # The profile's counts are kept when known, as the id lists may be capped or left out, fetched_at and the counts the lists were fetched at once they are loaded, and whether the followers are a sample
+  for optional_field in ('friends_count', 'followers_count', 'fetched_at', 'fetched_friends_count', 'fetched_followers_count', 'followers_sampled'):
+    if getattr(userinfo, optional_field) is not None:
+      document[optional_field] = getattr(userinfo, optional_field)
+  return document
+
+def encode_adjacency(ids):
+  import idcodec
+  if ADJACENCY_ENCODING == 'varint':
+    return ids.data if isinstance(ids, idcodec.PackedIds) else idcodec.encode_ids(ids)
+  return ids.tolist()
+
+def userinfo_edges(userinfo):
+  # Each edge goes from the follower (src) to the followed account (dst), for the lists that are loaded
+  edges = []
+  if userinfo.is_loaded('friends'):
+    edges.extend((userinfo.id, friend_id) for friend_id in userinfo.friends)
+  if userinfo.is_loaded('followers'):
+    edges.extend((follower_id, userinfo.id) for follower_id in userinfo.followers)
+  return edges
+
+#region Edge store
+
+def add_edges_to_db(edge_lists, chunk_size=EDGE_WRITE_CHUNK_SIZE):
+
+  '''
+  Adds follow edges to the edges collection, as idempotent unordered upserts of chunk_size edges at a time.
+
+  Keyword Arguments:
+  ===
+  edge_lists -- an iterable of lists of (src, dst) tuples, where src follows dst
+  chunk_size -- the number of edges sent per bulk write
+
+  return: the number of edges that were not in the collection yet
+
+  '''
+
+  import pymongo
+
+  db_edges = clients.get_db().edges
+  clients.run_setup_once('edge_indexes', ensure_edge_indexes)
+
+  edges_inserted = 0
+  all_edges = (edge for edge_list in edge_lists for edge in edge_list)
+  for edge_chunk in chunked(all_edges, chunk_size):
+    result = db_edges.bulk_write([
+      pymongo.UpdateOne({'src': source_id, 'dst': destination_id}, {'$setOnInsert': {'src': source_id, 'dst': destination_id}}, upsert=True)
+      for source_id, destination_id in edge_chunk
+    ], ordered=False)
+    edges_inserted += result.upserted_count
+
+  return edges_inserted
+
+def remove_stale_edges_from_db(userinfo_objects):
+
+  '''
+  Removes the stored edges of users that their current friends and followers lists no longer have, e.g. once they unfollowed an account. Only complete lists replace the stored edges (see has_complete_ids): lists that are not loaded, cut by the page limits or sampled only ever add edges.
+
+  Keyword Arguments:
+  ===
+  userinfo_objects -- the list of UserInfo objects whose edges were just written
+
+  return: the number of edges removed
+
+  '''
+
+  import pymongo
+
+  delete_operations = []
+  for userinfo in userinfo_objects:
+    if has_complete_ids(userinfo, 'friends'):
+      delete_operations.append(pymongo.DeleteMany({'src': userinfo.id, 'dst': {'$nin': userinfo.friends.tolist()}}))
+    if has_complete_ids(userinfo, 'followers'):
+      delete_operations.append(pymongo.DeleteMany({'dst': userinfo.id, 'src': {'$nin': userinfo.followers.tolist()}}))
+  if not delete_operations:
+    return 0
+  return clients.get_db().edges.bulk_write(delete_operations, ordered=False).deleted_count
+
+def has_complete_ids(userinfo, id_type):
+  # Loaded, not a sample, and as long as the profile's count when it is known
+  if not userinfo.is_loaded(id_type) or id_type == 'followers' and userinfo.followers_sampled:
+    return False
+  count = getattr(userinfo, id_type + '_count')
+  return count is None or len(getattr(userinfo, id_type)) >= count
+
+def get_friend_ids_from_db(userid):
+  # Served by the (src, dst) index
+  return array('q', (edge['dst'] for edge in clients.get_db().edges.find({'src': userid}, {'_id': False, 'dst': True})))
+
+def get_follower_ids_from_db(userid):
+  # Served by the (dst, src) index, instead of a scan of every user's friends
+  return array('q', (edge['src'] for edge in clients.get_db().edges.find({'dst': userid}, {'_id': False, 'src': True})))
+
+def iter_edges_from_db(userids=None, batch_size=EDGE_WRITE_CHUNK_SIZE):
+
+  '''
+  Streams follow edges from the edges collection, e.g. to build a graph without hydrating every user.
+
+  Keyword Arguments:
+  ===
+  userids -- only get the edges starting or ending at these users; all edges when None
+  batch_size -- the number of edges the database cursor fetches per round trip
+
+  return: a generator of (src, dst) tuples, where src follows dst
+
+  '''
+
+  query = {}
+  if userids is not None:
+    userids = list(userids)
+    query = {'$or': [{'src': {'$in': userids}}, {'dst': {'$in': userids}}]}
+  for edge in clients.get_db().edges.find(query, {'_id': False, 'src': True, 'dst': True}).batch_size(batch_size):
+    yield (edge['src'], edge['dst'])
+
+def fill_adjacency_from_edge_store(userinfo_objects, chunk_size, with_friends=True, with_followers=True):
+  # Look up the edges of a whole chunk of users per query, through the indexes in both directions
+  db_edges = clients.get_db().edges
+  for userinfo_chunk in chunked(userinfo_objects, chunk_size):
+    userinfo_by_id = {userinfo.id: userinfo for userinfo in userinfo_chunk}
+    friend_ids = {userid: array('q') for userid in userinfo_by_id}
+    follower_ids = {userid: array('q') for userid in userinfo_by_id}
+    if with_friends:
+      for edge in db_edges.find({'src': {'$in': list(userinfo_by_id)}}, {'_id': False, 'src': True, 'dst': True}):
+        friend_ids[edge['src']].append(edge['dst'])
+    if with_followers:
+      for edge in db_edges.find({'dst': {'$in': list(userinfo_by_id)}}, {'_id': False, 'src': True, 'dst': True}):
+        follower_ids[edge['dst']].append(edge['src'])
+    for userinfo in userinfo_chunk:
+      if with_friends:
+        userinfo.friends = friend_ids[userinfo.id]
+      if with_followers:
+        userinfo.followers = follower_ids[userinfo.id]
+      yield userinfo
+
+def migrate_userinfo_to_edge_store(batch_size=HYDRATION_BATCH_SIZE):
+
+  '''
+  Moves the friends and followers arrays embedded in userinfo documents into the edges collection. Each document's arrays are only removed once its edges are written, so the migration can be interrupted and run again.
+
+  Keyword Arguments:
+  ===
+  batch_size -- the number of userinfo documents migrated per round
+
+  return: the number of userinfo documents migrated
+
+  '''
+
+  db_userinfo = clients.get_db().userinfo
+  embedded_query = {'$or': [{'friends': {'$exists': True}}, {'followers': {'$exists': True}}]}
+  documents_migrated = 0
+  while True:
+    documents = list(db_userinfo.find(embedded_query, {'_id': True, 'userid': True, 'friends': True, 'followers': True}).limit(batch_size))
+    if not documents:
+      return documents_migrated
+    add_edges_to_db(userinfo_edges(document_to_userinfo_object(document)) for document in documents)
+    db_userinfo.update_many({'_id': {'$in': [document['_id'] for document in documents]}}, {'$unset': {'friends': '', 'followers': ''}})
+    documents_migrated += len(documents)
+
+def ensure_edge_indexes():
+  import pymongo
+
+  db_edges = clients.get_db().edges
+  db_edges.create_index([('src', pymongo.ASCENDING), ('dst', pymongo.ASCENDING)], unique=True)
+  db_edges.create_index([('dst', pymongo.ASCENDING), ('src', pymongo.ASCENDING)])
+
+#endregion
+
+def ensure_userinfo_indexes():
+
+  '''
+  Creates the unique index on userid that keeps the userinfo collection free of duplicates, first removing the duplicates left by earlier insert-only crawls (the most recently written document of each user is kept).
+
+  '''
+
+  import pymongo
+
+  db_userinfo = clients.get_db().userinfo
+  try:
+    db_userinfo.create_index('userid', unique=True)
+  except pymongo.errors.OperationFailure:
+    duplicates = db_userinfo.aggregate([
+      {'$sort': {'_id': -1}},
+      {'$group': {'_id': '$userid', 'document_ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+      {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    for duplicate in duplicates:
+      db_userinfo.delete_many({'_id': {'$in': duplicate['document_ids'][1:]}})
+    db_userinfo.create_index('userid', unique=True)
+
+def hydrate_userinfo_objects_from_db(**query_options):
+
+  '''
+  Gets the UserInfo objects stored in the database as a list.
+
+  Keyword Arguments:
+  ===
+  query_options -- the projection, filters and batch size, see iter_userinfo_objects_from_db
+
+  return: the list of UserInfo objects
+
+  '''
+
+  return list(iter_userinfo_objects_from_db(**query_options))
+
+def iter_userinfo_objects_from_db(fields=None, tags=None, userids=None, updated_since=None, batch_size=HYDRATION_BATCH_SIZE, chunk_size=None, storage_mode=None, packed_adjacency=False):
+
+  '''
+  Streams the UserInfo objects stored in the database, fetching batch_size documents per round trip, so the whole collection is never held in memory at once (e.g. users_to_graph can consume the stream directly).
+
+  Keyword Arguments:
+  ===
+  fields -- the document fields to fetch, e.g. ['userid', 'handle', 'tags'] to leave out the large friends and followers arrays (userid is always fetched, and the fields left out get UserInfo defaults); all fields when None
+  tags -- only get users with any of these tags
+  userids -- only get the users with these ids
+  updated_since -- only get users written to the database at or after this datetime
+  batch_size -- the number of documents the database cursor fetches per round trip
+  chunk_size -- yield lists of up to chunk_size UserInfo objects instead of single objects
+  storage_mode -- where friends and followers are read from, 'embedded' or 'edges' (see add_userinfo_to_db); EDGE_STORAGE_MODE when None
+  packed_adjacency -- keep delta-varint encoded friends and followers encoded in memory, as idcodec.PackedIds, instead of decoding them into id buffers
+
+  return: a generator of UserInfo objects, or of lists of them when chunk_size is given
+
+  '''
+
+  db_userinfo = clients.get_db().userinfo
+
+  query = {}
+  if tags is not None:
+    query['tags'] = {'$in': list(tags)}
+  if userids is not None:
+    query['userid'] = {'$in': list(userids)}
+  if updated_since is not None:
+    query['updated_at'] = {'$gte': updated_since}
+  projection = None
+  if fields is not None:
+    projection = dict.fromkeys(set(fields) | {'userid'}, True)
+    projection['_id'] = False
+
+  userinfo_objects = (
+    document_to_userinfo_object(document, packed_adjacency)
+    for document in db_userinfo.find(query, projection).batch_size(batch_size)
+  )
+  if (storage_mode or EDGE_STORAGE_MODE) == 'edges':
+    with_friends = fields is None or 'friends' in fields
+    with_followers = fields is None or 'followers' in fields
+    if with_friends or with_followers:
+      userinfo_objects = fill_adjacency_from_edge_store(userinfo_objects, batch_size, with_friends, with_followers)
+  if chunk_size is None:
+    return userinfo_objects
+  return chunked(userinfo_objects, chunk_size)
+
+def document_to_userinfo_object(document, packed_adjacency=False):
+
+  '''
+  Converts a userinfo document from the database into a UserInfo object, filling the id buffers directly from the document's arrays or delta-varint binary.
+
+  Keyword Arguments:
+  ===
+  document -- the userinfo document, possibly with only some of its fields
+  packed_adjacency -- keep friends and followers stored as delta-varint binary encoded, as idcodec.PackedIds
+
+  return: the UserInfo object, with defaults for the fields missing from the document
+
+  '''
+
+  import idcodec
+  return classes.UserInfo(**{
+    USERINFO_DOCUMENT_FIELDS[field]: idcodec.PackedIds(value) if packed_adjacency and isinstance(value, bytes) else value
+    for field, value in document.items() if field in USERINFO_DOCUMENT_FIELDS
+  })
 
 #region Misc Data Helpers
 
 def generate_sample_userinfo(limit=20):
 
   '''
-  Generates sample UserInfo objects intended for testing purposes.
+  Generates sample UserInfo objects intended for testing purposes, with realistic descriptions and handles. Every pair of users is considered, so for more than a few thousand users use generate_power_law_userinfo.
 
   Keyword arguments:
   ===
@@ -156,6 +604,7 @@ def generate_sample_userinfo(limit=20):
   # 2. The relationships between the userids, randomly generate their friends and followers among others in the pool
   # 3. Create the userinfo objects and return them
 
+  fake = get_faker()
   user_pool = {}
   for i in range(limit):
     # Generate a 12 digit number and add it if it doesn't exist in the user_pool of ids
@@ -199,17 +648,125 @@ def generate_sample_userinfo(limit=20):
 
   return users
 
+def generate_power_law_graph(number_of_users, mean_friends=20, exponent=2.1, seed=0):
+
+  '''
+  Generates a follower graph grown by preferential attachment, so that it has Twitter's heavy-tailed degrees, vectorized so that millions of edges take seconds.
+
+  Accounts join one after the other, and each follows a heavy-tailed number of the accounts that joined before it. Each account it follows is either picked uniformly, or with probability 1 - 1 / (exponent - 1) copied from a uniformly picked earlier follow edge, so with probability proportional to the followers it already has: the earliest accounts keep gaining followers as the graph grows, and P(followers = k) ~ k ** -exponent (Price's model). Copies of copies are resolved by pointer jumping, in a number of passes logarithmic in the length of the copy chains, rather than by growing the graph one edge at a time.
+
+  Keyword Arguments:
+  ===
+  number_of_users -- the number of accounts
+  mean_friends -- the average number of follows drawn for each account, before the repeated ones are dropped (copies often land on the same popular accounts)
+  exponent -- the power law exponent of the follower counts, above 2; Twitter's is around 2
+  seed -- the random seed, the same seed always gives the same graph
+
+  return: (user_ids, source_indexes, destination_indexes) -- the int64 array of the accounts' 12 digit ids, in the order they joined, and the int64 arrays of the index in user_ids each edge starts from (the follower) and points to (the followed account), sorted by source, without duplicates or self loops
+
+  '''
+
+  import numpy as np # https://numpy.org/doc/stable/
+  import csrgraph
+  generator = np.random.default_rng(seed)
+  # Random increasing gaps keep the ids unique without drawing them against each other, and older accounts have smaller ids, as on Twitter
+  user_ids = 10 ** 11 + np.cumsum(generator.integers(1, 2 * (8 * 10 ** 11 // max(number_of_users, 1)), number_of_users, dtype=np.int64))
+  if number_of_users < 2:
+    return user_ids, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+  # Lognormal friend counts: most accounts follow a few dozen, some follow thousands, and no account follows more accounts than joined before it
+  friend_counts = np.minimum(generator.lognormal(np.log(max(mean_friends, 1)) - 0.5, 1.0, number_of_users).astype(np.int64), np.arange(number_of_users))
+  source_indexes = np.repeat(np.arange(number_of_users, dtype=np.int64), friend_counts)
+  # The edges of the accounts that joined before each edge's source
+  earlier_edges = np.concatenate(([0], np.cumsum(friend_counts)))[source_indexes]
+
+  copy_probability = min(1.0, 1 / (exponent - 1))
+  copies = (generator.random(len(source_indexes)) < copy_probability) & (earlier_edges > 0)
+  destination_indexes = np.where(copies, -1, (generator.random(len(source_indexes)) * source_indexes).astype(np.int64))
+  # Each copy points at an earlier edge, whose destination may be a copy too; every pass halves the chains left
+  pointers = np.where(copies, (generator.random(len(source_indexes)) * earlier_edges).astype(np.int64), np.arange(len(source_indexes)))
+  pending = np.flatnonzero(copies)
+  while len(pending):
+    copied = pointers[pending]
+    destination_indexes[pending] = destination_indexes[copied]
+    pointers[pending] = pointers[copied]
+    pending = pending[destination_indexes[pending] < 0]
+
+  edge_keys = csrgraph.sorted_unique(source_indexes * number_of_users + destination_indexes)
+  return user_ids, edge_keys // number_of_users, edge_keys % number_of_users
+
+def generate_power_law_userinfo(number_of_users, mean_friends=20, exponent=2.1, seed=0):
+
+  '''
+  Generates UserInfo objects whose friends and followers form a power law follower graph (see generate_power_law_graph), for tests and benchmarks at scale. Handles are derived from the ids, descriptions and tags are left empty.
+
+  Keyword Arguments:
+  ===
+  number_of_users -- the number of UserInfo objects to generate
+  mean_friends -- the average number of accounts each account follows
+  exponent -- the power law exponent of the follower counts
+  seed -- the random seed
+
+  return: the list of UserInfo objects generated
+
+  '''
+
+  import numpy as np # https://numpy.org/doc/stable/
+  import csrgraph
+  user_ids, source_indexes, destination_indexes = generate_power_law_graph(number_of_users, mean_friends, exponent, seed)
+  # The edges come sorted by source, so each user's friends are one slice; sorting by destination gives the followers
+  friends_indptr = csrgraph.indptr_from_sorted(source_indexes, number_of_users)
+  friend_ids = user_ids[destination_indexes]
+  by_destination = np.argsort(destination_indexes, kind='stable')
+  followers_indptr = csrgraph.indptr_from_sorted(destination_indexes[by_destination], number_of_users)
+  follower_ids = user_ids[source_indexes[by_destination]]
+
+  users = []
+  for user_index, user_id in enumerate(user_ids.tolist()):
+    friends = array('q')
+    friends.frombytes(friend_ids[friends_indptr[user_index]:friends_indptr[user_index + 1]].tobytes())
+    followers = array('q')
+    followers.frombytes(follower_ids[followers_indptr[user_index]:followers_indptr[user_index + 1]].tobytes())
+    users.append(classes.UserInfo(id=user_id, description='', handle='user' + str(user_id), friends=friends, followers=followers))
+  return users
+
 #endregion
 
 #region Helpers
 
+@functools.lru_cache(maxsize=None)
+def get_faker():
+  from faker import Faker # https://faker.readthedocs.io/en/stable/
+  from faker.providers import lorem
+
+  # Init faker module and add relevent providers to generate fake data
+  fake = Faker()
+  fake.add_provider(lorem)
+  return fake
+
+def add_write_counts(write_counts, more_write_counts):
+  for count_name, count in more_write_counts.items():
+    write_counts[count_name] += count
+
+def chunked(iterable, chunk_size):
+  # Group the items of iterable into lists of up to chunk_size items, without reading ahead any further
+  chunk = []
+  for item in iterable:
+    chunk.append(item)
+    if len(chunk) == chunk_size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
 # http://docs.tweepy.org/en/latest/code_snippet.html#handling-the-rate-limit-using-cursors
+# Waiting on rate limits is done by the scheduler, so this only has to end the iteration cleanly
 def limit_handled(cursor):
   while True:
     try:
       yield cursor.next()
-    except tweepy.RateLimitError:
-      time.sleep(15 * 60)
+    except StopIteration:
+      return
 
 #endregion
 